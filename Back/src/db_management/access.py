@@ -0,0 +1,83 @@
+from typing import List, Tuple, Union
+
+from models.users import UserModel
+from utility.logging import logger
+
+# Guest grants, a guest sees the granted contents and the contents of the granted albums that belong to the album owner.
+# Albums can hold other users' public contents, these stay visible only for as long as they are public,
+# so an album grant never shares more than the album owner could share themselves
+GRANT_TABLES = {
+    "content": ("nyapixguest_content_authorizations", "content_id"),
+    "album": ("nyapixguest_album_authorizations", "album_id"),
+}
+
+# Contents granted to one guest, the rule of get_allowed_contents inlined by content_db.visibility_clause
+GRANTED_CONTENTS = ("SELECT content_id FROM nyapixguest_content_authorizations WHERE guest_id = %s "
+                    "UNION ALL SELECT ac.content_id FROM nyapixguest_album_authorizations ga "
+                    "JOIN nyapixalbum a ON a.id = ga.album_id JOIN nyapixalbumcontent ac ON ac.album_id = ga.album_id "
+                    "JOIN nyapixcontent gc ON gc.id = ac.content_id AND gc.user_id = a.user_id WHERE ga.guest_id = %s")
+
+def get_allowed_contents(db) -> Union[Tuple[dict, set], None]:
+    """({guest_id: sorted granted content ids}, ids of the albums granted to anyone), with one query each"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT guest_id, array_agg(content_id ORDER BY content_id) FROM ("
+                       "SELECT guest_id, content_id FROM nyapixguest_content_authorizations "
+                       "UNION SELECT ga.guest_id, ac.content_id FROM nyapixguest_album_authorizations ga "
+                       "JOIN nyapixalbum a ON a.id = ga.album_id JOIN nyapixalbumcontent ac ON ac.album_id = ga.album_id "
+                       "JOIN nyapixcontent c ON c.id = ac.content_id AND c.user_id = a.user_id"
+                       ") granted GROUP BY guest_id")
+        allowed = dict(cursor.fetchall())
+        cursor.execute("SELECT DISTINCT album_id FROM nyapixguest_album_authorizations")
+        albums = set(row[0] for row in cursor.fetchall())
+        return allowed, albums
+    except Exception as e:
+        logger.error("Error getting guest authorizations")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
+
+def add_grant(db, kind: str, guest_id: int, target_id: int) -> bool:
+    table, column = GRANT_TABLES[kind]
+    cursor = db.cursor()
+    try:
+        cursor.execute(f"INSERT INTO {table} (guest_id, {column}) VALUES (%s, %s) ON CONFLICT DO NOTHING", (guest_id, target_id))
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error adding {kind} authorization")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def remove_grant(db, kind: str, guest_id: int, target_id: int) -> bool:
+    table, column = GRANT_TABLES[kind]
+    cursor = db.cursor()
+    try:
+        cursor.execute(f"DELETE FROM {table} WHERE guest_id = %s AND {column} = %s", (guest_id, target_id))
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error removing {kind} authorization")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def get_granted_guests(db, kind: str, target_id: int) -> Union[List[UserModel], None]:
+    table, column = GRANT_TABLES[kind]
+    cursor = db.cursor()
+    try:
+        cursor.execute(f"SELECT u.id, u.username, u.nickname, u.user_type FROM {table} g JOIN nyapixuser u ON u.id = g.guest_id "
+                       f"WHERE g.{column} = %s ORDER BY u.username", (target_id,))
+        return [UserModel(id=row[0], username=row[1], nickname=row[2], type=row[3]) for row in cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting {kind} authorizations")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
@@ -1,10 +1,14 @@
-from db_management.content import has_user_access, get_content, search_content
+from db_management.content import get_contents, prepare_search_filter, visibility_clause, get_miniature
 from db_management.users import get_user
 from models.content import AuthorModel, AuthorPageModel, AlbumPageModel
 from models.users import UserModel
 from utility.logging import logger
 from typing import List, Union
 import models.content as models
+from utility.query import Node
+from utility.media import generate_mosaic
+from utility.staging import StagingArea
+import utility.access as access
 
 def is_user_album(db, user_id: int, album_id: int) -> bool:
     cursor = db.cursor()
@@ -32,43 +36,96 @@ def is_content_in_album(db, album_id: int, content_id: int) -> bool:
         logger.error(e)
         return False
 
-def add_content_to_album(db, album_id: int, content_id: int) -> bool:
+def _insert_album_contents(cursor, album_id: int, content_ids: list[int], user_id: int) -> int:
+    """Append the contents the user can see to the album, in the given order, skipping those already in it"""
+    visibility, visibility_params = visibility_clause(user_id)
+    # Serializes concurrent appends to the same album so they don't compute the same positions
+    cursor.execute("SELECT id FROM nyapixalbum WHERE id = %s FOR UPDATE", (album_id,))
+    cursor.execute(f"WITH base AS (SELECT COALESCE(MAX(position) + 1, 0) AS next FROM nyapixalbumcontent WHERE album_id = %s), "
+                   f"wanted AS (SELECT content_id, MIN(n) AS n FROM unnest(%s::int[]) WITH ORDINALITY AS w(content_id, n) GROUP BY content_id) "
+                   f"INSERT INTO nyapixalbumcontent (album_id, content_id, position) "
+                   f"SELECT %s, c.id, base.next + ROW_NUMBER() OVER (ORDER BY w.n) - 1 FROM wanted w CROSS JOIN base JOIN nyapixcontent c ON c.id = w.content_id "
+                   f"WHERE {visibility} AND NOT EXISTS (SELECT 1 FROM nyapixalbumcontent ac WHERE ac.album_id = %s AND ac.content_id = c.id) "
+                   f"ON CONFLICT DO NOTHING",
+                   [album_id, list(content_ids), album_id] + visibility_params + [album_id])
+    return cursor.rowcount
+
+def add_contents_to_album(db, album_id: int, content_ids: list[int], user_id: int) -> int:
+    """Returns how many contents were added, -1 on error"""
     cursor = db.cursor()
     try:
-        if is_content_in_album(db, album_id, content_id):
-            return False
-        cursor.execute("INSERT INTO nyapixalbumcontent (album_id, content_id) VALUES (%s, %s)", (album_id, content_id))
+        added = _insert_album_contents(cursor, album_id, content_ids, user_id)
         db.commit()
-        return True
+        if added > 0:
+            access.invalidate_albums([album_id])
+        return added
     except Exception as e:
-        logger.error("Error adding content to album")
+        logger.error("Error adding contents to album")
         logger.error(e)
-        return False
+        db.rollback()
+        return -1
     finally:
         cursor.close()
 
-def remove_content_from_album(db, album_id: int, content_id: int) -> None:
+def remove_contents_from_album(db, album_id: int, content_ids: list[int]) -> int:
+    """Returns how many contents were removed, -1 on error"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("DELETE FROM nyapixalbumcontent WHERE album_id = %s AND content_id = ANY(%s)", (album_id, list(content_ids)))
+        removed = cursor.rowcount
+        db.commit()
+        if removed > 0:
+            access.invalidate_albums([album_id])
+        return removed
+    except Exception as e:
+        logger.error("Error removing contents from album")
+        logger.error(e)
+        db.rollback()
+        return -1
+    finally:
+        cursor.close()
+
+def reorder_album(db, album_id: int, content_ids: list[int]) -> int:
+    """Move the given contents to the front of the album in that order, the others keep their relative order after them.
+    Positions are compacted on the way, returns how many rows moved, -1 on error"""
     cursor = db.cursor()
     try:
-        if not is_content_in_album(db, album_id, content_id):
-            return
-        cursor.execute("DELETE FROM nyapixalbumcontent WHERE album_id = %s AND content_id = %s", (album_id, content_id))
+        cursor.execute("WITH wanted AS (SELECT content_id, MIN(n) AS n FROM unnest(%s::int[]) WITH ORDINALITY AS w(content_id, n) GROUP BY content_id), "
+                       "ordered AS (SELECT ac.content_id, ROW_NUMBER() OVER (ORDER BY w.n NULLS LAST, ac.position, ac.content_id) - 1 AS position "
+                       "FROM nyapixalbumcontent ac LEFT JOIN wanted w ON w.content_id = ac.content_id WHERE ac.album_id = %s) "
+                       "UPDATE nyapixalbumcontent ac SET position = ordered.position FROM ordered "
+                       "WHERE ac.album_id = %s AND ac.content_id = ordered.content_id AND ac.position <> ordered.position",
+                       (list(content_ids), album_id, album_id))
+        moved = cursor.rowcount
         db.commit()
+        return moved
     except Exception as e:
-        logger.error("Error removing content from album")
+        logger.error("Error reordering album")
         logger.error(e)
+        db.rollback()
+        return -1
     finally:
         cursor.close()
 
+def add_content_to_album(db, album_id: int, content_id: int, user_id: int) -> bool:
+    return add_contents_to_album(db, album_id, [content_id], user_id) > 0
+
+def remove_content_from_album(db, album_id: int, content_id: int) -> None:
+    remove_contents_from_album(db, album_id, [content_id])
+
 def add_album(db, user_id: int, info: models.AlbumPostModel) -> bool:
     cursor = db.cursor()
     try:
-        cursor.execute("INSERT INTO nyapixalbum (user_id, title, description) VALUES (%s, %s, %s)", (user_id, info.name, info.description))
+        cursor.execute("INSERT INTO nyapixalbum (user_id, title, description) VALUES (%s, %s, %s) RETURNING id", (user_id, info.name, info.description))
+        album_id = cursor.fetchone()[0]
+        if len(info.contents) > 0:
+            _insert_album_contents(cursor, album_id, info.contents, user_id)
         db.commit()
         return True
     except Exception as e:
         logger.error("Error adding album")
         logger.error(e)
+        db.rollback()
         return False
     finally:
         cursor.close()
@@ -94,6 +151,7 @@ def delete_album(db, album_id: int) -> bool:
     try:
         cursor.execute("DELETE FROM nyapixalbum WHERE id = %s", (album_id,))
         db.commit()
+        access.invalidate_albums([album_id])
         return True
     except Exception as e:
         logger.error("Error deleting album")
@@ -102,7 +160,9 @@ def delete_album(db, album_id: int) -> bool:
     finally:
         cursor.close()
 
-def get_album(db, user_id: int, album_id: int) -> Union[models.AlbumContentModel, None]:
+def get_album(db, user_id: int, album_id: int, page: int = 1, max_results: int = 50) -> Union[models.AlbumContentModel, None]:
+    """One page of an album, in its stored order. Access filtering happens in the page query and hydration is batched,
+    so the cost does not depend on the album size"""
     cursor = db.cursor()
     try:
         # Get album info
@@ -111,21 +171,23 @@ def get_album(db, user_id: int, album_id: int) -> Union[models.AlbumContentModel
         if result is None:
             return None
         info = models.AlbumModel(id=album_id, name=result[0], description=result[1])
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM nyapixuser_album_favorites WHERE user_id = %s AND album_id = %s)", (user_id, album_id))
+        info.is_favorite = cursor.fetchone()[0]
 
-        # get album content
-        cursor.execute("SELECT content_id FROM nyapixalbumcontent WHERE album_id = %s", (album_id,))
-        result = cursor.fetchall()
-
-        contents = [content_id[0] for content_id in result]
+        visibility, visibility_params = visibility_clause(user_id)
+        cursor.execute(f"SELECT COUNT(*) FROM nyapixalbumcontent ac JOIN nyapixcontent c ON c.id = ac.content_id WHERE ac.album_id = %s AND {visibility}",
+                       [album_id] + visibility_params)
+        total = cursor.fetchone()[0]
+        total_pages = (total + max_results - 1) // max_results
 
-        # Remove content user don't have access to
-        real_contents = []
-        for content_id in contents:
-            if has_user_access(db, content_id, user_id):
-                real_contents.append(content_id)
-        data = [get_content(db, content_id) for content_id in real_contents]
+        cursor.execute(f"SELECT c.id FROM nyapixalbumcontent ac JOIN nyapixcontent c ON c.id = ac.content_id WHERE ac.album_id = %s AND {visibility} "
+                       f"ORDER BY ac.position, ac.content_id LIMIT %s OFFSET %s",
+                       [album_id] + visibility_params + [max_results, (page - 1) * max_results])
+        data = get_contents(db, [row[0] for row in cursor.fetchall()], user_id)
+        if data is None:
+            return None
 
-        return models.AlbumContentModel(info=info, contents=data)
+        return models.AlbumContentModel(info=info, contents=data, total_pages=total_pages, total_contents=total)
     except Exception as e:
         logger.error("Error getting album")
         logger.error(e)
@@ -133,6 +195,22 @@ def get_album(db, user_id: int, album_id: int) -> Union[models.AlbumContentModel
     finally:
         cursor.close()
 
+def get_album_content_ids(db, user_id: int, album_id: int) -> List[int]:
+    """Every content of the album the user can see, in the album order"""
+    cursor = db.cursor()
+    try:
+        visibility, visibility_params = visibility_clause(user_id)
+        cursor.execute(f"SELECT c.id FROM nyapixalbumcontent ac JOIN nyapixcontent c ON c.id = ac.content_id WHERE ac.album_id = %s AND {visibility} "
+                       f"ORDER BY ac.position, ac.content_id",
+                       [album_id] + visibility_params)
+        return [row[0] for row in cursor.fetchall()]
+    except Exception as e:
+        logger.error("Error getting album content ids")
+        logger.error(e)
+        return []
+    finally:
+        cursor.close()
+
 def get_album_info(db, album_id: int) -> Union[models.AlbumModel, None]:
     cursor = db.cursor()
     try:
@@ -175,27 +253,150 @@ def get_content_linked_albums(db, content_id: int) -> List[int]:
         cursor.close()
 
 def search_album(db, needed_tags: list[int], needed_characters: list[int], needed_authors: list[int],
-                   tags_to_exclude: list[int], characters_to_exclude: list[int], authors_to_exclude: list[int], max_results: int, page: int, user_id: int) -> Union[AlbumPageModel, None]:
-    available_content = search_content(db, needed_tags, needed_characters, needed_authors, tags_to_exclude, characters_to_exclude, authors_to_exclude, max_results, page, user_id)
-    if available_content is None:
+                   tags_to_exclude: list[int], characters_to_exclude: list[int], authors_to_exclude: list[int], max_results: int, page: int, user_id: int,
+                   allowed_sources: list[int] = None, query: Node = None, media_types: list[str] = None) -> Union[AlbumPageModel, None]:
+    """Albums holding content that match the filters, ranked by how many of their contents match.
+    Matching, scoring, ordering and pagination all happen in a single query"""
+    cursor = db.cursor()
+    try:
+        if len(needed_tags) == 0 and len(needed_characters) == 0 and len(needed_authors) == 0 and not allowed_sources and not media_types and query is None:
+            return AlbumPageModel(albums=[], total_albums=0, total_pages=0)
+
+        where, params = prepare_search_filter(db, {"tags": needed_tags, "characters": needed_characters, "authors": needed_authors},
+                                              {"tags": tags_to_exclude, "characters": characters_to_exclude, "authors": authors_to_exclude},
+                                              user_id, allowed_sources, query, media_types)
+
+        cursor.execute(f"SELECT a.id, a.title, a.description, COUNT(*) AS score, COUNT(*) OVER () AS total "
+                       f"FROM nyapixalbum a JOIN nyapixalbumcontent ac ON ac.album_id = a.id JOIN nyapixcontent c ON c.id = ac.content_id "
+                       f"WHERE {where} GROUP BY a.id ORDER BY score DESC, a.id DESC LIMIT %s OFFSET %s",
+                       params + [max_results, (page - 1) * max_results])
+        result = cursor.fetchall()
+
+        albums = [models.AlbumModel(id=row[0], name=row[1], description=row[2], match_count=row[3], is_favorite=False) for row in result]
+        if len(albums) > 0:
+            cursor.execute("SELECT album_id FROM nyapixuser_album_favorites WHERE user_id = %s AND album_id = ANY(%s)", (user_id, [album.id for album in albums]))
+            favorites = set(row[0] for row in cursor.fetchall())
+            for album in albums:
+                album.is_favorite = album.id in favorites
+        if len(result) > 0:
+            total_results = result[0][4]
+        elif page > 1:
+            # Past the last page, the window count is not available
+            cursor.execute(f"SELECT COUNT(DISTINCT ac.album_id) FROM nyapixalbumcontent ac JOIN nyapixcontent c ON c.id = ac.content_id WHERE {where}", params)
+            total_results = cursor.fetchone()[0]
+        else:
+            total_results = 0
+        total_pages = (total_results + max_results - 1) // max_results
+
+        return AlbumPageModel(albums=albums, total_albums=total_results, total_pages=total_pages)
+    except Exception as e:
+        logger.error("Error searching albums")
+        logger.error(e)
         return None
+    finally:
+        cursor.close()
+
+# Covers are shared by everyone who can see the album, so they are only built from public contents
+ALBUM_COVER_LEADING_IDS = ("CASE WHEN EXISTS (SELECT 1 FROM nyapixcontent c WHERE c.id = a.cover_content_id AND NOT c.is_private) "
+                           "THEN ARRAY[a.cover_content_id] ELSE ARRAY("
+                           "SELECT ac.content_id FROM nyapixalbumcontent ac JOIN nyapixcontent c ON c.id = ac.content_id "
+                           "WHERE ac.album_id = a.id AND NOT c.is_private ORDER BY ac.position, ac.content_id LIMIT 4) END")
+
+def get_stale_album_covers(db, max_results: int, album_id: int = None) -> List[tuple]:
+    """(album_id, leading content ids) of albums whose cover is missing or was built from other contents"""
+    cursor = db.cursor()
+    try:
+        album_filter = "" if album_id is None else "WHERE a.id = %s"
+        cursor.execute(f"WITH leading AS (SELECT a.id AS album_id, {ALBUM_COVER_LEADING_IDS} AS ids FROM nyapixalbum a {album_filter}) "
+                       f"SELECT l.album_id, l.ids FROM leading l LEFT JOIN nyapixalbum_cover cv ON cv.album_id = l.album_id "
+                       f"WHERE cv.source_content_ids IS DISTINCT FROM l.ids AND NOT (cv.album_id IS NULL AND cardinality(l.ids) = 0) "
+                       f"LIMIT %s",
+                       ([] if album_id is None else [album_id]) + [max_results])
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+    except Exception as e:
+        logger.error("Error getting stale album covers")
+        logger.error(e)
+        return []
+    finally:
+        cursor.close()
+
+def save_album_cover(db, album_id: int, content_ids: list[int], data: Union[bytes, None]) -> bool:
+    """Store (or remove, if data is None) the cover built from `content_ids`"""
+    cursor = db.cursor()
+    try:
+        if data is None:
+            cursor.execute("DELETE FROM nyapixalbum_cover WHERE album_id = %s", (album_id,))
+        else:
+            cursor.execute("INSERT INTO nyapixalbum_cover (album_id, source_content_ids, data) VALUES (%s, %s, %s) "
+                           "ON CONFLICT (album_id) DO UPDATE SET source_content_ids = EXCLUDED.source_content_ids, data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP",
+                           (album_id, content_ids, data))
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error("Error saving album cover")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def get_album_cover(db, album_id: int) -> Union[bytes, None]:
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT data FROM nyapixalbum_cover WHERE album_id = %s", (album_id,))
+        result = cursor.fetchone()
+        if result is None:
+            return None
+        return bytes(result[0])
+    except Exception as e:
+        logger.error("Error getting album cover")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
+
+def set_album_cover_content(db, album_id: int, content_id: Union[int, None]) -> bool:
+    """Pick the content used as cover, None goes back to the automatic mosaic"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("UPDATE nyapixalbum SET cover_content_id = %s WHERE id = %s", (content_id, album_id))
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error("Error setting album cover")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def build_album_cover(db, content_ids: list[int]) -> bytes:
+    with StagingArea(prefix="cover-") as area:
+        paths = []
+        for content_id in content_ids:
+            miniature = get_miniature(db, content_id)
+            if miniature is None:
+                continue
+            path = area.path(f"{content_id}.png")
+            with open(path, "wb") as file:
+                file.write(miniature)
+            paths.append(path)
+        output_path = generate_mosaic(paths, area.path("cover.png"))
+        with open(output_path, "rb") as file:
+            return file.read()
 
-    content_id_dict = {}
-    for content in available_content.contents:
-        linked_albums = get_content_linked_albums(db, content.id)
-        for album_id in linked_albums:
-            if album_id not in content_id_dict.keys():
-                content_id_dict[album_id] = 0
-            content_id_dict[album_id] += 1
-
-    albums = []
-    for album_id in content_id_dict.keys():
-        album = get_album_info(db, album_id)
-        if album is not None:
-            albums.append(album)
-
-    total_results = len(albums)
-    total_pages = (total_results + max_results - 1) // max_results
-    albums = albums[(page - 1) * max_results:page * max_results]
-
-    return AlbumPageModel(albums=albums, total_albums=total_results, total_pages=total_pages)
+def refresh_album_covers(db, album_id: int = None, max_results: int = 50) -> int:
+    """Rebuild the covers whose leading contents changed, returns how many were refreshed"""
+    refreshed = 0
+    for stale_album_id, content_ids in get_stale_album_covers(db, max_results, album_id):
+        try:
+            data = build_album_cover(db, content_ids) if len(content_ids) > 0 else None
+        except Exception as e:
+            logger.error(f"Error building cover of album {stale_album_id}")
+            logger.error(e)
+            continue
+        if save_album_cover(db, stale_album_id, content_ids, data):
+            refreshed += 1
+    if refreshed > 0:
+        logger.info(f"Refreshed {refreshed} album covers")
+    return refreshed
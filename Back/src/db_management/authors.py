@@ -5,11 +5,11 @@ from typing import List, Union
 def search_authors(db, author_name: str, max_results: int) -> AuthorPageModel:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT author_name, id FROM nyapixauthor WHERE author_name LIKE %s ORDER BY author_name LIMIT %s", (f"%{author_name}%", max_results))
+        cursor.execute("SELECT author_name, id, usage_count FROM nyapixauthor WHERE author_name LIKE %s ORDER BY usage_count DESC, author_name LIMIT %s", (f"%{author_name}%", max_results))
         result = cursor.fetchall()
         authors = []
         for row in result:
-            authors.append(AuthorModel(name=row[0], id=row[1]))
+            authors.append(AuthorModel(name=row[0], id=row[1], usage_count=row[2]))
         return AuthorPageModel(authors=authors, total_authors=len(authors), total_pages=1)
     except Exception as e:
         logger.error("Error searching authors")
@@ -21,11 +21,11 @@ def search_authors(db, author_name: str, max_results: int) -> AuthorPageModel:
 def get_authors_page(db, page: int, size: int) -> AuthorPageModel:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT author_name, id FROM nyapixauthor ORDER BY author_name LIMIT %s OFFSET %s", (size, (page - 1) * size))
+        cursor.execute("SELECT author_name, id, usage_count FROM nyapixauthor ORDER BY author_name LIMIT %s OFFSET %s", (size, (page - 1) * size))
         result = cursor.fetchall()
         authors = []
         for row in result:
-            authors.append(AuthorModel(name=row[0], id=row[1]))
+            authors.append(AuthorModel(name=row[0], id=row[1], usage_count=row[2]))
         cursor.execute("SELECT COUNT(*) FROM nyapixauthor")
         total = cursor.fetchone()[0]
         total_pages = (total + size - 1) // size  # Corrected page count calculation
@@ -41,13 +41,13 @@ def get_author(db, author_id: Union[int, str]) -> Union[AuthorModel, None]:
     cursor = db.cursor()
     try:
         if type(author_id) == int:
-            cursor.execute("SELECT author_name FROM nyapixauthor WHERE id = %s", (author_id,))
+            cursor.execute("SELECT author_name, usage_count FROM nyapixauthor WHERE id = %s", (author_id,))
             result = cursor.fetchone()
-            return AuthorModel(name=result[0], id=author_id)
+            return AuthorModel(name=result[0], id=author_id, usage_count=result[1])
         elif type(author_id) == str:
-            cursor.execute("SELECT author_name, id FROM nyapixauthor WHERE author_name = %s", (author_id,))
+            cursor.execute("SELECT author_name, id, usage_count FROM nyapixauthor WHERE author_name = %s", (author_id,))
             result = cursor.fetchone()
-            return AuthorModel(name=result[0], id=result[1])
+            return AuthorModel(name=result[0], id=result[1], usage_count=result[2])
     except Exception as e:
         logger.error("Error getting author")
         logger.error(e)
@@ -97,11 +97,11 @@ def edit_author(db, author_id: int, name: str) -> bool:
 def get_author_by_name(db, author_name: str) -> Union[AuthorModel, None]:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT author_name, id FROM nyapixauthor WHERE author_name = %s", (author_name,))
+        cursor.execute("SELECT author_name, id, usage_count FROM nyapixauthor WHERE author_name = %s", (author_name,))
         result = cursor.fetchone()
         if result is None:
             return None
-        return AuthorModel(name=result[0], id=result[1])
+        return AuthorModel(name=result[0], id=result[1], usage_count=result[2])
     except Exception as e:
         logger.error("Error getting author")
         logger.error(e)
@@ -5,11 +5,11 @@ from typing import List, Union
 def search_characters(db, character_name: str, max_results: int) -> CharacterPageModel:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT character_name, id FROM nyapixcharacter WHERE character_name LIKE %s ORDER BY character_name LIMIT %s", (f"%{character_name}%", max_results))
+        cursor.execute("SELECT character_name, id, usage_count FROM nyapixcharacter WHERE character_name LIKE %s ORDER BY usage_count DESC, character_name LIMIT %s", (f"%{character_name}%", max_results))
         result = cursor.fetchall()
         characters = []
         for row in result:
-            characters.append(CharacterModel(name=row[0], id=row[1]))
+            characters.append(CharacterModel(name=row[0], id=row[1], usage_count=row[2]))
         return CharacterPageModel(characters=characters, total_characters=len(characters), total_pages=1)
     except Exception as e:
         logger.error("Error searching characters")
@@ -21,11 +21,11 @@ def search_characters(db, character_name: str, max_results: int) -> CharacterPag
 def get_characters_page(db, page: int, size: int) -> CharacterPageModel:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT character_name, id FROM nyapixcharacter ORDER BY character_name LIMIT %s OFFSET %s", (size, (page - 1) * size))
+        cursor.execute("SELECT character_name, id, usage_count FROM nyapixcharacter ORDER BY character_name LIMIT %s OFFSET %s", (size, (page - 1) * size))
         result = cursor.fetchall()
         characters = []
         for row in result:
-            characters.append(CharacterModel(name=row[0], id=row[1]))
+            characters.append(CharacterModel(name=row[0], id=row[1], usage_count=row[2]))
         cursor.execute("SELECT COUNT(*) FROM nyapixcharacter")
         total = cursor.fetchone()[0]
         total_pages = (total + size - 1) // size  # Corrected page count calculation
@@ -41,13 +41,13 @@ def get_character(db, character_id: Union[int, str]) -> Union[CharacterModel, No
     cursor = db.cursor()
     try:
         if type(character_id) == int:
-            cursor.execute("SELECT character_name FROM nyapixcharacter WHERE id = %s", (character_id,))
+            cursor.execute("SELECT character_name, usage_count FROM nyapixcharacter WHERE id = %s", (character_id,))
             result = cursor.fetchone()
-            return CharacterModel(name=result[0], id=character_id)
+            return CharacterModel(name=result[0], id=character_id, usage_count=result[1])
         elif type(character_id) == str:
-            cursor.execute("SELECT character_name, id FROM nyapixcharacter WHERE character_name = %s", (character_id,))
+            cursor.execute("SELECT character_name, id, usage_count FROM nyapixcharacter WHERE character_name = %s", (character_id,))
             result = cursor.fetchone()
-            return CharacterModel(name=result[0], id=result[1])
+            return CharacterModel(name=result[0], id=result[1], usage_count=result[2])
     except Exception as e:
         logger.error("Error getting character")
         logger.error(e)
@@ -97,11 +97,11 @@ def edit_character(db, character_id: int, name: str) -> bool:
 def get_character_by_name(db, character_name: str) -> Union[CharacterModel, None]:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT id FROM nyapixcharacter WHERE character_name = %s", (character_name,))
+        cursor.execute("SELECT id, usage_count FROM nyapixcharacter WHERE character_name = %s", (character_name,))
         result = cursor.fetchone()
         if result is None:
             return None
-        return CharacterModel(name=character_name, id=result[0])
+        return CharacterModel(name=character_name, id=result[0], usage_count=result[1])
     except Exception as e:
         logger.error("Error getting character by name")
         logger.error(e)
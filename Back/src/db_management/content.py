@@ -1,79 +1,170 @@
-from typing import Union
+import os
+from typing import Union, Tuple, Callable
 
+import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
+
+from db_management.access import GRANTED_CONTENTS
+import db_management.stream as stream_db
+import db_management.tags as tags_db
+from db_management.migrations import USAGE_COUNTS
 import models.content as models
-from models.content import ContentModel, ContentPageModel
+from models.content import ContentModel, ContentPageModel, ContentFacetsModel, FacetModel, ContentChangeSetModel
 from utility.logging import logger
-
-def add_content(db, content: models.ContentPostModel, file_hash: str, user_id: int) -> int:
+from utility.query import Node, Term, And, Not, query_terms
+import utility.access as access
+import utility.tag_closure as tag_closure
+
+def insert_content(cursor, content: models.ContentPostModel, file_hash: str, user_id: int) -> int:
+    """Insert the content row and its associations, in the caller's transaction. Returns the content id"""
+    cursor.execute("INSERT INTO nyapixcontent (title, description, source_id, original_file_hash, user_id, is_private) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
+                   (content.title, content.description, content.source_id, file_hash, user_id, content.is_private))
+    content_id = cursor.fetchone()[0]
+    for taxonomy, (table, column, _, _) in TAXONOMY_TABLES.items():
+        ids = sorted(set(getattr(content, taxonomy)))
+        if len(ids) > 0:
+            execute_values(cursor, f"INSERT INTO {table} (content_id, {column}) VALUES %s", [(content_id, item) for item in ids])
+    if len(content.tags) > 0:
+        tags_db.apply_implications(cursor, [content_id])
+    return content_id
+
+def ingest_content(db, content: models.ContentPostModel, file_hash: str, user_id: int, media_type: str, media_path: str,
+                   miniature_path: str = None) -> int:
+    """Store a whole upload as one unit of work: metadata, associations, media and miniature are committed together,
+    a failure leaves nothing behind. Returns the content id, -1 if the file was already uploaded, -2 on any other error"""
     cursor = db.cursor()
     try:
-        cursor.execute("INSERT INTO nyapixcontent (title, description, source_id, original_file_hash, user_id, is_private) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
-                          (content.title, content.description, content.source_id, file_hash, user_id, content.is_private))
-        content_id = cursor.fetchone()[0]
-        for tag_id in content.tags:
-            cursor.execute("INSERT INTO nyapixcontent_tag (content_id, tag_id) VALUES (%s, %s)", (content_id, tag_id))
-        for character_id in content.characters:
-            cursor.execute("INSERT INTO nyapixcontent_characters (content_id, character_id) VALUES (%s, %s)", (content_id, character_id))
-        for author_id in content.authors:
-            cursor.execute("INSERT INTO nyapixcontent_author (content_id, author_id) VALUES (%s, %s)", (content_id, author_id))
+        content_id = insert_content(cursor, content, file_hash, user_id)
+        stream_db.insert_media(cursor, content_id, media_type, media_path)
+        if miniature_path is not None:
+            insert_miniature(cursor, content_id, miniature_path)
         db.commit()
         return content_id
+    except psycopg2.errors.UniqueViolation:
+        db.rollback()
+        return -1
     except Exception as e:
-        logger.error("Error adding content")
+        logger.error("Error ingesting content")
         logger.error(e)
+        db.rollback()
+        return -2
+    finally:
+        cursor.close()
 
-        # Remove any leftover data
-        try:
-            cursor.execute("DELETE FROM nyapixcontent WHERE id = %s", (content_id,))
-        except Exception as e:
-            pass
-
-        try:
-            cursor.execute("DELETE FROM nyapixcontent_tag WHERE content_id = %s", (content_id,))
-        except:
-            pass
-
-        try:
-            cursor.execute("DELETE FROM nyapixcontent_characters WHERE content_id = %s", (content_id,))
-        except:
-            pass
-
-        try:
-            cursor.execute("DELETE FROM nyapixcontent_author WHERE content_id = %s", (content_id,))
-        except:
-            pass
-        db.commit()
-        return -1
+CONTENT_SCALAR_FIELDS = ("title", "description", "source_id", "is_private")
 
-def update_content(db, content_id: int, data: models.ContentUpdateModel) -> bool:
+def update_content(db, content_id: int, data: models.ContentUpdateModel) -> Union[ContentChangeSetModel, None]:
+    """Apply only what actually differs, in one transaction: a single UPDATE for the scalar fields and computed
+    inserts/deletes for the associations. Returns the effective change set, None on error"""
     cursor = db.cursor()
     try:
-        if data.title is not None:
-            cursor.execute("UPDATE nyapixcontent SET title = %s WHERE id = %s", (data.title, content_id))
-        if data.description is not None:
-            cursor.execute("UPDATE nyapixcontent SET description = %s WHERE id = %s", (data.description, content_id))
-        if data.source_id is not None:
-            cursor.execute("UPDATE nyapixcontent SET source_id = %s WHERE id = %s", (data.source_id, content_id))
-        if data.is_private is not None:
-            cursor.execute("UPDATE nyapixcontent SET is_private = %s WHERE id = %s", (data.is_private, content_id))
+        changes = ContentChangeSetModel(content_id=content_id)
+
+        cursor.execute(f"SELECT {', '.join(CONTENT_SCALAR_FIELDS)} FROM nyapixcontent WHERE id = %s FOR UPDATE", (content_id,))
+        current = cursor.fetchone()
+        if current is None:
+            return None
+
+        for field, value in zip(CONTENT_SCALAR_FIELDS, current):
+            wanted = getattr(data, field)
+            if wanted is not None and wanted != value:
+                changes.fields.append(field)
+        if len(changes.fields) > 0:
+            cursor.execute(f"UPDATE nyapixcontent SET {', '.join(f'{field} = %s' for field in changes.fields)} WHERE id = %s",
+                           [getattr(data, field) for field in changes.fields] + [content_id])
+
+        for taxonomy, (table, column, _, _) in TAXONOMY_TABLES.items():
+            wanted = getattr(data, taxonomy)
+            if wanted is None:
+                continue
+            cursor.execute(f"SELECT {column} FROM {table} WHERE content_id = %s", (content_id,))
+            existing = set(row[0] for row in cursor.fetchall())
+            to_add = sorted(set(wanted) - existing)
+            to_remove = sorted(existing - set(wanted))
+            if len(to_add) > 0:
+                execute_values(cursor, f"INSERT INTO {table} (content_id, {column}) VALUES %s", [(content_id, item) for item in to_add])
+            if len(to_remove) > 0:
+                cursor.execute(f"DELETE FROM {table} WHERE content_id = %s AND {column} = ANY(%s)", (content_id, to_remove))
+            setattr(changes, f"added_{taxonomy}", to_add)
+            setattr(changes, f"removed_{taxonomy}", to_remove)
+
         if data.tags is not None:
-            cursor.execute("DELETE FROM nyapixcontent_tag WHERE content_id = %s", (content_id,))
-            for tag_id in data.tags:
-                cursor.execute("INSERT INTO nyapixcontent_tag (content_id, tag_id) VALUES (%s, %s)", (content_id, tag_id))
-        if data.characters is not None:
-            cursor.execute("DELETE FROM nyapixcontent_characters WHERE content_id = %s", (content_id,))
-            for character_id in data.characters:
-                cursor.execute("INSERT INTO nyapixcontent_characters (content_id, character_id) VALUES (%s, %s)", (content_id, character_id))
-        if data.authors is not None:
-            cursor.execute("DELETE FROM nyapixcontent_author WHERE content_id = %s", (content_id,))
-            for author_id in data.authors:
-                cursor.execute("INSERT INTO nyapixcontent_author (content_id, author_id) VALUES (%s, %s)", (content_id, author_id))
+            # A removed tag that is implied by a kept one comes straight back
+            implied = set(tag_id for _, tag_id in tags_db.apply_implications(cursor, [content_id]))
+            changes.added_tags = sorted(set(changes.added_tags) | (implied - set(changes.removed_tags)))
+            changes.removed_tags = [tag_id for tag_id in changes.removed_tags if tag_id not in implied]
+
         db.commit()
-        return True
+        return changes
     except Exception as e:
         logger.error("Error updating content")
         logger.error(e)
-        return False
+        db.rollback()
+        return None
+    finally:
+        cursor.close()
+
+BULK_EDIT_BATCH_SIZE = 1000
+
+def get_owned_matching_content_ids(db, user_id: int, content_ids: list[int] = None, query: Node = None) -> list[int]:
+    """Ids of the user's own content among `content_ids`, or matching the query.
+    Filtered on ownership rather than visibility, only owned rows can ever be edited"""
+    cursor = db.cursor()
+    try:
+        if query is not None:
+            tag_closure.ensure_loaded(db)
+            clause, params = compile_query(query, resolve_query_names(db, query))
+            where, params = f"c.user_id = %s AND ({clause})", [user_id] + params
+        else:
+            where, params = "c.user_id = %s AND c.id = ANY(%s)", [user_id, list(content_ids or [])]
+        cursor.execute(f"SELECT c.id FROM nyapixcontent c WHERE {where} ORDER BY c.id", params)
+        return [row[0] for row in cursor.fetchall()]
+    except Exception as e:
+        logger.error("Error getting bulk edit targets")
+        logger.error(e)
+        return []
+    finally:
+        cursor.close()
+
+def bulk_edit_contents(db, content_ids: list[int], edit: models.ContentBulkEditModel, progress: Callable = None) -> int:
+    """Apply the same edit to every content with a handful of set-based statements per batch, all in one transaction.
+    `progress(processed, changed)` is called after every batch, returns how many rows changed, -1 on error"""
+    cursor = db.cursor()
+    try:
+        changed = 0
+        for start in range(0, len(content_ids), BULK_EDIT_BATCH_SIZE):
+            batch = content_ids[start:start + BULK_EDIT_BATCH_SIZE]
+            for taxonomy, (table, column, _, _) in TAXONOMY_TABLES.items():
+                to_add = list(set(getattr(edit, f"add_{taxonomy}")))
+                to_remove = list(set(getattr(edit, f"remove_{taxonomy}")))
+                if len(to_add) > 0:
+                    cursor.execute(f"INSERT INTO {table} (content_id, {column}) "
+                                   f"SELECT content_id, item FROM unnest(%s::int[]) AS content_id CROSS JOIN unnest(%s::int[]) AS item "
+                                   f"ON CONFLICT DO NOTHING",
+                                   (batch, to_add))
+                    changed += cursor.rowcount
+                if len(to_remove) > 0:
+                    cursor.execute(f"DELETE FROM {table} WHERE content_id = ANY(%s) AND {column} = ANY(%s)", (batch, to_remove))
+                    changed += cursor.rowcount
+            if edit.source_id is not None or edit.is_private is not None:
+                cursor.execute("UPDATE nyapixcontent SET source_id = COALESCE(%s, source_id), is_private = COALESCE(%s, is_private) "
+                               "WHERE id = ANY(%s) AND (source_id IS DISTINCT FROM COALESCE(%s, source_id) OR is_private IS DISTINCT FROM COALESCE(%s, is_private))",
+                               (edit.source_id, edit.is_private, batch, edit.source_id, edit.is_private))
+                changed += cursor.rowcount
+            if len(edit.add_tags) > 0 or len(edit.remove_tags) > 0:
+                changed += len(tags_db.apply_implications(cursor, batch))
+            if progress is not None:
+                progress(min(start + BULK_EDIT_BATCH_SIZE, len(content_ids)), changed)
+        db.commit()
+        return changed
+    except Exception as e:
+        logger.error("Error bulk editing content")
+        logger.error(e)
+        db.rollback()
+        return -1
+    finally:
+        cursor.close()
 
 def delete_content(db, content_id: int) -> bool:
     cursor = db.cursor()
@@ -86,10 +177,12 @@ def delete_content(db, content_id: int) -> bool:
         logger.error(e)
         return False
 
-def get_content(db, content_id: int) -> Union[ContentModel, None]:
+MEDIA_TYPES = ("video", "image", "audio")
+
+def get_content(db, content_id: int, user_id: int = None) -> Union[ContentModel, None]:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT title, description, source_id, is_private FROM nyapixcontent WHERE id = %s", (content_id,))
+        cursor.execute("SELECT title, description, source_id, is_private, media_type, media_id FROM nyapixcontent WHERE id = %s", (content_id,))
         result = cursor.fetchone()
 
         if result is None:
@@ -97,6 +190,9 @@ def get_content(db, content_id: int) -> Union[ContentModel, None]:
 
         to_return = ContentModel(title=result[0], description=result[1], is_private=result[3], tags=[], characters=[], authors=[], url="tmp", source=result[2], id=content_id)
 
+        if result[4] is not None:
+            to_return.url = f"v1/content/{result[4]}/{result[5]}"
+
         cursor.execute("SELECT tag_id FROM nyapixcontent_tag WHERE content_id = %s", (content_id,))
         result = cursor.fetchall()
         to_return.tags = [tag[0] for tag in result]
@@ -111,45 +207,118 @@ def get_content(db, content_id: int) -> Union[ContentModel, None]:
 
         to_return.authors = [author[0] for author in result]
 
-        # determine if content is video or image
-        cursor.execute("SELECT id FROM nyapixvideo WHERE content_id = %s", (content_id,))
-        result = cursor.fetchone()
+        if user_id is not None:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM nyapixuser_content_favorites WHERE user_id = %s AND content_id = %s)", (user_id, content_id))
+            to_return.is_favorite = cursor.fetchone()[0]
 
-        if result is not None:
-            to_return.url = f"v1/content/video/{result[0]}"
-
-        cursor.execute("SELECT id FROM nyapiximage WHERE content_id = %s", (content_id,))
-        result = cursor.fetchone()
+        return to_return
+    except Exception as e:
+        logger.error("Error getting content")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
 
-        if result is not None:
-            to_return.url = f"v1/content/image/{result[0]}"
+def get_contents(db, content_ids: list[int], user_id: int = None) -> Union[list[ContentModel], None]:
+    """Hydrate a whole page of content with one query per table, keeping the order of `content_ids`.
+    When `user_id` is given, is_favorite is set for that user. Returns None on error"""
+    cursor = db.cursor()
+    try:
+        if len(content_ids) == 0:
+            return []
+
+        cursor.execute("SELECT id, title, description, source_id, is_private, media_type, media_id FROM nyapixcontent WHERE id = ANY(%s)", (list(content_ids),))
+        contents = {}
+        for row in cursor.fetchall():
+            content = ContentModel(title=row[1], description=row[2], is_private=row[4], tags=[], characters=[], authors=[], url="tmp", source=row[3], id=row[0])
+            if row[5] is not None:
+                content.url = f"v1/content/{row[5]}/{row[6]}"
+            contents[row[0]] = content
+
+        for taxonomy, (table, column, _, _) in TAXONOMY_TABLES.items():
+            cursor.execute(f"SELECT content_id, {column} FROM {table} WHERE content_id = ANY(%s)", (list(contents.keys()),))
+            for row in cursor.fetchall():
+                getattr(contents[row[0]], taxonomy).append(row[1])
+
+        if user_id is not None:
+            cursor.execute("SELECT content_id FROM nyapixuser_content_favorites WHERE user_id = %s AND content_id = ANY(%s)", (user_id, list(contents.keys())))
+            favorites = set(row[0] for row in cursor.fetchall())
+            for content_id, content in contents.items():
+                content.is_favorite = content_id in favorites
+
+        return [contents[content_id] for content_id in content_ids if content_id in contents]
+    except Exception as e:
+        logger.error("Error getting contents")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
 
-        cursor.execute("SELECT id FROM nyapixaudio WHERE content_id = %s", (content_id,))
-        result = cursor.fetchone()
+def get_content_features(db, content_ids: list[int] = None) -> Union[dict, None]:
+    """Tag, character and author ids of the given contents (of every content when None), as {content_id: {taxonomy: [ids]}}.
+    Contents without any association are included with empty lists. Returns None on error"""
+    cursor = db.cursor()
+    try:
+        if content_ids is None:
+            cursor.execute("SELECT id FROM nyapixcontent")
+        else:
+            cursor.execute("SELECT id FROM nyapixcontent WHERE id = ANY(%s)", (list(content_ids),))
+        features = {row[0]: {taxonomy: [] for taxonomy in TAXONOMY_TABLES} for row in cursor.fetchall()}
+
+        for taxonomy, (table, column, _, _) in TAXONOMY_TABLES.items():
+            if content_ids is None:
+                cursor.execute(f"SELECT content_id, {column} FROM {table}")
+            else:
+                cursor.execute(f"SELECT content_id, {column} FROM {table} WHERE content_id = ANY(%s)", (list(features.keys()),))
+            for content_id, item in cursor.fetchall():
+                if content_id in features:
+                    features[content_id][taxonomy].append(item)
+        return features
+    except Exception as e:
+        logger.error("Error getting content features")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
 
-        if result is not None:
-            to_return.url = f"v1/content/audio/{result[0]}"
+def get_visible_content_ids(db, content_ids: list[int], user_id: int) -> list[int]:
+    """The given contents the user can see, in the given order"""
+    cursor = db.cursor()
+    try:
+        visibility, visibility_params = visibility_clause(user_id)
+        cursor.execute(f"SELECT c.id FROM nyapixcontent c WHERE c.id = ANY(%s) AND {visibility}", [list(content_ids)] + visibility_params)
+        visible = set(row[0] for row in cursor.fetchall())
+        return [content_id for content_id in content_ids if content_id in visible]
+    except Exception as e:
+        logger.error("Error filtering visible contents")
+        logger.error(e)
+        return []
+    finally:
+        cursor.close()
 
-        return to_return
+def get_contents_media(db, content_ids: list[int], user_id: int) -> list[Tuple[int, str, str, int, int, str]]:
+    """(content_id, title, media_type, media_id, media_size, media_mime) of the given contents the user can see, in the given order"""
+    cursor = db.cursor()
+    try:
+        visibility, visibility_params = visibility_clause(user_id)
+        cursor.execute(f"SELECT c.id, c.title, c.media_type, c.media_id, c.media_size, c.media_mime FROM nyapixcontent c "
+                       f"WHERE c.id = ANY(%s) AND c.media_type IS NOT NULL AND {visibility}",
+                       [list(content_ids)] + visibility_params)
+        media = {row[0]: row for row in cursor.fetchall()}
+        return [media[content_id] for content_id in dict.fromkeys(content_ids) if content_id in media]
     except Exception as e:
-        logger.error("Error getting content")
+        logger.error("Error getting contents media")
         logger.error(e)
-        return None
+        return []
     finally:
         cursor.close()
 
 def has_user_access(db, content_id: int, user_id: int) -> bool:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT user_id, is_private FROM nyapixcontent WHERE id = %s", (content_id,))
-        result = cursor.fetchone()
-        if result is None:
-            return False
-        if result[0] == user_id:
-            return True
-        if result[1]:
-            return False
-        return True
+        visibility, visibility_params = visibility_clause(user_id)
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM nyapixcontent c WHERE c.id = %s AND {visibility})", [content_id] + visibility_params)
+        return cursor.fetchone()[0]
     except Exception as e:
         logger.error("Error checking user access")
         logger.error(e)
@@ -157,97 +326,205 @@ def has_user_access(db, content_id: int, user_id: int) -> bool:
     finally:
         cursor.close()
 
-def get_content_user_id(db, content_id: int) -> Union[int, None]:
+def get_media_access(db, media_type: str, media_id: int, user_id: int) -> Union[Tuple[int, str], None]:
+    """Returns the content id and MIME type of a media if the user can access it, None otherwise.
+    Answered by a single lookup on the nyapixcontent media index"""
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT user_id FROM nyapixcontent WHERE id = %s", (content_id,))
+        visibility, params = visibility_clause(user_id)
+        cursor.execute(f"SELECT c.id, c.media_mime FROM nyapixcontent c WHERE c.media_type = %s AND c.media_id = %s AND {visibility}",
+                       [media_type, media_id] + params)
         result = cursor.fetchone()
         if result is None:
             return None
-        return result[0]
+        return result[0], result[1]
     except Exception as e:
-        logger.error("Error getting user id from content")
+        logger.error("Error checking media access")
         logger.error(e)
         return None
     finally:
         cursor.close()
 
-def is_user_content(db, content_id: int, user_id: int) -> bool:
+def get_media_content_id(db, media_type: str, media_id: int) -> Union[int, None]:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT user_id FROM nyapixcontent WHERE id = %s", (content_id,))
+        cursor.execute("SELECT id FROM nyapixcontent WHERE media_type = %s AND media_id = %s", (media_type, media_id))
         result = cursor.fetchone()
         if result is None:
-            return False
-        return result[0] == user_id
+            return None
+        return result[0]
     except Exception as e:
-        logger.error("Error checking user content")
+        logger.error(f"Error getting content id from {media_type}")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
+
+def refresh_popularity(db) -> bool:
+    """Recompute the precomputed popularity rank from favorites and access history, only touching rows that changed"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("WITH scores AS ("
+                       "SELECT c.id, COALESCE(f.favorites, 0) * 5 + COALESCE(h.viewers, 0) AS score FROM nyapixcontent c "
+                       "LEFT JOIN (SELECT content_id, COUNT(*) AS favorites FROM nyapixuser_content_favorites GROUP BY content_id) f ON f.content_id = c.id "
+                       "LEFT JOIN (SELECT content_id, COUNT(*) AS viewers FROM nyapixuser_content_history GROUP BY content_id) h ON h.content_id = c.id"
+                       ") UPDATE nyapixcontent c SET popularity = scores.score FROM scores WHERE scores.id = c.id AND c.popularity <> scores.score")
+        logger.info(f"Refreshed popularity of {cursor.rowcount} contents")
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error("Error refreshing popularity")
         logger.error(e)
+        db.rollback()
         return False
     finally:
         cursor.close()
 
-def get_video_content_id(db, video_id: int) -> Union[int, None]:
+def reconcile_usage_counts(db) -> bool:
+    """Fix the usage_count columns maintained by triggers should they ever drift (manual edits, a restored dump...).
+    A write racing with this may leave a slightly off count until the next run"""
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT content_id FROM nyapixvideo WHERE id = %s", (video_id,))
-        result = cursor.fetchone()
-        if result is None:
+        for counted, referencing, column in USAGE_COUNTS:
+            cursor.execute(f"UPDATE {counted} t SET usage_count = actual.count FROM ("
+                           f"SELECT c.id, COUNT(r.{column}) AS count FROM {counted} c LEFT JOIN {referencing} r ON r.{column} = c.id GROUP BY c.id"
+                           f") actual WHERE actual.id = t.id AND t.usage_count <> actual.count")
+            if cursor.rowcount > 0:
+                logger.info(f"Reconciled {cursor.rowcount} usage counts of {counted}")
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error("Error reconciling usage counts")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+# An access weighs half as much every TRENDING_HALF_LIFE_HOURS, only the TRENDING_SIZE best scores are kept
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "24"))
+TRENDING_SIZE = 1000
+# Accesses older than this many half-lives weigh less than 1% and are not even read
+TRENDING_WINDOW_HALF_LIVES = 7
+
+def refresh_trending(db) -> bool:
+    """Rebuild the trending ranking from access history. Each user who accessed a content adds 1 + ln(access_count),
+    decayed exponentially by the age of their last access, so a single user replaying a content can't make it trend"""
+    cursor = db.cursor()
+    try:
+        half_life = TRENDING_HALF_LIFE_HOURS * 3600
+        cursor.execute("DELETE FROM nyapixcontent_trending")
+        cursor.execute("INSERT INTO nyapixcontent_trending (content_id, score) "
+                       "SELECT content_id, SUM((1 + ln(access_count)) * exp(-ln(2) * extract(epoch FROM LOCALTIMESTAMP - accessed_at) / %s)) AS score "
+                       "FROM nyapixuser_content_history WHERE accessed_at > LOCALTIMESTAMP - make_interval(secs => %s) "
+                       "GROUP BY content_id ORDER BY score DESC LIMIT %s",
+                       (half_life, half_life * TRENDING_WINDOW_HALF_LIVES, TRENDING_SIZE))
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error("Error refreshing trending")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def get_trending_content(db, user_id: int, max_results: int, page: int) -> Union[ContentPageModel, None]:
+    """One page of the precomputed trending ranking, restricted to what the user can see"""
+    cursor = db.cursor()
+    try:
+        visibility, visibility_params = visibility_clause(user_id)
+        cursor.execute(f"SELECT t.content_id, COUNT(*) OVER () FROM nyapixcontent_trending t JOIN nyapixcontent c ON c.id = t.content_id "
+                       f"WHERE {visibility} ORDER BY t.score DESC, t.content_id DESC LIMIT %s OFFSET %s",
+                       visibility_params + [max_results, max_results * (page - 1)])
+        rows = cursor.fetchall()
+        total = rows[0][1] if len(rows) > 0 else 0
+        if len(rows) == 0 and page > 1:
+            cursor.execute(f"SELECT COUNT(*) FROM nyapixcontent_trending t JOIN nyapixcontent c ON c.id = t.content_id WHERE {visibility}", visibility_params)
+            total = cursor.fetchone()[0]
+        contents = get_contents(db, [row[0] for row in rows], user_id)
+        if contents is None:
             return None
-        return result[0]
+        return ContentPageModel(contents=contents, total_pages=(total + max_results - 1) // max_results, total_contents=total)
     except Exception as e:
-        logger.error("Error getting content id from video")
+        logger.error("Error getting trending content")
         logger.error(e)
         return None
     finally:
         cursor.close()
 
-def get_image_content_id(db, image_id: int) -> Union[int, None]:
+def get_content_user_id(db, content_id: int) -> Union[int, None]:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT content_id FROM nyapiximage WHERE id = %s", (image_id,))
+        cursor.execute("SELECT user_id FROM nyapixcontent WHERE id = %s", (content_id,))
         result = cursor.fetchone()
         if result is None:
             return None
         return result[0]
     except Exception as e:
-        logger.error("Error getting content id from image")
+        logger.error("Error getting user id from content")
         logger.error(e)
         return None
     finally:
         cursor.close()
 
-def get_audio_content_id(db, audio_id: int) -> Union[int, None]:
+def is_user_content(db, content_id: int, user_id: int) -> bool:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT content_id FROM nyapixaudio WHERE id = %s", (audio_id,))
+        cursor.execute("SELECT user_id FROM nyapixcontent WHERE id = %s", (content_id,))
         result = cursor.fetchone()
         if result is None:
-            return None
-        return result[0]
+            return False
+        return result[0] == user_id
     except Exception as e:
-        logger.error("Error getting content id from audio")
+        logger.error("Error checking user content")
         logger.error(e)
-        return None
+        return False
     finally:
         cursor.close()
 
-def get_user_content(db, user_id: int, max_results: int, page: int) -> Union[ContentPageModel, None]:
+def get_video_content_id(db, video_id: int) -> Union[int, None]:
+    return get_media_content_id(db, "video", video_id)
+
+def get_image_content_id(db, image_id: int) -> Union[int, None]:
+    return get_media_content_id(db, "image", image_id)
+
+def get_audio_content_id(db, audio_id: int) -> Union[int, None]:
+    return get_media_content_id(db, "audio", audio_id)
+
+# Every order is backed by an index (see migrations) or, for random, computed in the database from the seed,
+# so a page never requires fetching the whole match set. The trailing id keeps pagination stable on ties.
+SORT_ORDERS = {
+    "newest": "c.id DESC",
+    "oldest": "c.id ASC",
+    "title": "c.title ASC, c.id ASC",
+    "duration": "c.media_duration DESC NULLS LAST, c.id DESC",
+    "size": "c.media_size DESC NULLS LAST, c.id DESC",
+    "popularity": "c.popularity DESC, c.id DESC",
+    "random": "md5(c.id::text || %s), c.id",
+}
+
+def order_clause(sort: str, seed: int = None) -> Tuple[str, list]:
+    """ORDER BY clause (and its params) for one of SORT_ORDERS, the random order is stable for a given seed"""
+    if sort == "random":
+        return SORT_ORDERS[sort], [str(seed or 0)]
+    return SORT_ORDERS[sort], []
+
+def get_user_content(db, user_id: int, max_results: int, page: int, sort: str = "newest", seed: int = None) -> Union[ContentPageModel, None]:
     cursor = db.cursor()
     try:
         cursor.execute("SELECT COUNT(*) FROM nyapixcontent WHERE user_id = %s", (user_id,))
         total = cursor.fetchone()[0]
         total_pages = (total + max_results - 1) // max_results
 
-        contents = []
-        cursor.execute("SELECT id FROM nyapixcontent WHERE user_id = %s ORDER BY id DESC LIMIT %s OFFSET %s", (user_id, max_results, max_results * page))
-        result = cursor.fetchall()
-        for row in result:
-            content = get_content(db, row[0])
-            if content is not None:
-                contents.append(content)
+        order, order_params = order_clause(sort, seed)
+        cursor.execute(f"SELECT c.id FROM nyapixcontent c WHERE c.user_id = %s ORDER BY {order} LIMIT %s OFFSET %s",
+                       [user_id] + order_params + [max_results, max_results * page])
+        contents = get_contents(db, [row[0] for row in cursor.fetchall()], user_id)
+        if contents is None:
+            return None
 
-        return ContentPageModel(contents=contents, total_pages=total_pages, total_contents=total)
+        return ContentPageModel(contents=contents, total_pages=total_pages, total_contents=total, seed=seed)
     except Exception as e:
         logger.error("Error getting user content from db")
         logger.error(e)
@@ -294,184 +571,342 @@ def has_author(db, content_id: int, author_id: int) -> bool:
     finally:
         cursor.close()
 
-# content = content_db.search_content(db, title_regex, description_regex, needed_tags, needed_characters, needed_authors,
-#                                             tags_to_exclude, characters_to_exclude, authors_to_exclude, allowed_sources, max_results, page)
-def search_content(db, needed_tags: list[int], needed_characters: list[int], needed_authors: list[int],
-                   tags_to_exclude: list[int], characters_to_exclude: list[int], authors_to_exclude: list[int], max_results: int, page: int, user_id: int) -> Union[ContentPageModel, None]:
+TAXONOMY_TABLES = {
+    "tags": ("nyapixcontent_tag", "tag_id", "nyapixtag", "tag_name"),
+    "characters": ("nyapixcontent_characters", "character_id", "nyapixcharacter", "character_name"),
+    "authors": ("nyapixcontent_author", "author_id", "nyapixauthor", "author_name"),
+}
+
+REFERENCE_TABLES = {
+    "tags": "nyapixtag",
+    "characters": "nyapixcharacter",
+    "authors": "nyapixauthor",
+    "sources": "nyapixcontent_sources",
+}
+
+def get_taxonomy_names(db, taxonomy: str, ids: list[int]) -> dict:
+    """{id: name} of the given tags, characters or authors"""
+    _, _, name_table, name_column = TAXONOMY_TABLES[taxonomy]
     cursor = db.cursor()
     try:
-        logger.info("Searching using: tags: " + str(needed_tags) + " characters: " + str(needed_characters) + " authors: " + str(needed_authors) + " tags to avoid:" + str(tags_to_exclude) + " characters to exclude: " + str(characters_to_exclude) + " authors to exclude: " + str(authors_to_exclude))
-
-        first_search = "need_tags"
-        if len(needed_tags) == 0:
-            first_search = "need_characters"
-            if len(needed_characters) == 0:
-                first_search = "need_authors"
-                if len(needed_authors) == 0:
-                    return ContentPageModel(contents=[], total_pages=0, total_contents=0)
-
-        content_ids = []
-        if first_search == "need_tags":
-            # Get all content that have ALL needed tags
-            cursor.execute("SELECT content_id FROM nyapixcontent_tag WHERE tag_id = %s", (needed_tags[0],))
-            result = cursor.fetchall()
-            for row in result:
-                add_to_list = True
-                for tag_id in needed_tags[1:]:
-                    if not has_tag(db, row[0], tag_id):
-                        add_to_list = False
-                        break
-                if add_to_list:
-                    content_ids.append(row[0])
-        elif first_search == "need_characters":
-            # Get all content that have ALL needed characters
-            cursor.execute("SELECT content_id FROM nyapixcontent_characters WHERE character_id = %s", (needed_characters[0],))
-            result = cursor.fetchall()
-            for row in result:
-                add_to_list = True
-                for character_id in needed_characters[1:]:
-                    if not has_character(db, row[0], character_id):
-                        add_to_list = False
-                        break
-                if add_to_list:
-                    content_ids.append(row[0])
-        elif first_search == "need_authors":
-            # Get all content that have ALL needed authors
-            cursor.execute("SELECT content_id FROM nyapixcontent_author WHERE author_id = %s", (needed_authors[0],))
-            result = cursor.fetchall()
-            for row in result:
-                add_to_list = True
-                for author_id in needed_authors[1:]:
-                    if not has_author(db, row[0], author_id):
-                        add_to_list = False
-                        break
-                if add_to_list:
-                    content_ids.append(row[0])
-
-        after_forcing_tags = []
-        if len(needed_tags) > 0:
-            # Remove content that do not have all needed tags
-            for item in content_ids:
-                add_to_list = True
-                for tag_id in needed_tags:
-                    if not has_tag(db, item, tag_id):
-                        add_to_list = False
-                        break
-                if add_to_list:
-                    after_forcing_tags.append(item)
-        else:
-            after_forcing_tags = content_ids
-
-        logger.info("After forcing tags: " + str(after_forcing_tags))
-        after_forcing_characters = []
-        if len(needed_characters) > 0:
-            # Remove content that do not have all needed characters
-            for item in after_forcing_tags:
-                add_to_list = True
-                for character_id in needed_characters:
-                    if not has_character(db, item, character_id):
-                        add_to_list = False
-                        break
-                if add_to_list:
-                    after_forcing_characters.append(item)
-        else:
-            after_forcing_characters = after_forcing_tags
-
-        logger.info("After forcing characters: " + str(after_forcing_characters))
-        after_forcing_authors = []
-        if len(needed_authors) > 0:
-            # Remove content that do not have all needed authors
-            for item in after_forcing_characters:
-                add_to_list = True
-                for author_id in needed_authors:
-                    if not has_author(db, item, author_id):
-                        add_to_list = False
-                        break
-                if add_to_list:
-                    after_forcing_authors.append(item)
-        else:
-            after_forcing_authors = after_forcing_characters
-        logger.info("After forcing authors: " + str(after_forcing_authors))
-
-        logger.info("Got content ids: " + str(content_ids))
-        after_exclude_tags = []
-        if len(tags_to_exclude) > 0:
-            # Remove content that have any excluded tags
-            for item in after_forcing_authors:
-                add_to_list = True
-                for tag_id in tags_to_exclude:
-                    if has_tag(db, item, tag_id):
-                        add_to_list = False
-                        break
-                if add_to_list:
-                    after_exclude_tags.append(item)
-        else:
-            after_exclude_tags = content_ids
-
-        logger.info("After excluding tags: " + str(after_exclude_tags))
-        after_exclude_characters = []
-        if len(characters_to_exclude) > 0:
-            # Remove content that have any excluded characters
-            for item in after_exclude_tags:
-                add_to_list = True
-                for character_id in characters_to_exclude:
-                    if has_character(db, item, character_id):
-                        add_to_list = False
-                        break
-                if add_to_list:
-                    after_exclude_characters.append(item)
-        else:
-            after_exclude_characters = after_exclude_tags
-
-        logger.info("After excluding characters: " + str(after_exclude_characters))
-        after_exclude_authors = after_exclude_characters
-        if len(authors_to_exclude) > 0:
-            # Remove content that have any excluded authors
-            for item in after_exclude_characters:
-                add_to_list = True
-                for author_id in authors_to_exclude:
-                    if has_author(db, item, author_id):
-                        add_to_list = False
-                        break
-                if add_to_list:
-                    after_exclude_authors.append(item)
-        else:
-            after_exclude_authors = after_exclude_characters
-        logger.info("After excluding authors: " + str(after_exclude_authors))
-
-        # Remove content that user does not have access to
-        after_exclude_authors = [item for item in after_exclude_authors if has_user_access(db, item, user_id)]
-        logger.info("After excluding access: " + str(after_exclude_authors))
+        if len(ids) == 0:
+            return {}
+        cursor.execute(f"SELECT id, {name_column} FROM {name_table} WHERE id = ANY(%s)", (list(ids),))
+        return {row[0]: row[1] for row in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Error getting {taxonomy} names")
+        logger.error(e)
+        return {}
+    finally:
+        cursor.close()
 
-        final_list = [get_content(db, item) for item in after_exclude_authors]
+def get_missing_references(db, references: dict) -> Union[dict, None]:
+    """Check every referenced id in one round trip, `references` mapping a REFERENCE_TABLES key to a list of ids (None is skipped).
+    Returns the ids that do not exist, grouped by taxonomy, or None on error"""
+    cursor = db.cursor()
+    try:
+        queries, params = [], []
+        for taxonomy, ids in references.items():
+            if ids is None or len(ids) == 0:
+                continue
+            queries.append(f"SELECT %s, ref.id FROM unnest(%s::int[]) AS ref(id) "
+                           f"WHERE NOT EXISTS (SELECT 1 FROM {REFERENCE_TABLES[taxonomy]} t WHERE t.id = ref.id)")
+            params += [taxonomy, sorted(set(ids))]
+        if len(queries) == 0:
+            return {}
+
+        cursor.execute(" UNION ALL ".join(queries), params)
+        missing = {}
+        for taxonomy, missing_id in cursor.fetchall():
+            missing.setdefault(taxonomy, []).append(missing_id)
+        return missing
+    except Exception as e:
+        logger.error("Error checking content references")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
 
-        total = len(final_list)
-        total_pages = (total + max_results - 1) // max_results
+def merge_references(db, taxonomy: str, source_id: int, target_id: int) -> Union[list[int], None]:
+    """Move every use of `source_id` to `target_id` and delete the source, with set-based statements in one transaction.
+    Contents already having the target just lose the source. Returns the ids of the rewritten contents, None on error"""
+    cursor = db.cursor()
+    try:
+        if taxonomy == "sources":
+            cursor.execute("UPDATE nyapixcontent SET source_id = %s WHERE source_id = %s RETURNING id", (target_id, source_id))
+            content_ids = sorted(row[0] for row in cursor.fetchall())
+        else:
+            # INSERT + DELETE rather than UPDATE: conflicting primary keys are skipped and the usage count triggers see both sides
+            table, column, _, _ = TAXONOMY_TABLES[taxonomy]
+            cursor.execute(f"INSERT INTO {table} (content_id, {column}) SELECT content_id, %s FROM {table} WHERE {column} = %s ON CONFLICT DO NOTHING",
+                           (target_id, source_id))
+            cursor.execute(f"DELETE FROM {table} WHERE {column} = %s RETURNING content_id", (source_id,))
+            content_ids = sorted(row[0] for row in cursor.fetchall())
+
+        if taxonomy == "tags":
+            tags_db.merge_tag_relations(cursor, source_id, target_id)
+            if len(content_ids) > 0:
+                tags_db.apply_implications(cursor, content_ids)
+        cursor.execute(f"DELETE FROM {REFERENCE_TABLES[taxonomy]} WHERE id = %s", (source_id,))
+        db.commit()
+        return content_ids
+    except Exception as e:
+        logger.error(f"Error merging {taxonomy}")
+        logger.error(e)
+        db.rollback()
+        return None
+    finally:
+        cursor.close()
 
-        logger.info("Final list: " + str(final_list))
+def visibility_clause(user_id: int, alias: str = "c") -> Tuple[str, list]:
+    """SQL predicate (and its params) keeping only the content rows the user is allowed to see:
+    their own content, public content and content granted to them as a guest"""
+    allowed = access.get_allowed_contents(user_id)
+    if allowed is None:
+        return f"({alias}.user_id = %s OR NOT {alias}.is_private OR {alias}.id IN ({GRANTED_CONTENTS}))", [user_id, user_id, user_id]
+    if len(allowed) == 0:
+        return f"({alias}.user_id = %s OR NOT {alias}.is_private)", [user_id]
+    return f"({alias}.user_id = %s OR NOT {alias}.is_private OR {alias}.id = ANY(%s))", [user_id, allowed]
+
+def build_search_filter(needed: dict, excluded: dict, user_id: int, allowed_sources: list[int] = None, query: Tuple[str, list] = None,
+                        media_types: list[str] = None) -> Tuple[str, list]:
+    """Build the WHERE clause matching content that has ALL needed ids and NONE of the excluded ids, for each taxonomy.
+    `allowed_sources` and `media_types` restrict the source and media kind, `query` is an already compiled query language clause"""
+    clauses, params = [], []
+    visibility, visibility_params = visibility_clause(user_id)
+    clauses.append(visibility)
+    params += visibility_params
+
+    for taxonomy, ids in needed.items():
+        ids = list(set(ids))
+        if len(ids) == 0:
+            continue
+        clause, clause_params = _taxonomy_clause(taxonomy, ids, True)
+        clauses.append(clause)
+        params += clause_params
+
+    for taxonomy, ids in excluded.items():
+        ids = list(set(ids))
+        if len(ids) == 0:
+            continue
+        if taxonomy == "tags":
+            # Content having a tag implying an excluded one implicitly has it
+            ids = sorted(set(item for group in tag_closure.expand(ids).values() for item in group))
+        table, column, _, _ = TAXONOMY_TABLES[taxonomy]
+        clauses.append(f"NOT EXISTS (SELECT 1 FROM {table} x WHERE x.content_id = c.id AND x.{column} = ANY(%s))")
+        params.append(ids)
+
+    if allowed_sources is not None and len(allowed_sources) > 0:
+        clauses.append("c.source_id = ANY(%s)")
+        params.append(list(set(allowed_sources)))
+
+    if media_types is not None and len(media_types) > 0:
+        clauses.append("c.media_type = ANY(%s)")
+        params.append(list(set(media_types)))
+
+    if query is not None:
+        clauses.append(f"({query[0]})")
+        params += query[1]
+
+    return " AND ".join(clauses), params
+
+def _taxonomy_clause(taxonomy: str, ids: list[int], match_all: bool) -> Tuple[str, list]:
+    """Content having all (or any) of the given ids, answered from the association table alone"""
+    if taxonomy in ("sources", "media"):
+        column = "source_id" if taxonomy == "sources" else "media_type"
+        if not match_all:
+            return f"c.{column} = ANY(%s)", [ids]
+        if len(set(ids)) > 1:
+            return "FALSE", []
+        return f"c.{column} = %s", [ids[0]]
+    table, column, _, _ = TAXONOMY_TABLES[taxonomy]
+    if taxonomy == "tags":
+        # A tag is also matched by any tag implying it
+        groups = tag_closure.expand(list(set(ids)))
+        if not match_all:
+            return _association_clause(table, column, sorted(set(item for group in groups.values() for item in group)), False)
+        expanded = [group for group in groups.values() if len(group) > 1]
+        if len(expanded) > 0:
+            clauses, params = [], []
+            plain = [tag_id for tag_id, group in groups.items() if len(group) == 1]
+            if len(plain) > 0:
+                clause, params = _association_clause(table, column, plain, True)
+                clauses.append(clause)
+            for group in expanded:
+                clause, clause_params = _association_clause(table, column, group, False)
+                clauses.append(clause)
+                params += clause_params
+            return " AND ".join(clauses), params
+    return _association_clause(table, column, ids, match_all)
+
+def _association_clause(table: str, column: str, ids: list[int], match_all: bool) -> Tuple[str, list]:
+    if not match_all:
+        return f"c.id IN (SELECT content_id FROM {table} WHERE {column} = ANY(%s))", [ids]
+    if len(ids) == 1:
+        return f"c.id IN (SELECT content_id FROM {table} WHERE {column} = %s)", [ids[0]]
+    return f"c.id IN (SELECT content_id FROM {table} WHERE {column} = ANY(%s) GROUP BY content_id HAVING COUNT(*) = %s)", [ids, len(ids)]
+
+def resolve_query_names(db, node: Node) -> dict:
+    """Map every (field, value) term of a parsed query to its id, with one query per referenced field.
+    Tag aliases resolve to their canonical tag, unknown names are left out of the result"""
+    cursor = db.cursor()
+    try:
+        names = {}
+        for term in query_terms(node):
+            names.setdefault(term.field, set()).add(term.value)
+
+        resolved = {}
+        for field, values in names.items():
+            if field == "media":
+                for value in values:
+                    if value in MEDIA_TYPES:
+                        resolved[(field, value)] = value
+                continue
+            if field == "sources":
+                table, column = "nyapixcontent_sources", "name"
+            else:
+                _, _, table, column = TAXONOMY_TABLES[field]
+            cursor.execute(f"SELECT {column}, id FROM {table} WHERE {column} = ANY(%s)", (list(values),))
+            for row in cursor.fetchall():
+                resolved[(field, row[0])] = row[1]
+            if field == "tags":
+                for value in values:
+                    alias = tag_closure.resolve_alias(value)
+                    if alias is not None:
+                        resolved.setdefault((field, value), alias)
+        return resolved
+    finally:
+        cursor.close()
 
-        return ContentPageModel(contents=final_list[max_results * (page - 1):max_results * page], total_pages=total_pages, total_contents=total)
+def compile_query(node: Node, resolved: dict) -> Tuple[str, list]:
+    """Push a parsed query down to a SQL predicate on `nyapixcontent c`.
+    Sibling terms of the same field are merged so `a b c` or `a | b | c` costs a single association table probe"""
+    if isinstance(node, Term):
+        node = And([node])
+
+    if isinstance(node, Not):
+        clause, params = compile_query(node.child, resolved)
+        return f"NOT ({clause})", params
+
+    match_all = isinstance(node, And)
+    grouped = {}
+    others = []
+    for child in node.children:
+        if isinstance(child, Term):
+            grouped.setdefault(child.field, []).append(resolved.get((child.field, child.value)))
+        else:
+            others.append(child)
+
+    clauses, params = [], []
+    for field, ids in grouped.items():
+        known = list(set(item for item in ids if item is not None))
+        if match_all and len(known) != len(set(ids)):
+            # A required name that does not exist can't match anything
+            return "FALSE", []
+        if len(known) == 0:
+            continue
+        clause, clause_params = _taxonomy_clause(field, known, match_all)
+        clauses.append(clause)
+        params += clause_params
+
+    for child in others:
+        clause, clause_params = compile_query(child, resolved)
+        clauses.append(f"({clause})")
+        params += clause_params
+
+    if len(clauses) == 0:
+        return ("TRUE" if match_all else "FALSE"), []
+    if match_all:
+        return " AND ".join(clauses), params
+    # Parenthesized so the alternatives can never escape the predicates ANDed around them
+    return f"({' OR '.join(clauses)})", params
+
+def prepare_search_filter(db, needed: dict, excluded: dict, user_id: int, allowed_sources: list[int] = None, query: Node = None,
+                          media_types: list[str] = None) -> Tuple[str, list]:
+    """Resolve and compile the query, then build the complete search WHERE clause on `nyapixcontent c`"""
+    # Without the closure searches still work, only without alias and implication expansion
+    tag_closure.ensure_loaded(db)
+    compiled_query = None
+    if query is not None:
+        compiled_query = compile_query(query, resolve_query_names(db, query))
+    return build_search_filter(needed, excluded, user_id, allowed_sources, compiled_query, media_types)
+
+def get_search_facets(db, where: str, params: list, limit: int) -> Union[ContentFacetsModel, None]:
+    """Top `limit` tags, characters and authors of the whole matching set, computed in a single aggregate query.
+    Returns None if the query did not fit in the SEARCH_FACETS_TIMEOUT_MS budget."""
+    cursor = db.cursor()
+    try:
+        timeout = int(os.getenv("SEARCH_FACETS_TIMEOUT_MS", "250"))
+        cursor.execute("SET LOCAL statement_timeout = %s", (timeout,))
+
+        branches = []
+        for taxonomy, (table, column, names_table, name_column) in TAXONOMY_TABLES.items():
+            branches.append(f"SELECT '{taxonomy}' AS taxonomy, x.{column} AS id, n.{name_column} AS name, COUNT(*) AS hits "
+                            f"FROM {table} x JOIN {names_table} n ON n.id = x.{column} "
+                            f"WHERE x.content_id IN (SELECT id FROM matches) GROUP BY x.{column}, n.{name_column}")
+        cursor.execute(f"WITH matches AS (SELECT c.id FROM nyapixcontent c WHERE {where}) "
+                       f"SELECT taxonomy, id, name, hits FROM ("
+                       f"SELECT *, ROW_NUMBER() OVER (PARTITION BY taxonomy ORDER BY hits DESC, id) AS rank FROM ({' UNION ALL '.join(branches)}) counts"
+                       f") ranked WHERE rank <= %s ORDER BY taxonomy, rank",
+                       params + [limit])
+
+        facets = ContentFacetsModel(tags=[], characters=[], authors=[])
+        for row in cursor.fetchall():
+            getattr(facets, row[0]).append(FacetModel(id=row[1], name=row[2], count=row[3]))
+        return facets
+    except psycopg2.errors.QueryCanceled:
+        logger.warning("Search facets exceeded their time budget, skipping them")
+        return None
     except Exception as e:
-        logger.error("Error searching content in db")
+        logger.error("Error getting search facets")
         logger.error(e)
         return None
     finally:
+        # Ends the read-only transaction, dropping the local statement_timeout
+        db.rollback()
         cursor.close()
 
-def add_miniature(db, content_id: int, miniature_path: str) -> bool:
+def search_content(db, needed_tags: list[int], needed_characters: list[int], needed_authors: list[int],
+                   tags_to_exclude: list[int], characters_to_exclude: list[int], authors_to_exclude: list[int], max_results: int, page: int, user_id: int,
+                   facets_limit: int = 0, allowed_sources: list[int] = None, query: Node = None, media_types: list[str] = None,
+                   sort: str = "newest", seed: int = None) -> Union[ContentPageModel, None]:
     cursor = db.cursor()
     try:
-        with open(miniature_path, "rb") as file:
-            cursor.execute("INSERT INTO nyapixminiature (content_id, data) VALUES (%s, %s)", (content_id, file.read()))
-        db.commit()
-        return True
+        logger.info("Searching using: tags: " + str(needed_tags) + " characters: " + str(needed_characters) + " authors: " + str(needed_authors) + " tags to avoid:" + str(tags_to_exclude) + " characters to exclude: " + str(characters_to_exclude) + " authors to exclude: " + str(authors_to_exclude) + " sources: " + str(allowed_sources) + " media: " + str(media_types) + " query: " + str(query))
+
+        if len(needed_tags) == 0 and len(needed_characters) == 0 and len(needed_authors) == 0 and not allowed_sources and not media_types and query is None:
+            return ContentPageModel(contents=[], total_pages=0, total_contents=0)
+
+        where, params = prepare_search_filter(db, {"tags": needed_tags, "characters": needed_characters, "authors": needed_authors},
+                                              {"tags": tags_to_exclude, "characters": characters_to_exclude, "authors": authors_to_exclude},
+                                              user_id, allowed_sources, query, media_types)
+
+        cursor.execute(f"SELECT COUNT(*) FROM nyapixcontent c WHERE {where}", params)
+        total = cursor.fetchone()[0]
+        total_pages = (total + max_results - 1) // max_results
+
+        order, order_params = order_clause(sort, seed)
+        cursor.execute(f"SELECT c.id FROM nyapixcontent c WHERE {where} ORDER BY {order} LIMIT %s OFFSET %s",
+                       params + order_params + [max_results, max_results * (page - 1)])
+        contents = get_contents(db, [row[0] for row in cursor.fetchall()], user_id)
+        if contents is None:
+            return None
+
+        result = ContentPageModel(contents=contents, total_pages=total_pages, total_contents=total, seed=seed)
+        if facets_limit > 0:
+            result.facets = get_search_facets(db, where, params, facets_limit)
+        return result
     except Exception as e:
-        logger.error("Error adding miniature")
+        logger.error("Error searching content in db")
         logger.error(e)
-        return False
+        return None
     finally:
         cursor.close()
 
+def insert_miniature(cursor, content_id: int, miniature_path: str):
+    with open(miniature_path, "rb") as file:
+        cursor.execute("INSERT INTO nyapixminiature (content_id, data) VALUES (%s, %s)", (content_id, file.read()))
+
 def get_miniature(db, content_id: int) -> Union[bytes, None]:
     cursor = db.cursor()
     try:
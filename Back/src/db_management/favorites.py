@@ -0,0 +1,97 @@
+from datetime import datetime
+from typing import Tuple, Union
+
+from db_management.content import get_contents, visibility_clause
+from models.content import FavoriteContentPageModel, FavoriteAlbumPageModel, AlbumModel
+from utility.logging import logger
+
+FAVORITE_TABLES = {
+    "content": ("nyapixuser_content_favorites", "content_id"),
+    "album": ("nyapixuser_album_favorites", "album_id"),
+}
+
+def encode_cursor(created_at: datetime, target_id: int) -> str:
+    return f"{created_at.isoformat()}_{target_id}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Raises ValueError on a malformed cursor"""
+    created_at, _, target_id = cursor.rpartition("_")
+    return datetime.fromisoformat(created_at), int(target_id)
+
+def add_favorite(db, kind: str, user_id: int, target_id: int) -> bool:
+    table, column = FAVORITE_TABLES[kind]
+    cursor = db.cursor()
+    try:
+        cursor.execute(f"INSERT INTO {table} (user_id, {column}) VALUES (%s, %s) ON CONFLICT DO NOTHING", (user_id, target_id))
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error adding {kind} favorite")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def remove_favorite(db, kind: str, user_id: int, target_id: int) -> bool:
+    table, column = FAVORITE_TABLES[kind]
+    cursor = db.cursor()
+    try:
+        cursor.execute(f"DELETE FROM {table} WHERE user_id = %s AND {column} = %s", (user_id, target_id))
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error removing {kind} favorite")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def _keyset_clause(after: Union[str, None], column: str) -> Tuple[str, list]:
+    if after is None:
+        return "", []
+    created_at, target_id = decode_cursor(after)
+    return f"AND (f.created_at, f.{column}) < (%s, %s) ", [created_at, target_id]
+
+def get_favorite_contents(db, user_id: int, max_results: int, after: str = None) -> Union[FavoriteContentPageModel, None]:
+    """Most recent favorites first, `after` being the next_cursor of the previous page.
+    Contents that became private since they were favorited are skipped"""
+    keyset, keyset_params = _keyset_clause(after, "content_id")
+    cursor = db.cursor()
+    try:
+        visibility, visibility_params = visibility_clause(user_id)
+        cursor.execute(f"SELECT f.content_id, f.created_at FROM nyapixuser_content_favorites f JOIN nyapixcontent c ON c.id = f.content_id "
+                       f"WHERE f.user_id = %s {keyset}AND {visibility} ORDER BY f.created_at DESC, f.content_id DESC LIMIT %s",
+                       [user_id] + keyset_params + visibility_params + [max_results + 1])
+        rows = cursor.fetchall()
+        next_cursor = encode_cursor(rows[max_results - 1][1], rows[max_results - 1][0]) if len(rows) > max_results else None
+        contents = get_contents(db, [row[0] for row in rows[:max_results]], user_id)
+        if contents is None:
+            return None
+        return FavoriteContentPageModel(contents=contents, next_cursor=next_cursor)
+    except Exception as e:
+        logger.error("Error getting favorite contents")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
+
+def get_favorite_albums(db, user_id: int, max_results: int, after: str = None) -> Union[FavoriteAlbumPageModel, None]:
+    """Most recent favorites first, `after` being the next_cursor of the previous page"""
+    keyset, keyset_params = _keyset_clause(after, "album_id")
+    cursor = db.cursor()
+    try:
+        cursor.execute(f"SELECT a.id, a.title, a.description, f.created_at FROM nyapixuser_album_favorites f JOIN nyapixalbum a ON a.id = f.album_id "
+                       f"WHERE f.user_id = %s {keyset}ORDER BY f.created_at DESC, f.album_id DESC LIMIT %s",
+                       [user_id] + keyset_params + [max_results + 1])
+        rows = cursor.fetchall()
+        next_cursor = encode_cursor(rows[max_results - 1][3], rows[max_results - 1][0]) if len(rows) > max_results else None
+        albums = [AlbumModel(id=row[0], name=row[1], description=row[2], is_favorite=True) for row in rows[:max_results]]
+        return FavoriteAlbumPageModel(albums=albums, next_cursor=next_cursor)
+    except Exception as e:
+        logger.error("Error getting favorite albums")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
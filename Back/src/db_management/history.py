@@ -0,0 +1,64 @@
+from typing import Union
+
+from psycopg2.extras import execute_values
+
+from utility.logging import logger
+
+ACCESS_VIEW = 1
+ACCESS_DOWNLOAD = 2
+ACCESS_EDIT = 3
+
+# A favorite says more about a user's taste than a view
+FAVORITE_WEIGHT = 3.0
+
+HISTORY_TABLES = {
+    "content": ("nyapixuser_content_history", "content_id", "nyapixcontent"),
+    "album": ("nyapixuser_album_history", "album_id", "nyapixalbum"),
+}
+
+def save_history(db, kind: str, rows: list) -> bool:
+    """Upsert a batch of (user_id, target_id, accessed_at, access_type, access_count) rows in one statement.
+    Rows whose user or target was deleted in the meantime are skipped instead of failing the batch"""
+    table, column, target_table = HISTORY_TABLES[kind]
+    cursor = db.cursor()
+    try:
+        execute_values(cursor,
+                       f"INSERT INTO {table} (user_id, {column}, accessed_at, access_type, access_count) "
+                       f"SELECT v.user_id, v.target_id, v.accessed_at, v.access_type, v.access_count "
+                       f"FROM (VALUES %s) AS v(user_id, target_id, accessed_at, access_type, access_count) "
+                       f"JOIN {target_table} t ON t.id = v.target_id "
+                       f"JOIN nyapixuser u ON u.id = v.user_id "
+                       f"ON CONFLICT (user_id, {column}) DO UPDATE SET "
+                       f"accessed_at = GREATEST({table}.accessed_at, EXCLUDED.accessed_at), "
+                       f"access_type = EXCLUDED.access_type, "
+                       f"access_count = {table}.access_count + EXCLUDED.access_count",
+                       rows, template="(%s::int, %s::int, %s::timestamptz, %s::int, %s::int)", page_size=1000)
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error saving {kind} history")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def get_user_interactions(db, user_id: int, half_life_days: float, max_history: int = 500) -> Union[dict, None]:
+    """{content_id: weight} of what the user liked or viewed. A favorite weighs FAVORITE_WEIGHT, a viewed content
+    1 + ln(access_count) halved every `half_life_days` since its last access. Only the `max_history` most recent
+    accesses are read. Returns None on error"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT content_id, SUM(weight) FROM ("
+                       "SELECT content_id, %s::float AS weight FROM nyapixuser_content_favorites WHERE user_id = %s "
+                       "UNION ALL (SELECT content_id, (1 + ln(access_count)) * exp(-ln(2) * extract(epoch FROM LOCALTIMESTAMP - accessed_at) / %s) "
+                       "FROM nyapixuser_content_history WHERE user_id = %s ORDER BY accessed_at DESC LIMIT %s)"
+                       ") interactions GROUP BY content_id",
+                       (FAVORITE_WEIGHT, user_id, half_life_days * 86400, user_id, max_history))
+        return {row[0]: row[1] for row in cursor.fetchall()}
+    except Exception as e:
+        logger.error("Error getting user interactions")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
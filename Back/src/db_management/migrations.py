@@ -0,0 +1,340 @@
+from utility.logging import logger
+
+# (counted table, referencing table, referencing column) of every usage_count column, also used by content_db.reconcile_usage_counts
+USAGE_COUNTS = [
+    ("nyapixtag", "nyapixcontent_tag", "tag_id"),
+    ("nyapixcharacter", "nyapixcontent_characters", "character_id"),
+    ("nyapixauthor", "nyapixcontent_author", "author_id"),
+    ("nyapixcontent_sources", "nyapixcontent", "source_id"),
+]
+
+# Statement level triggers: a bulk write updates each counter once, with the net delta of the whole statement.
+# TG_ARGV is (counted table, referencing column), UPDATE is only hooked on nyapixcontent for source changes.
+USAGE_COUNT_FUNCTION = """CREATE OR REPLACE FUNCTION nyapix_count_usage() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        EXECUTE format('UPDATE %1$I t SET usage_count = t.usage_count + d.delta FROM '
+                       '(SELECT %2$I AS id, COUNT(*) AS delta FROM new_rows WHERE %2$I IS NOT NULL GROUP BY 1) d WHERE t.id = d.id',
+                       TG_ARGV[0], TG_ARGV[1]);
+    ELSIF TG_OP = 'DELETE' THEN
+        EXECUTE format('UPDATE %1$I t SET usage_count = t.usage_count - d.delta FROM '
+                       '(SELECT %2$I AS id, COUNT(*) AS delta FROM old_rows WHERE %2$I IS NOT NULL GROUP BY 1) d WHERE t.id = d.id',
+                       TG_ARGV[0], TG_ARGV[1]);
+    ELSE
+        EXECUTE format('UPDATE %1$I t SET usage_count = t.usage_count + d.delta FROM (SELECT id, SUM(delta) AS delta FROM ('
+                       'SELECT n.%2$I AS id, 1 AS delta FROM new_rows n JOIN old_rows o ON o.id = n.id WHERE n.%2$I IS DISTINCT FROM o.%2$I '
+                       'UNION ALL SELECT o.%2$I, -1 FROM new_rows n JOIN old_rows o ON o.id = n.id WHERE n.%2$I IS DISTINCT FROM o.%2$I'
+                       ') changes WHERE id IS NOT NULL GROUP BY id) d WHERE t.id = d.id',
+                       TG_ARGV[0], TG_ARGV[1]);
+    END IF;
+    RETURN NULL;
+END
+$$"""
+
+def _usage_count_statements() -> list:
+    statements = [USAGE_COUNT_FUNCTION]
+    for counted, referencing, column in USAGE_COUNTS:
+        statements.append(f"ALTER TABLE {counted} ADD COLUMN IF NOT EXISTS usage_count INT NOT NULL DEFAULT 0")
+        events = [("insert", "INSERT", "NEW TABLE AS new_rows"), ("delete", "DELETE", "OLD TABLE AS old_rows")]
+        if referencing == "nyapixcontent":
+            events.append(("update", "UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"))
+        for suffix, event, transition in events:
+            statements.append(f"DROP TRIGGER IF EXISTS {referencing}_{column}_count_{suffix} ON {referencing}")
+            statements.append(f"CREATE TRIGGER {referencing}_{column}_count_{suffix} AFTER {event} ON {referencing} "
+                              f"REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION nyapix_count_usage('{counted}', '{column}')")
+        statements.append(f"UPDATE {counted} t SET usage_count = (SELECT COUNT(*) FROM {referencing} r WHERE r.{column} = t.id)")
+    return statements
+
+# DB/schema.sql is only run by postgres on the very first startup, every later schema change lives here.
+# Migrations are applied in order at backend startup and recorded in nyapixschema_migrations.
+# A migration either lists plain `statements` (run in one transaction) or `indexes` to build
+# CONCURRENTLY, which postgres refuses to do inside a transaction block.
+MIGRATIONS = [
+    {
+        "version": 1,
+        "name": "lookup indexes",
+        "indexes": [
+            ("nyapixcontent_tag_tag_id_idx", "nyapixcontent_tag (tag_id)"),
+            ("nyapixcontent_characters_character_id_idx", "nyapixcontent_characters (character_id)"),
+            ("nyapixcontent_author_author_id_idx", "nyapixcontent_author (author_id)"),
+            ("nyapixcontent_user_id_id_idx", "nyapixcontent (user_id, id)"),
+            ("nyapixvideo_content_id_idx", "nyapixvideo (content_id)"),
+            ("nyapiximage_content_id_idx", "nyapiximage (content_id)"),
+            ("nyapixaudio_content_id_idx", "nyapixaudio (content_id)"),
+            ("nyapixuser_session_user_id_idx", "nyapixuser_session (user_id)"),
+            ("nyapixalbumcontent_content_id_idx", "nyapixalbumcontent (content_id)"),
+        ],
+    },
+    {
+        "version": 2,
+        "name": "album content primary key",
+        # album_id was a SERIAL primary key, so an album could only ever hold one content
+        "statements": [
+            "ALTER TABLE nyapixalbumcontent ALTER COLUMN album_id DROP DEFAULT",
+            "ALTER TABLE nyapixalbumcontent DROP CONSTRAINT IF EXISTS nyapixalbumcontent_pkey",
+            "DROP SEQUENCE IF EXISTS nyapixalbumcontent_album_id_seq",
+            "ALTER TABLE nyapixalbumcontent ADD PRIMARY KEY (album_id, content_id)",
+        ],
+    },
+    {
+        "version": 3,
+        "name": "denormalized content media",
+        # Lets hydration and media access checks work from the content row alone
+        "statements": [
+            "ALTER TABLE nyapixcontent ADD COLUMN IF NOT EXISTS media_type TEXT CHECK (media_type IN ('video', 'image', 'audio'))",
+            "ALTER TABLE nyapixcontent ADD COLUMN IF NOT EXISTS media_id INT",
+            "ALTER TABLE nyapixcontent ADD COLUMN IF NOT EXISTS media_size BIGINT",
+            "ALTER TABLE nyapixcontent ADD COLUMN IF NOT EXISTS media_mime TEXT",
+            # Same precedence as the old lookups: audio over image over video
+            "UPDATE nyapixcontent c SET media_type = 'video', media_id = m.id, media_size = octet_length(m.data), media_mime = 'video/mp4' FROM nyapixvideo m WHERE m.content_id = c.id",
+            "UPDATE nyapixcontent c SET media_type = 'image', media_id = m.id, media_size = octet_length(m.data), media_mime = 'image/png' FROM nyapiximage m WHERE m.content_id = c.id",
+            "UPDATE nyapixcontent c SET media_type = 'audio', media_id = m.id, media_size = octet_length(m.data), media_mime = 'audio/wav' FROM nyapixaudio m WHERE m.content_id = c.id",
+        ],
+    },
+    {
+        "version": 4,
+        "name": "content media index",
+        "indexes": [
+            ("nyapixcontent_media_idx", "nyapixcontent (media_type, media_id)"),
+        ],
+    },
+    {
+        "version": 5,
+        "name": "content sort keys",
+        "statements": [
+            "ALTER TABLE nyapixcontent ADD COLUMN IF NOT EXISTS media_duration REAL",
+            # Precomputed rank, refreshed by the popularity background job
+            "ALTER TABLE nyapixcontent ADD COLUMN IF NOT EXISTS popularity INT NOT NULL DEFAULT 0",
+        ],
+    },
+    {
+        "version": 6,
+        "name": "content sort indexes",
+        # Match the ORDER BY clauses of content_db.SORT_ORDERS so LIMIT can stop early
+        "indexes": [
+            ("nyapixcontent_title_idx", "nyapixcontent (title, id)"),
+            ("nyapixcontent_duration_idx", "nyapixcontent (media_duration DESC NULLS LAST, id DESC)"),
+            ("nyapixcontent_size_idx", "nyapixcontent (media_size DESC NULLS LAST, id DESC)"),
+            ("nyapixcontent_popularity_idx", "nyapixcontent (popularity DESC, id DESC)"),
+        ],
+    },
+    {
+        "version": 7,
+        "name": "album content position",
+        "statements": [
+            "ALTER TABLE nyapixalbumcontent ADD COLUMN IF NOT EXISTS position INT",
+            "UPDATE nyapixalbumcontent ac SET position = ordered.position FROM ("
+            "SELECT album_id, content_id, ROW_NUMBER() OVER (PARTITION BY album_id ORDER BY content_id) - 1 AS position FROM nyapixalbumcontent"
+            ") ordered WHERE ordered.album_id = ac.album_id AND ordered.content_id = ac.content_id",
+            "ALTER TABLE nyapixalbumcontent ALTER COLUMN position SET DEFAULT 0",
+            "ALTER TABLE nyapixalbumcontent ALTER COLUMN position SET NOT NULL",
+        ],
+    },
+    {
+        "version": 8,
+        "name": "album content position index",
+        "indexes": [
+            ("nyapixalbumcontent_position_idx", "nyapixalbumcontent (album_id, position, content_id)"),
+        ],
+    },
+    {
+        "version": 9,
+        "name": "uncompressed media storage",
+        # Media are already compressed, storing them EXTERNAL lets substring() read a slice without detoasting the whole blob.
+        # Only applies to rows written from now on.
+        "statements": [
+            "ALTER TABLE nyapixvideo ALTER COLUMN data SET STORAGE EXTERNAL",
+            "ALTER TABLE nyapiximage ALTER COLUMN data SET STORAGE EXTERNAL",
+            "ALTER TABLE nyapixaudio ALTER COLUMN data SET STORAGE EXTERNAL",
+        ],
+    },
+    {
+        "version": 10,
+        "name": "album covers",
+        "statements": [
+            "ALTER TABLE nyapixalbum ADD COLUMN IF NOT EXISTS cover_content_id INT REFERENCES nyapixcontent(id) ON DELETE SET NULL",
+            # source_content_ids are the contents the cover was built from, the cover is stale once they change
+            "CREATE TABLE IF NOT EXISTS nyapixalbum_cover ("
+            "album_id INT PRIMARY KEY REFERENCES nyapixalbum(id) ON DELETE CASCADE, "
+            "source_content_ids INT[] NOT NULL, "
+            "data BYTEA NOT NULL, "
+            "updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+        ],
+    },
+    {
+        "version": 11,
+        "name": "history access counts",
+        # History keeps one row per user and target, the count tells repeated accesses apart from a single one
+        "statements": [
+            "ALTER TABLE nyapixuser_content_history ADD COLUMN IF NOT EXISTS access_count INT NOT NULL DEFAULT 1",
+            "ALTER TABLE nyapixuser_album_history ADD COLUMN IF NOT EXISTS access_count INT NOT NULL DEFAULT 1",
+        ],
+    },
+    {
+        "version": 12,
+        "name": "favorites timestamps",
+        "statements": [
+            "ALTER TABLE nyapixuser_content_favorites ADD COLUMN IF NOT EXISTS created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP",
+            "ALTER TABLE nyapixuser_album_favorites ADD COLUMN IF NOT EXISTS created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP",
+        ],
+    },
+    {
+        "version": 13,
+        "name": "favorites listing indexes",
+        # Match the keyset order of favorites_db so a page is a single index range scan
+        "indexes": [
+            ("nyapixuser_content_favorites_listing_idx", "nyapixuser_content_favorites (user_id, created_at DESC, content_id DESC)"),
+            ("nyapixuser_album_favorites_listing_idx", "nyapixuser_album_favorites (user_id, created_at DESC, album_id DESC)"),
+        ],
+    },
+    {
+        "version": 14,
+        "name": "trending ranking",
+        # Top of the time-decayed access ranking, rebuilt by the trending background job
+        "statements": [
+            "CREATE TABLE IF NOT EXISTS nyapixcontent_trending ("
+            "content_id INT PRIMARY KEY REFERENCES nyapixcontent(id) ON DELETE CASCADE, "
+            "score REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS nyapixcontent_trending_score_idx ON nyapixcontent_trending (score DESC, content_id DESC)",
+        ],
+    },
+    {
+        "version": 15,
+        "name": "history recency index",
+        "indexes": [
+            ("nyapixuser_content_history_accessed_at_idx", "nyapixuser_content_history (accessed_at)"),
+        ],
+    },
+    {
+        "version": 16,
+        "name": "usage counts",
+        "statements": _usage_count_statements(),
+    },
+    {
+        "version": 17,
+        "name": "tag aliases and implications",
+        # nyapixtag_closure is the transitive closure of nyapixtag_implication, rebuilt by tags_db whenever an implication changes
+        "statements": [
+            "CREATE TABLE IF NOT EXISTS nyapixtag_alias ("
+            "alias_name TEXT PRIMARY KEY, "
+            "tag_id INT NOT NULL REFERENCES nyapixtag(id) ON DELETE CASCADE)",
+            "CREATE INDEX IF NOT EXISTS nyapixtag_alias_tag_id_idx ON nyapixtag_alias (tag_id)",
+            "CREATE TABLE IF NOT EXISTS nyapixtag_implication ("
+            "tag_id INT NOT NULL REFERENCES nyapixtag(id) ON DELETE CASCADE, "
+            "implied_tag_id INT NOT NULL REFERENCES nyapixtag(id) ON DELETE CASCADE, "
+            "PRIMARY KEY (tag_id, implied_tag_id), "
+            "CHECK (tag_id <> implied_tag_id))",
+            "CREATE TABLE IF NOT EXISTS nyapixtag_closure ("
+            "tag_id INT NOT NULL REFERENCES nyapixtag(id) ON DELETE CASCADE, "
+            "implied_tag_id INT NOT NULL REFERENCES nyapixtag(id) ON DELETE CASCADE, "
+            "PRIMARY KEY (tag_id, implied_tag_id))",
+            "CREATE INDEX IF NOT EXISTS nyapixtag_closure_implied_tag_id_idx ON nyapixtag_closure (implied_tag_id)",
+        ],
+    },
+    {
+        "version": 18,
+        "name": "unique guest authorizations",
+        # One grant per guest and target, so granting is idempotent and the visibility subqueries are index lookups
+        "statements": [
+            "DELETE FROM nyapixguest_content_authorizations a USING nyapixguest_content_authorizations b "
+            "WHERE a.guest_id = b.guest_id AND a.content_id = b.content_id AND a.id > b.id",
+            "CREATE UNIQUE INDEX IF NOT EXISTS nyapixguest_content_authorizations_guest_content_idx ON nyapixguest_content_authorizations (guest_id, content_id)",
+            "DELETE FROM nyapixguest_album_authorizations a USING nyapixguest_album_authorizations b "
+            "WHERE a.guest_id = b.guest_id AND a.album_id = b.album_id AND a.id > b.id",
+            "CREATE UNIQUE INDEX IF NOT EXISTS nyapixguest_album_authorizations_guest_album_idx ON nyapixguest_album_authorizations (guest_id, album_id)",
+        ],
+    },
+    {
+        "version": 19,
+        "name": "orphan contents",
+        # Contents whose media never got stored, left behind by uploads that predate single-transaction ingestion
+        "statements": [
+            "DELETE FROM nyapixcontent c WHERE c.media_type IS NULL "
+            "AND NOT EXISTS (SELECT 1 FROM nyapixvideo m WHERE m.content_id = c.id) "
+            "AND NOT EXISTS (SELECT 1 FROM nyapiximage m WHERE m.content_id = c.id) "
+            "AND NOT EXISTS (SELECT 1 FROM nyapixaudio m WHERE m.content_id = c.id)",
+        ],
+    },
+]
+
+# Arbitrary key used to make sure only one backend instance migrates at a time
+MIGRATIONS_LOCK_ID = 7_061_227
+
+def get_applied_versions(db) -> set:
+    cursor = db.cursor()
+    try:
+        cursor.execute("CREATE TABLE IF NOT EXISTS nyapixschema_migrations ("
+                       "version INT PRIMARY KEY, "
+                       "name TEXT NOT NULL, "
+                       "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+        cursor.execute("SELECT version FROM nyapixschema_migrations")
+        versions = set(row[0] for row in cursor.fetchall())
+        db.commit()
+        return versions
+    finally:
+        cursor.close()
+
+def _build_index_concurrently(db, name: str, definition: str):
+    cursor = db.cursor()
+    try:
+        # An interrupted CONCURRENTLY build leaves an invalid index behind that IF NOT EXISTS would keep
+        cursor.execute("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s", (name,))
+        result = cursor.fetchone()
+        if result is not None and result[0]:
+            return
+        if result is not None:
+            logger.info(f"Dropping invalid index {name}")
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        logger.info(f"Building index {name}")
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+    finally:
+        cursor.close()
+
+def apply_migration(db, migration: dict):
+    cursor = db.cursor()
+    try:
+        if "indexes" in migration:
+            db.autocommit = True
+            try:
+                for name, definition in migration["indexes"]:
+                    _build_index_concurrently(db, name, definition)
+            finally:
+                db.autocommit = False
+        for statement in migration.get("statements", []):
+            cursor.execute(statement)
+        cursor.execute("INSERT INTO nyapixschema_migrations (version, name) VALUES (%s, %s)", (migration["version"], migration["name"]))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def run_migrations(db) -> bool:
+    """Apply every pending migration, returns True if the schema is up to date, False otherwise"""
+    cursor = db.cursor()
+    locked = False
+    try:
+        db.autocommit = True
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+        locked = True
+        db.autocommit = False
+
+        applied = get_applied_versions(db)
+        for migration in sorted(MIGRATIONS, key=lambda item: item["version"]):
+            if migration["version"] in applied:
+                continue
+            logger.info(f"Applying migration {migration['version']}: {migration['name']}")
+            apply_migration(db, migration)
+        return True
+    except Exception as e:
+        logger.error("Error running migrations")
+        logger.error(e)
+        return False
+    finally:
+        if locked:
+            db.rollback()
+            db.autocommit = True
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+            db.autocommit = False
+        cursor.close()
@@ -5,11 +5,11 @@ from typing import List, Union
 def list_sources(db) -> List[SourceModel]:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT name, id FROM nyapixcontent_sources")
+        cursor.execute("SELECT name, id, usage_count FROM nyapixcontent_sources")
         result = cursor.fetchall()
         sources = []
         for row in result:
-            sources.append(SourceModel(name=row[0], id=row[1]))
+            sources.append(SourceModel(name=row[0], id=row[1], usage_count=row[2]))
         return sources
     except Exception as e:
         logger.error("Error listing sources")
@@ -22,13 +22,13 @@ def get_source(db, source: Union[int, str]) -> Union[SourceModel, None]:
     cursor = db.cursor()
     try:
         if type(source) == str:
-            cursor.execute("SELECT name, id FROM nyapixcontent_sources WHERE name = %s", (source,))
+            cursor.execute("SELECT name, id, usage_count FROM nyapixcontent_sources WHERE name = %s", (source,))
             result = cursor.fetchone()
-            return SourceModel(name=result[0], id=result[1])
+            return SourceModel(name=result[0], id=result[1], usage_count=result[2])
         elif type(source) == int:
-            cursor.execute("SELECT name, id FROM nyapixcontent_sources WHERE id = %s", (source,))
+            cursor.execute("SELECT name, id, usage_count FROM nyapixcontent_sources WHERE id = %s", (source,))
             result = cursor.fetchone()
-            return SourceModel(name=result[0], id=result[1])
+            return SourceModel(name=result[0], id=result[1], usage_count=result[2])
         else:
             return None
     except Exception as e:
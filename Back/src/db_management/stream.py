@@ -7,18 +7,58 @@ import bcrypt
 import models.users as users_models
 from utility.media import get_video_length
 
-def add_video(db, content_id: int, file_path) -> bool:
-    cursor = db.cursor()
+MEDIA_TABLES = {
+    "video": "nyapixvideo",
+    "image": "nyapiximage",
+    "audio": "nyapixaudio",
+}
+
+MEDIA_CHUNK_SIZE = 1024 * 1024
+
+MEDIA_MIME_TYPES = {
+    "video": "video/mp4",
+    "image": "image/png",
+    "audio": "audio/wav",
+}
+
+def link_media(cursor, content_id: int, media_type: str, media_id: int, media_size: int, media_duration: float = None):
+    """Store the media reference on the content row, in the caller's transaction"""
+    cursor.execute("UPDATE nyapixcontent SET media_type = %s, media_id = %s, media_size = %s, media_mime = %s, media_duration = %s WHERE id = %s",
+                   (media_type, media_id, media_size, MEDIA_MIME_TYPES[media_type], media_duration, content_id))
+
+def get_media_duration(file_path: str) -> Union[float, None]:
     try:
-        with open(file_path, "rb") as file:
-            data = file.read()
-            cursor.execute("INSERT INTO nyapixvideo (content_id, data) VALUES (%s, %s)", (content_id, data))
-        db.commit()
-        return True
+        return get_video_length(file_path)
     except Exception as e:
-        logger.error("Error adding video")
+        logger.error("Error getting media duration")
         logger.error(e)
-        return False
+        return None
+
+def insert_media(cursor, content_id: int, media_type: str, file_path: str) -> int:
+    """Store the media file and link it to the content, in the caller's transaction. Returns the media id"""
+    with open(file_path, "rb") as file:
+        data = file.read()
+    cursor.execute(f"INSERT INTO {MEDIA_TABLES[media_type]} (content_id, data) VALUES (%s, %s) RETURNING id", (content_id, data))
+    media_id = cursor.fetchone()[0]
+    media_duration = get_media_duration(file_path) if media_type in ("video", "audio") else None
+    link_media(cursor, content_id, media_type, media_id, len(data), media_duration)
+    return media_id
+
+def iter_media_chunks(db, media_type: str, media_id: int, chunk_size: int = MEDIA_CHUNK_SIZE):
+    """Yield a stored media slice by slice instead of loading the whole blob"""
+    cursor = db.cursor()
+    try:
+        offset = 1
+        while True:
+            cursor.execute(f"SELECT substring(data FROM %s FOR %s) FROM {MEDIA_TABLES[media_type]} WHERE id = %s", (offset, chunk_size, media_id))
+            result = cursor.fetchone()
+            if result is None or len(result[0]) == 0:
+                return
+            chunk = bytes(result[0])
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            offset += chunk_size
     finally:
         cursor.close()
 
@@ -130,33 +170,3 @@ def get_audio(db, content_id: int) -> Union[bytes, None]:
 #         return None
 #     finally:
 #         cursor.close()
-
-def add_image(db, content_id: int, file_path: str) -> bool:
-    cursor = db.cursor()
-    try:
-        with open(file_path, "rb") as file:
-            data = file.read()
-            cursor.execute("INSERT INTO nyapiximage (content_id, data) VALUES (%s, %s)", (content_id, data))
-        db.commit()
-        return True
-    except Exception as e:
-        logger.error("Error adding image")
-        logger.error(e)
-        return False
-    finally:
-        cursor.close()
-
-def add_audio(db, content_id: int, file_path: str) -> bool:
-    cursor = db.cursor()
-    try:
-        with open(file_path, "rb") as file:
-            data = file.read()
-            cursor.execute("INSERT INTO nyapixaudio (content_id, data) VALUES (%s, %s)", (content_id, data))
-        db.commit()
-        return True
-    except Exception as e:
-        logger.error("Error adding audio")
-        logger.error(e)
-        return False
-    finally:
-        cursor.close()
@@ -1,15 +1,15 @@
-from models.content import SourceModel, TagModel, TagPageModel
+from models.content import SourceModel, TagModel, TagPageModel, TagRelationsModel
 from utility.logging import logger
-from typing import List, Union
+from typing import List, Union, Tuple
 
 def list_tags(db) -> List[TagModel]:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT tag_name, id FROM nyapixtag")
+        cursor.execute("SELECT tag_name, id, usage_count FROM nyapixtag")
         result = cursor.fetchall()
         tags = []
         for row in result:
-            tags.append(TagModel(name=row[0], id=row[1]))
+            tags.append(TagModel(name=row[0], id=row[1], usage_count=row[2]))
         return tags
     except Exception as e:
         logger.error("Error listing sources")
@@ -21,11 +21,11 @@ def list_tags(db) -> List[TagModel]:
 def get_tags_page(db, page: int, size: int) -> TagPageModel:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT tag_name, id FROM nyapixtag ORDER BY tag_name LIMIT %s OFFSET %s", (size, (page - 1) * size))
+        cursor.execute("SELECT tag_name, id, usage_count FROM nyapixtag ORDER BY tag_name LIMIT %s OFFSET %s", (size, (page - 1) * size))
         result = cursor.fetchall()
         tags = []
         for row in result:
-            tags.append(TagModel(name=row[0], id=row[1]))
+            tags.append(TagModel(name=row[0], id=row[1], usage_count=row[2]))
         cursor.execute("SELECT COUNT(*) FROM nyapixtag")
         total = cursor.fetchone()[0]
         total_pages = (total + size - 1) // size  # Corrected page count calculation
@@ -41,13 +41,13 @@ def get_tag(db, source: Union[int, str]) -> Union[TagModel, None]:
     cursor = db.cursor()
     try:
         if type(source) == str:
-            cursor.execute("SELECT tag_name, id FROM nyapixtag WHERE tag_name = %s", (source,))
+            cursor.execute("SELECT tag_name, id, usage_count FROM nyapixtag WHERE tag_name = %s", (source,))
             result = cursor.fetchone()
-            return TagModel(name=result[0], id=result[1])
+            return TagModel(name=result[0], id=result[1], usage_count=result[2])
         elif type(source) == int:
-            cursor.execute("SELECT tag_name, id FROM nyapixtag WHERE id = %s", (source,))
+            cursor.execute("SELECT tag_name, id, usage_count FROM nyapixtag WHERE id = %s", (source,))
             result = cursor.fetchone()
-            return TagModel(name=result[0], id=result[1])
+            return TagModel(name=result[0], id=result[1], usage_count=result[2])
         else:
             return None
     except Exception as e:
@@ -72,6 +72,8 @@ def delete_tag(db, tag_id: int) -> bool:
     cursor = db.cursor()
     try:
         cursor.execute("DELETE FROM nyapixtag WHERE id = %s", (tag_id,))
+        # Implications going through the deleted tag no longer hold
+        rebuild_closure(cursor)
         db.commit()
         return True
     except Exception as e:
@@ -110,11 +112,11 @@ def chek_is_user_tag(db, user_id, tag_id) -> bool:
 def get_user_tags(db, user_id) -> List[TagModel]:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT tag_name, id FROM nyapixtag WHERE user_id = %s", (user_id,))
+        cursor.execute("SELECT tag_name, id, usage_count FROM nyapixtag WHERE user_id = %s", (user_id,))
         result = cursor.fetchall()
         tags = []
         for row in result:
-            tags.append(TagModel(name=row[0], id=row[1]))
+            tags.append(TagModel(name=row[0], id=row[1], usage_count=row[2]))
         return tags
     except Exception as e:
         logger.error("Error getting user tags")
@@ -126,11 +128,11 @@ def get_user_tags(db, user_id) -> List[TagModel]:
 def search_tags(db, query, max_results) -> TagPageModel:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT tag_name, id FROM nyapixtag WHERE tag_name LIKE %s LIMIT %s", (f"%{query}%", max_results))
+        cursor.execute("SELECT tag_name, id, usage_count FROM nyapixtag WHERE tag_name LIKE %s ORDER BY usage_count DESC, tag_name LIMIT %s", (f"%{query}%", max_results))
         result = cursor.fetchall()
         tags = []
         for row in result:
-            tags.append(TagModel(name=row[0], id=row[1]))
+            tags.append(TagModel(name=row[0], id=row[1], usage_count=row[2]))
         return TagPageModel(tags=tags, total_pages=1, total_tags=len(tags))
     except Exception as e:
         logger.error("Error searching tags")
@@ -142,14 +144,173 @@ def search_tags(db, query, max_results) -> TagPageModel:
 def get_tag_by_name(db, tag_name) -> Union[TagModel, None]:
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT tag_name, id FROM nyapixtag WHERE tag_name = %s", (tag_name,))
+        # An alias resolves to its canonical tag
+        cursor.execute("SELECT tag_name, id, usage_count FROM nyapixtag WHERE tag_name = %s "
+                       "UNION ALL SELECT t.tag_name, t.id, t.usage_count FROM nyapixtag_alias a JOIN nyapixtag t ON t.id = a.tag_id WHERE a.alias_name = %s "
+                       "LIMIT 1", (tag_name, tag_name))
         result = cursor.fetchone()
         if result is None:
             return None
-        return TagModel(name=result[0], id=result[1])
+        return TagModel(name=result[0], id=result[1], usage_count=result[2])
     except Exception as e:
         logger.error("Error getting tag by name")
         logger.error(e)
         return None
     finally:
         cursor.close()
+
+def rebuild_closure(cursor):
+    """Recompute nyapixtag_closure from nyapixtag_implication, in the caller's transaction.
+    UNION (not UNION ALL) makes the recursion stop on implication cycles"""
+    cursor.execute("DELETE FROM nyapixtag_closure")
+    cursor.execute("INSERT INTO nyapixtag_closure (tag_id, implied_tag_id) "
+                   "WITH RECURSIVE closure (tag_id, implied_tag_id) AS ("
+                   "SELECT tag_id, implied_tag_id FROM nyapixtag_implication "
+                   "UNION SELECT c.tag_id, i.implied_tag_id FROM closure c JOIN nyapixtag_implication i ON i.tag_id = c.implied_tag_id) "
+                   "SELECT tag_id, implied_tag_id FROM closure WHERE tag_id <> implied_tag_id")
+
+def apply_implications(cursor, content_ids: list[int] = None, tag_ids: list[int] = None) -> list[Tuple[int, int]]:
+    """Add every tag implied by the tags of the given contents (all contents by default) with a single statement,
+    in the caller's transaction. `tag_ids` restricts it to the implications of these tags. Returns the added (content_id, tag_id)"""
+    clauses, params = [], []
+    if content_ids is not None:
+        clauses.append("ct.content_id = ANY(%s)")
+        params.append(list(content_ids))
+    if tag_ids is not None:
+        clauses.append("ct.tag_id = ANY(%s)")
+        params.append(list(tag_ids))
+    where = f"WHERE {' AND '.join(clauses)}" if len(clauses) > 0 else ""
+    cursor.execute("INSERT INTO nyapixcontent_tag (content_id, tag_id) "
+                   f"SELECT DISTINCT ct.content_id, cl.implied_tag_id FROM nyapixcontent_tag ct JOIN nyapixtag_closure cl ON cl.tag_id = ct.tag_id {where} "
+                   "ON CONFLICT DO NOTHING RETURNING content_id, tag_id", params)
+    return cursor.fetchall()
+
+def merge_tag_relations(cursor, source_id: int, target_id: int):
+    """Point the aliases and implications of `source_id` to `target_id` and keep the source name as an alias,
+    in the caller's transaction, before the source tag is deleted"""
+    cursor.execute("UPDATE nyapixtag_alias SET tag_id = %s WHERE tag_id = %s", (target_id, source_id))
+    cursor.execute("INSERT INTO nyapixtag_alias (alias_name, tag_id) SELECT tag_name, %s FROM nyapixtag WHERE id = %s ON CONFLICT DO NOTHING",
+                   (target_id, source_id))
+    cursor.execute("INSERT INTO nyapixtag_implication (tag_id, implied_tag_id) "
+                   "SELECT CASE WHEN tag_id = %s THEN %s ELSE tag_id END, CASE WHEN implied_tag_id = %s THEN %s ELSE implied_tag_id END "
+                   "FROM nyapixtag_implication WHERE (tag_id = %s AND implied_tag_id <> %s) OR (implied_tag_id = %s AND tag_id <> %s) "
+                   "ON CONFLICT DO NOTHING",
+                   (source_id, target_id, source_id, target_id, source_id, target_id, source_id, target_id))
+    cursor.execute("DELETE FROM nyapixtag_implication WHERE tag_id = %s OR implied_tag_id = %s", (source_id, source_id))
+    rebuild_closure(cursor)
+
+def get_tag_closure(db) -> Union[List[Tuple[int, int]], None]:
+    """Every (tag_id, implied_tag_id) of the transitive closure"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT tag_id, implied_tag_id FROM nyapixtag_closure")
+        return cursor.fetchall()
+    except Exception as e:
+        logger.error("Error getting tag closure")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
+
+def get_tag_aliases(db) -> Union[dict, None]:
+    """{alias_name: tag_id} of every alias"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT alias_name, tag_id FROM nyapixtag_alias")
+        return dict(cursor.fetchall())
+    except Exception as e:
+        logger.error("Error getting tag aliases")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
+
+def add_tag_alias(db, alias_name: str, tag_id: int) -> bool:
+    """False if the alias exists or is already the name of a tag"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("INSERT INTO nyapixtag_alias (alias_name, tag_id) SELECT %s, %s "
+                       "WHERE NOT EXISTS (SELECT 1 FROM nyapixtag WHERE tag_name = %s)", (alias_name, tag_id, alias_name))
+        db.commit()
+        return cursor.rowcount == 1
+    except Exception as e:
+        logger.error("Error adding tag alias")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def delete_tag_alias(db, alias_name: str) -> bool:
+    cursor = db.cursor()
+    try:
+        cursor.execute("DELETE FROM nyapixtag_alias WHERE alias_name = %s", (alias_name,))
+        db.commit()
+        return cursor.rowcount == 1
+    except Exception as e:
+        logger.error("Error deleting tag alias")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def add_tag_implication(db, tag_id: int, implied_tag_id: int) -> Union[List[int], None]:
+    """Add the implication, rebuild the closure and apply it to the already tagged contents, in one transaction.
+    Returns the ids of the contents that gained tags, None on error"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("INSERT INTO nyapixtag_implication (tag_id, implied_tag_id) VALUES (%s, %s)", (tag_id, implied_tag_id))
+        rebuild_closure(cursor)
+        # Only contents having the tag, or a tag implying it, can gain anything
+        cursor.execute("SELECT %s UNION SELECT tag_id FROM nyapixtag_closure WHERE implied_tag_id = %s", (tag_id, tag_id))
+        sources = [row[0] for row in cursor.fetchall()]
+        added = apply_implications(cursor, tag_ids=sources)
+        db.commit()
+        return sorted(set(content_id for content_id, _ in added))
+    except Exception as e:
+        logger.error("Error adding tag implication")
+        logger.error(e)
+        db.rollback()
+        return None
+    finally:
+        cursor.close()
+
+def delete_tag_implication(db, tag_id: int, implied_tag_id: int) -> bool:
+    """Tags already applied because of the implication are kept"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("DELETE FROM nyapixtag_implication WHERE tag_id = %s AND implied_tag_id = %s", (tag_id, implied_tag_id))
+        if cursor.rowcount == 0:
+            db.rollback()
+            return False
+        rebuild_closure(cursor)
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error("Error deleting tag implication")
+        logger.error(e)
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def get_tag_relations(db, tag_id: int) -> Union[TagRelationsModel, None]:
+    cursor = db.cursor()
+    try:
+        relations = TagRelationsModel(aliases=[], implies=[], implied_by=[])
+        cursor.execute("SELECT alias_name FROM nyapixtag_alias WHERE tag_id = %s ORDER BY alias_name", (tag_id,))
+        relations.aliases = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT t.tag_name, t.id, t.usage_count FROM nyapixtag_closure cl JOIN nyapixtag t ON t.id = cl.implied_tag_id "
+                       "WHERE cl.tag_id = %s ORDER BY t.tag_name", (tag_id,))
+        relations.implies = [TagModel(name=row[0], id=row[1], usage_count=row[2]) for row in cursor.fetchall()]
+        cursor.execute("SELECT t.tag_name, t.id, t.usage_count FROM nyapixtag_closure cl JOIN nyapixtag t ON t.id = cl.tag_id "
+                       "WHERE cl.implied_tag_id = %s ORDER BY t.tag_name", (tag_id,))
+        relations.implied_by = [TagModel(name=row[0], id=row[1], usage_count=row[2]) for row in cursor.fetchall()]
+        return relations
+    except Exception as e:
+        logger.error("Error getting tag relations")
+        logger.error(e)
+        return None
+    finally:
+        cursor.close()
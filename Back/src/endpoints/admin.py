@@ -1,8 +1,51 @@
 import fastapi
 import models.content as models
 import db_management.authors as authors_db
+import db_management.content as content_db
 from utility.logging import logger
 from db_management.connection import connect_db
 import decorators.users_type as users_type
+import utility.history as history
+import utility.indexes as indexes
+import utility.tag_closure as tag_closure
 
 router = fastapi.APIRouter()
+
+@router.get("/history", tags=["Administration"])
+@users_type.admin_required
+async def get_history_stats_endpoint(request: fastapi.Request) -> models.HistoryStatsModel:
+    return models.HistoryStatsModel(**history.get_history_stats())
+
+@router.post("/merge/{taxonomy}", tags=["Administration"])
+@users_type.admin_required
+async def merge_references_endpoint(request: fastapi.Request, taxonomy: str, source_id: int = fastapi.Query(...),
+                                    target_id: int = fastapi.Query(...)) -> models.MergeResultModel:
+    db = None
+    try:
+        db = connect_db()
+        if taxonomy not in content_db.REFERENCE_TABLES or source_id == target_id:
+            return fastapi.responses.Response(status_code=400)
+
+        missing = content_db.get_missing_references(db, {taxonomy: [source_id, target_id]})
+        if missing is None:
+            return fastapi.responses.Response(status_code=500)
+        if len(missing) > 0:
+            return fastapi.responses.JSONResponse(content={"detail": "Unknown references", "missing": missing}, status_code=404)
+
+        content_ids = content_db.merge_references(db, taxonomy, source_id, target_id)
+        if content_ids is None:
+            return fastapi.responses.Response(status_code=500)
+
+        # Co-occurrence and similarity are keyed by the merged ids, the closure by tag ids and aliases
+        indexes.refresh_contents(db, content_ids)
+        if taxonomy == "tags":
+            tag_closure.load(db)
+        logger.info(f"Merged {taxonomy} {source_id} into {target_id}, {len(content_ids)} contents rewritten")
+        return models.MergeResultModel(taxonomy=taxonomy, source_id=source_id, target_id=target_id, updated_contents=len(content_ids))
+    except Exception as e:
+        logger.error("Error merging references")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
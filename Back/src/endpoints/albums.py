@@ -3,13 +3,38 @@ import decorators.users_type as users_type
 from utility.logging import logger
 from db_management.connection import connect_db
 import db_management.albums as albums_db
+import db_management.content as content_db
+import db_management.favorites as favorites_db
+import db_management.access as access_db
+import db_management.users as users_db
 import models.content as models
 from fastapi import Query, Response
 import models.users as user_models
+from utility.query import parse_query, QuerySyntaxError
+from utility.archive import stream_media_archive
+from starlette.responses import StreamingResponse
+from utility.caching import cached_image_response
+import utility.history as history
+import utility.access as access
+import utility.users as users_utility
+from db_management.history import ACCESS_VIEW, ACCESS_DOWNLOAD
 import os
 
 router = fastapi.APIRouter()
 
+def refresh_album_cover_task(album_id: int):
+    """Rebuild the album cover after the response is sent, if its leading contents changed"""
+    db = None
+    try:
+        db = connect_db()
+        albums_db.refresh_album_covers(db, album_id)
+    except Exception as e:
+        logger.error("Error refreshing album cover")
+        logger.error(e)
+    finally:
+        if db is not None:
+            db.close()
+
 @router.post("", tags=["Albums management"])
 @users_type.admin_or_user_required
 async def post_albums_endpoint(request: fastapi.Request, info: models.AlbumPostModel = fastapi.Body(...)):
@@ -28,15 +53,16 @@ async def post_albums_endpoint(request: fastapi.Request, info: models.AlbumPostM
         if db is not None:
             db.close()
 
-@router.post("/{album_id/add-content", tags=["Albums management"])
+@router.post("/{album_id}/add-content", tags=["Albums management"])
 @users_type.admin_or_user_required
-async def post_albums_add_content_endpoint(request: fastapi.Request, album_id: int, content_id: int):
+async def post_albums_add_content_endpoint(request: fastapi.Request, album_id: int, background_tasks: fastapi.BackgroundTasks, content_id: int):
     db = None
     try:
         db = connect_db()
         if not albums_db.is_user_album(db, request.state.user.id, album_id):
             return fastapi.responses.Response(status_code=403)
-        success = albums_db.add_content_to_album(db, album_id, content_id)
+        success = albums_db.add_content_to_album(db, album_id, content_id, request.state.user.id)
+        background_tasks.add_task(refresh_album_cover_task, album_id)
         if not success:
             return fastapi.responses.Response(status_code=409)
         return fastapi.responses.Response(status_code=200)
@@ -48,15 +74,16 @@ async def post_albums_add_content_endpoint(request: fastapi.Request, album_id: i
         if db is not None:
             db.close()
 
-@router.delete("/{album_id/remove-content", tags=["Albums management"])
+@router.delete("/{album_id}/remove-content", tags=["Albums management"])
 @users_type.admin_or_user_required
-async def delete_albums_remove_content_endpoint(request: fastapi.Request, album_id: int, content_id: int):
+async def delete_albums_remove_content_endpoint(request: fastapi.Request, album_id: int, background_tasks: fastapi.BackgroundTasks, content_id: int):
     db = None
     try:
         db = connect_db()
         if not albums_db.is_user_album(db, request.state.user.id, album_id):
             return fastapi.responses.Response(status_code=403)
         albums_db.remove_content_from_album(db, album_id, content_id)
+        background_tasks.add_task(refresh_album_cover_task, album_id)
         return fastapi.responses.Response(status_code=200)
     except Exception as e:
         logger.error("Error removing content from album")
@@ -66,13 +93,107 @@ async def delete_albums_remove_content_endpoint(request: fastapi.Request, album_
         if db is not None:
             db.close()
 
+@router.post("/{album_id}/contents", tags=["Albums management"])
+@users_type.admin_or_user_required
+async def post_albums_contents_endpoint(request: fastapi.Request, album_id: int, background_tasks: fastapi.BackgroundTasks, contents: models.AlbumAddContentModel = fastapi.Body(...)) -> models.AlbumMembershipChangeModel:
+    db = None
+    try:
+        db = connect_db()
+        if not albums_db.is_user_album(db, request.state.user.id, album_id):
+            return fastapi.responses.Response(status_code=403)
+        added = albums_db.add_contents_to_album(db, album_id, contents.content_id, request.state.user.id)
+        background_tasks.add_task(refresh_album_cover_task, album_id)
+        if added == -1:
+            return fastapi.responses.Response(status_code=409)
+        return models.AlbumMembershipChangeModel(changed=added)
+    except Exception as e:
+        logger.error("Error adding contents to album")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.delete("/{album_id}/contents", tags=["Albums management"])
+@users_type.admin_or_user_required
+async def delete_albums_contents_endpoint(request: fastapi.Request, album_id: int, background_tasks: fastapi.BackgroundTasks, contents: models.AlbumRemoveContentModel = fastapi.Body(...)) -> models.AlbumMembershipChangeModel:
+    db = None
+    try:
+        db = connect_db()
+        if not albums_db.is_user_album(db, request.state.user.id, album_id):
+            return fastapi.responses.Response(status_code=403)
+        removed = albums_db.remove_contents_from_album(db, album_id, contents.content_id)
+        background_tasks.add_task(refresh_album_cover_task, album_id)
+        if removed == -1:
+            return fastapi.responses.Response(status_code=409)
+        return models.AlbumMembershipChangeModel(changed=removed)
+    except Exception as e:
+        logger.error("Error removing contents from album")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.put("/{album_id}/contents/order", tags=["Albums management"])
+@users_type.admin_or_user_required
+async def put_albums_contents_order_endpoint(request: fastapi.Request, album_id: int, background_tasks: fastapi.BackgroundTasks, contents: models.AlbumReorderContentModel = fastapi.Body(...)) -> models.AlbumMembershipChangeModel:
+    db = None
+    try:
+        db = connect_db()
+        if not albums_db.is_user_album(db, request.state.user.id, album_id):
+            return fastapi.responses.Response(status_code=403)
+        moved = albums_db.reorder_album(db, album_id, contents.content_id)
+        background_tasks.add_task(refresh_album_cover_task, album_id)
+        if moved == -1:
+            return fastapi.responses.Response(status_code=409)
+        return models.AlbumMembershipChangeModel(changed=moved)
+    except Exception as e:
+        logger.error("Error reordering album")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.get("/favorites", tags=["Albums management"])
+async def get_favorite_albums_endpoint(request: fastapi.Request, max_results: int = Query(50), cursor: str = Query(None)) -> models.FavoriteAlbumPageModel:
+    db = None
+    try:
+        db = connect_db()
+        try:
+            favorites = favorites_db.get_favorite_albums(db, request.state.user.id, max_results, cursor)
+        except ValueError:
+            return fastapi.responses.Response(content="Invalid cursor", status_code=400)
+        if favorites is None:
+            return fastapi.responses.Response(status_code=500)
+        return favorites
+    except Exception as e:
+        logger.error("Error getting favorite albums")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
 @router.get("/search", tags=["Albums management"])
 async def search_content_endpoint(request: fastapi.Request,
                                   needed_tags: list[int] = Query(None), needed_characters: list[int] = Query(None), needed_authors: list[int] = Query(None),
                                   tags_to_exclude: list[int] = Query(None), characters_to_exclude: list[int] = Query(None), authors_to_exclude: list[int] = Query(None),
+                                  allowed_sources: list[int] = Query(None), media_type: list[str] = Query(None), query: str = Query(None),
                                   page: int = Query(1), max_results: int = Query(10)) -> models.AlbumPageModel:
     db = None
     try:
+        if media_type is not None and any(item not in content_db.MEDIA_TYPES for item in media_type):
+            return Response(content=f"media_type must be one of {', '.join(content_db.MEDIA_TYPES)}", status_code=400)
+
+        parsed_query = None
+        if query is not None:
+            try:
+                parsed_query = parse_query(query)
+            except QuerySyntaxError as e:
+                return Response(content=f"Invalid query: {e}", status_code=400)
+
         db = connect_db()
 
         if needed_tags is None:
@@ -89,7 +210,8 @@ async def search_content_endpoint(request: fastapi.Request,
             authors_to_exclude = []
 
         content = albums_db.search_album(db, needed_tags, needed_characters, needed_authors,
-                                         tags_to_exclude, characters_to_exclude, authors_to_exclude, max_results, page, request.state.user.id)
+                                         tags_to_exclude, characters_to_exclude, authors_to_exclude, max_results, page, request.state.user.id,
+                                         allowed_sources, parsed_query, media_type)
 
         if content is None:
             return Response(status_code=500)
@@ -144,14 +266,197 @@ async def delete_albums_endpoint(request: fastapi.Request, album_id: int):
         if db is not None:
             db.close()
 
+@router.get("/{album_id}/guests", tags=["Albums management"])
+@users_type.admin_or_user_required
+async def get_album_guests_endpoint(request: fastapi.Request, album_id: int) -> list[user_models.UserModel]:
+    db = None
+    try:
+        db = connect_db()
+        if not albums_db.is_user_album(db, request.state.user.id, album_id):
+            return Response(status_code=403)
+        guests = access_db.get_granted_guests(db, "album", album_id)
+        if guests is None:
+            return Response(status_code=500)
+        return guests
+    except Exception as e:
+        logger.error("Error getting album guests")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.put("/{album_id}/guests/{guest_id}", tags=["Albums management"])
+@users_type.admin_or_user_required
+async def add_album_guest_endpoint(request: fastapi.Request, album_id: int, guest_id: int):
+    db = None
+    try:
+        db = connect_db()
+        if not albums_db.is_user_album(db, request.state.user.id, album_id):
+            return Response(status_code=403)
+        guest = users_db.get_user(db, guest_id)
+        if guest is None:
+            return Response(status_code=404)
+        if guest.type != users_utility.USER_TYPE.GUEST:
+            return Response(content="Only guest accounts can be granted access", status_code=400)
+        if not access_db.add_grant(db, "album", guest_id, album_id):
+            return Response(status_code=500)
+        access.invalidate()
+        return Response(status_code=200)
+    except Exception as e:
+        logger.error("Error granting album access")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.delete("/{album_id}/guests/{guest_id}", tags=["Albums management"])
+@users_type.admin_or_user_required
+async def remove_album_guest_endpoint(request: fastapi.Request, album_id: int, guest_id: int):
+    db = None
+    try:
+        db = connect_db()
+        if not albums_db.is_user_album(db, request.state.user.id, album_id):
+            return Response(status_code=403)
+        if not access_db.remove_grant(db, "album", guest_id, album_id):
+            return Response(status_code=500)
+        access.invalidate()
+        return Response(status_code=200)
+    except Exception as e:
+        logger.error("Error revoking album access")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.put("/{album_id}/favorite", tags=["Albums management"])
+async def add_favorite_album_endpoint(request: fastapi.Request, album_id: int):
+    db = None
+    try:
+        db = connect_db()
+        if albums_db.get_album_info(db, album_id) is None:
+            return fastapi.responses.Response(status_code=404)
+        if not favorites_db.add_favorite(db, "album", request.state.user.id, album_id):
+            return fastapi.responses.Response(status_code=500)
+        return fastapi.responses.Response(status_code=200)
+    except Exception as e:
+        logger.error("Error adding favorite album")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.delete("/{album_id}/favorite", tags=["Albums management"])
+async def remove_favorite_album_endpoint(request: fastapi.Request, album_id: int):
+    db = None
+    try:
+        db = connect_db()
+        if not favorites_db.remove_favorite(db, "album", request.state.user.id, album_id):
+            return fastapi.responses.Response(status_code=500)
+        return fastapi.responses.Response(status_code=200)
+    except Exception as e:
+        logger.error("Error removing favorite album")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.get("/{album_id}/cover", tags=["Albums management"])
+async def get_album_cover_endpoint(request: fastapi.Request, album_id: int):
+    db = None
+    try:
+        db = connect_db()
+        cover = albums_db.get_album_cover(db, album_id)
+        if cover is None:
+            return fastapi.responses.Response(status_code=404)
+        return cached_image_response(request, cover)
+    except Exception as e:
+        logger.error("Error getting album cover")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.put("/{album_id}/cover", tags=["Albums management"])
+@users_type.admin_or_user_required
+async def put_album_cover_endpoint(request: fastapi.Request, album_id: int, background_tasks: fastapi.BackgroundTasks, content_id: int = Query(...)):
+    db = None
+    try:
+        db = connect_db()
+        if not albums_db.is_user_album(db, request.state.user.id, album_id):
+            return fastapi.responses.Response(status_code=403)
+        if not content_db.has_user_access(db, content_id, request.state.user.id):
+            return fastapi.responses.Response(status_code=403)
+        if not albums_db.set_album_cover_content(db, album_id, content_id):
+            return fastapi.responses.Response(status_code=409)
+        background_tasks.add_task(refresh_album_cover_task, album_id)
+        return fastapi.responses.Response(status_code=200)
+    except Exception as e:
+        logger.error("Error setting album cover")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.delete("/{album_id}/cover", tags=["Albums management"])
+@users_type.admin_or_user_required
+async def delete_album_cover_endpoint(request: fastapi.Request, album_id: int, background_tasks: fastapi.BackgroundTasks):
+    db = None
+    try:
+        db = connect_db()
+        if not albums_db.is_user_album(db, request.state.user.id, album_id):
+            return fastapi.responses.Response(status_code=403)
+        if not albums_db.set_album_cover_content(db, album_id, None):
+            return fastapi.responses.Response(status_code=409)
+        background_tasks.add_task(refresh_album_cover_task, album_id)
+        return fastapi.responses.Response(status_code=200)
+    except Exception as e:
+        logger.error("Error resetting album cover")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.get("/{album_id}/download", tags=["Albums management"])
+async def get_album_download_endpoint(request: fastapi.Request, album_id: int):
+    db = None
+    try:
+        db = connect_db()
+        if albums_db.get_album_info(db, album_id) is None:
+            return fastapi.responses.Response(status_code=404)
+        content_ids = albums_db.get_album_content_ids(db, request.state.user.id, album_id)
+        entries = content_db.get_contents_media(db, content_ids, request.state.user.id)
+        history.record_access("album", request.state.user.id, [album_id], ACCESS_DOWNLOAD)
+        history.record_access("content", request.state.user.id, [entry[0] for entry in entries], ACCESS_DOWNLOAD)
+        return StreamingResponse(stream_media_archive(entries), media_type="application/zip",
+                                 headers={"Content-Disposition": f"attachment; filename=\"album-{album_id}.zip\""})
+    except Exception as e:
+        logger.error("Error downloading album")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
 @router.get("/{album_id}", tags=["Albums management"])
-async def get_album_endpoint(request: fastapi.Request, album_id: int) -> models.AlbumContentModel:
+async def get_album_endpoint(request: fastapi.Request, album_id: int, page: int = Query(1), max_results: int = Query(50)) -> models.AlbumContentModel:
     db = None
     try:
         db = connect_db()
-        album = albums_db.get_album(db, request.state.user.id, album_id)
+        album = albums_db.get_album(db, request.state.user.id, album_id, page, max_results)
         if album is None:
-            return fastapi.responses.Response(status_code=404)
+            # Missing album or failed read, only the first is a 404
+            if albums_db.get_album_info(db, album_id) is None:
+                return fastapi.responses.Response(status_code=404)
+            return fastapi.responses.Response(status_code=500)
+        history.record_access("album", request.state.user.id, [album_id], ACCESS_VIEW)
         return album
     except Exception as e:
         logger.error("Error getting album")
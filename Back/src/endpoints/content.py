@@ -1,17 +1,15 @@
 import json
 import random
-import string
 import fastapi
+from typing import Union
 from starlette.responses import FileResponse, StreamingResponse
 
 from db_management.connection import connect_db
-import db_management.tags as tags_db
 import db_management.content as content_db
-import db_management.characters as characters_db
-import db_management.authors as authors_db
 import db_management.stream as video_db
-import db_management.sources as sources_db
-from db_management.content import has_user_access, get_image_content_id, get_video_content_id, is_user_content, get_audio_content_id
+import db_management.favorites as favorites_db
+import db_management.access as access_db
+from db_management.content import has_user_access, get_image_content_id, get_video_content_id, is_user_content, get_audio_content_id, get_media_access
 from models.content import ContentModel
 from models.users import UserModel
 from utility.logging import logger
@@ -20,11 +18,24 @@ from fastapi.responses import Response
 import models.content as models
 import decorators.users_type as users_type
 import os
+import shutil
 import utility.media as video_utility
 import hashlib
 import db_management.users as users_db
 
 from utility.media import convert_image_to_png, convert_audio_to_wav
+from utility.query import parse_query, QuerySyntaxError
+from utility.archive import stream_media_archive
+from utility.caching import cached_image_response
+import utility.jobs as jobs
+import utility.staging as staging
+import utility.history as history
+import utility.similarity as similarity
+import utility.indexes as indexes
+import utility.recommendations as recommendations
+import utility.access as access
+import utility.users as users_utility
+from db_management.history import ACCESS_VIEW, ACCESS_DOWNLOAD
 
 router = APIRouter()
 
@@ -45,11 +56,19 @@ def compute_file_hash(file_path: str) -> str:
         return hashlib.sha256(f.read()).hexdigest()
 
 @router.get("/my", tags=["Content management"])
-async def get_my_content_endpoint(request: fastapi.Request, page: int = Query(...), max_results: int = Query(10)) -> models.ContentPageModel:
+async def get_my_content_endpoint(request: fastapi.Request, page: int = Query(...), max_results: int = Query(10),
+                                  sort: str = Query("newest"), seed: int = Query(None)) -> models.ContentPageModel:
     db = None
     try:
+        if sort not in content_db.SORT_ORDERS:
+            return Response(content=f"sort must be one of {', '.join(content_db.SORT_ORDERS)}", status_code=400)
+        if sort == "random" and seed is None:
+            seed = random.randint(0, 2 ** 31 - 1)
+
         db = connect_db()
-        content = content_db.get_user_content(db, request.state.user.id, max_results, page)
+        content = content_db.get_user_content(db, request.state.user.id, max_results, page, sort, seed)
+        if content is None:
+            return Response(status_code=500)
 
         for item in content.contents:
             is_https = os.getenv("IS_HTTPS")
@@ -70,13 +89,128 @@ async def get_my_content_endpoint(request: fastapi.Request, page: int = Query(..
         if db is not None:
             db.close()
 
+@router.get("/trending", tags=["Content management"])
+async def get_trending_content_endpoint(request: fastapi.Request, page: int = Query(1), max_results: int = Query(50)) -> models.ContentPageModel:
+    db = None
+    try:
+        db = connect_db()
+        content = content_db.get_trending_content(db, request.state.user.id, max_results, page)
+        if content is None:
+            return Response(status_code=500)
+
+        for item in content.contents:
+            is_https = os.getenv("IS_HTTPS")
+            if is_https  == "yes":
+                is_https = True
+            else:
+                is_https = False
+            item.url = f"{request.base_url}{item.url}"
+            if is_https:
+                item.url = item.url.replace("http://", "https://")
+
+        return content
+    except Exception as e:
+        logger.error("Error getting trending content")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.get("/recommended", tags=["Content management"])
+async def get_recommended_content_endpoint(request: fastapi.Request, max_results: int = Query(50)) -> list[ContentModel]:
+    db = None
+    try:
+        db = connect_db()
+        recommended = recommendations.get_recommendations(db, request.state.user.id)
+        if recommended is None:
+            return Response(status_code=500)
+
+        visible = content_db.get_visible_content_ids(db, recommended, request.state.user.id)
+        if len(visible) > 0:
+            contents = content_db.get_contents(db, visible[:max_results], request.state.user.id)
+        else:
+            # Nothing to go on yet, fall back to what is trending
+            trending = content_db.get_trending_content(db, request.state.user.id, max_results, 1)
+            contents = None if trending is None else trending.contents
+        if contents is None:
+            return Response(status_code=500)
+
+        for item in contents:
+            is_https = os.getenv("IS_HTTPS")
+            if is_https  == "yes":
+                is_https = True
+            else:
+                is_https = False
+            item.url = f"{request.base_url}{item.url}"
+            if is_https:
+                item.url = item.url.replace("http://", "https://")
+
+        return contents
+    except Exception as e:
+        logger.error("Error getting recommended content")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.get("/favorites", tags=["Content management"])
+async def get_favorite_contents_endpoint(request: fastapi.Request, max_results: int = Query(50), cursor: str = Query(None)) -> models.FavoriteContentPageModel:
+    db = None
+    try:
+        db = connect_db()
+        try:
+            favorites = favorites_db.get_favorite_contents(db, request.state.user.id, max_results, cursor)
+        except ValueError:
+            return Response(content="Invalid cursor", status_code=400)
+        if favorites is None:
+            return Response(status_code=500)
+
+        for item in favorites.contents:
+            is_https = os.getenv("IS_HTTPS")
+            if is_https  == "yes":
+                is_https = True
+            else:
+                is_https = False
+            item.url = f"{request.base_url}{item.url}"
+            if is_https:
+                item.url = item.url.replace("http://", "https://")
+
+        return favorites
+    except Exception as e:
+        logger.error("Error getting favorite contents")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
 @router.get("/search", tags=["Content management"])
 async def search_content_endpoint(request: fastapi.Request,
                                   needed_tags: list[int] = Query(None), needed_characters: list[int] = Query(None), needed_authors: list[int] = Query(None),
                                   tags_to_exclude: list[int] = Query(None), characters_to_exclude: list[int] = Query(None), authors_to_exclude: list[int] = Query(None),
-                                  page: int = Query(1), max_results: int = Query(10)) -> models.ContentPageModel:
+                                  allowed_sources: list[int] = Query(None), media_type: list[str] = Query(None), query: str = Query(None),
+                                  page: int = Query(1), max_results: int = Query(10),
+                                  facets: bool = Query(False), facets_limit: int = Query(10),
+                                  sort: str = Query("newest"), seed: int = Query(None)) -> models.ContentPageModel:
     db = None
     try:
+        if sort not in content_db.SORT_ORDERS:
+            return Response(content=f"sort must be one of {', '.join(content_db.SORT_ORDERS)}", status_code=400)
+        if sort == "random" and seed is None:
+            seed = random.randint(0, 2 ** 31 - 1)
+
+        if media_type is not None and any(item not in content_db.MEDIA_TYPES for item in media_type):
+            return Response(content=f"media_type must be one of {', '.join(content_db.MEDIA_TYPES)}", status_code=400)
+
+        parsed_query = None
+        if query is not None:
+            try:
+                parsed_query = parse_query(query)
+            except QuerySyntaxError as e:
+                return Response(content=f"Invalid query: {e}", status_code=400)
+
         db = connect_db()
 
         if needed_tags is None:
@@ -93,7 +227,9 @@ async def search_content_endpoint(request: fastapi.Request,
             authors_to_exclude = []
 
         content = content_db.search_content(db, needed_tags, needed_characters, needed_authors,
-                                            tags_to_exclude, characters_to_exclude, authors_to_exclude, max_results, page, request.state.user.id)
+                                            tags_to_exclude, characters_to_exclude, authors_to_exclude, max_results, page, request.state.user.id,
+                                            facets_limit if facets else 0, allowed_sources, parsed_query, media_type,
+                                            sort, seed)
 
         if content is None:
             return Response(status_code=500)
@@ -117,6 +253,99 @@ async def search_content_endpoint(request: fastapi.Request,
         if db is not None:
             db.close()
 
+@router.get("/download", tags=["Content management"])
+async def download_contents_endpoint(request: fastapi.Request, content_ids: list[int] = Query(...)):
+    db = None
+    try:
+        db = connect_db()
+        entries = content_db.get_contents_media(db, content_ids, request.state.user.id)
+        if len(entries) == 0:
+            return Response(status_code=404)
+        history.record_access("content", request.state.user.id, [entry[0] for entry in entries], ACCESS_DOWNLOAD)
+        return StreamingResponse(stream_media_archive(entries), media_type="application/zip",
+                                 headers={"Content-Disposition": "attachment; filename=\"nyapix-selection.zip\""})
+    except Exception as e:
+        logger.error("Error downloading contents")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+# Edits touching more contents than this run in the background and are followed through /bulk-edit/{job_id}
+BULK_EDIT_SYNC_LIMIT = 1000
+
+def run_bulk_edit_job(job_id: str, content_ids: list[int], edit: models.ContentBulkEditModel) -> int:
+    """Returns how many rows changed, -1 on error. The job may have been evicted from the registry meanwhile"""
+    db = None
+    try:
+        db = connect_db()
+        changed = content_db.bulk_edit_contents(db, content_ids, edit, lambda processed, changed: jobs.update_job(job_id, processed=processed, changed=changed))
+        if changed == -1:
+            jobs.update_job(job_id, status="failed")
+        else:
+            jobs.update_job(job_id, status="done", processed=len(content_ids), changed=changed)
+            if changed > 0 and edit.associations_changed():
+                indexes.refresh_contents(db, content_ids)
+        return changed
+    except Exception as e:
+        logger.error("Error running bulk edit job")
+        logger.error(e)
+        jobs.update_job(job_id, status="failed")
+        return -1
+    finally:
+        if db is not None:
+            db.close()
+
+@router.post("/bulk-edit", tags=["Content management"])
+@users_type.admin_or_user_required
+async def bulk_edit_content_endpoint(request: fastapi.Request, background_tasks: fastapi.BackgroundTasks, edit: models.ContentBulkEditModel) -> models.JobModel:
+    db = None
+    try:
+        if (edit.content_ids is None) == (edit.query is None):
+            return Response(content="Exactly one of content_ids and query must be given", status_code=400)
+
+        parsed_query = None
+        if edit.query is not None:
+            try:
+                parsed_query = parse_query(edit.query)
+            except QuerySyntaxError as e:
+                return Response(content=f"Invalid query: {e}", status_code=400)
+            if parsed_query is None:
+                return Response(content="Empty query", status_code=400)
+
+        db = connect_db()
+        invalid = validate_references(db, edit.add_tags, edit.add_characters, edit.add_authors,
+                                      None if edit.source_id is None else [edit.source_id])
+        if invalid is not None:
+            return invalid
+
+        content_ids = content_db.get_owned_matching_content_ids(db, request.state.user.id, edit.content_ids, parsed_query)
+        job = jobs.create_job(request.state.user.id, len(content_ids))
+
+        if len(content_ids) > BULK_EDIT_SYNC_LIMIT:
+            background_tasks.add_task(run_bulk_edit_job, job.id, content_ids, edit)
+            return fastapi.responses.JSONResponse(content=job.model_dump(), status_code=202, background=background_tasks)
+
+        changed = run_bulk_edit_job(job.id, content_ids, edit)
+        if changed == -1:
+            return Response(status_code=409)
+        return models.JobModel(id=job.id, status="done", total=len(content_ids), processed=len(content_ids), changed=changed)
+    except Exception as e:
+        logger.error("Error bulk editing content")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.get("/bulk-edit/{job_id}", tags=["Content management"])
+async def get_bulk_edit_job_endpoint(request: fastapi.Request, job_id: str) -> models.JobModel:
+    job = jobs.get_job(job_id, request.state.user.id)
+    if job is None:
+        return Response(status_code=404)
+    return job
+
 @router.get("/{content_id}/thumb", tags=["Content management"])
 async def get_content_thumb_endpoint(request: fastapi.Request, content_id: int):
     db = None
@@ -131,7 +360,7 @@ async def get_content_thumb_endpoint(request: fastapi.Request, content_id: int):
         if miniature is None:
             return Response(status_code=404)
 
-        return StreamingResponse(async_bytes_it(miniature), media_type="image/png")
+        return cached_image_response(request, miniature)
     except Exception as e:
         logger.error("Error getting content thumbnail")
         logger.error(e)
@@ -140,6 +369,141 @@ async def get_content_thumb_endpoint(request: fastapi.Request, content_id: int):
         if db is not None:
             db.close()
 
+@router.put("/{content_id}/favorite", tags=["Content management"])
+async def add_favorite_content_endpoint(request: fastapi.Request, content_id: int):
+    db = None
+    try:
+        db = connect_db()
+        if not has_user_access(db, content_id, request.state.user.id):
+            return Response(status_code=404)
+        if not favorites_db.add_favorite(db, "content", request.state.user.id, content_id):
+            return Response(status_code=500)
+        return Response(status_code=200)
+    except Exception as e:
+        logger.error("Error adding favorite content")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.delete("/{content_id}/favorite", tags=["Content management"])
+async def remove_favorite_content_endpoint(request: fastapi.Request, content_id: int):
+    db = None
+    try:
+        db = connect_db()
+        if not favorites_db.remove_favorite(db, "content", request.state.user.id, content_id):
+            return Response(status_code=500)
+        return Response(status_code=200)
+    except Exception as e:
+        logger.error("Error removing favorite content")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.get("/{content_id}/guests", tags=["Content management"])
+@users_type.admin_or_user_required
+async def get_content_guests_endpoint(request: fastapi.Request, content_id: int) -> list[UserModel]:
+    db = None
+    try:
+        db = connect_db()
+        if not is_user_content(db, content_id, request.state.user.id):
+            return Response(status_code=403)
+        guests = access_db.get_granted_guests(db, "content", content_id)
+        if guests is None:
+            return Response(status_code=500)
+        return guests
+    except Exception as e:
+        logger.error("Error getting content guests")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.put("/{content_id}/guests/{guest_id}", tags=["Content management"])
+@users_type.admin_or_user_required
+async def add_content_guest_endpoint(request: fastapi.Request, content_id: int, guest_id: int):
+    db = None
+    try:
+        db = connect_db()
+        if not is_user_content(db, content_id, request.state.user.id):
+            return Response(status_code=403)
+        guest = users_db.get_user(db, guest_id)
+        if guest is None:
+            return Response(status_code=404)
+        if guest.type != users_utility.USER_TYPE.GUEST:
+            return Response(content="Only guest accounts can be granted access", status_code=400)
+        if not access_db.add_grant(db, "content", guest_id, content_id):
+            return Response(status_code=500)
+        access.invalidate()
+        return Response(status_code=200)
+    except Exception as e:
+        logger.error("Error granting content access")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.delete("/{content_id}/guests/{guest_id}", tags=["Content management"])
+@users_type.admin_or_user_required
+async def remove_content_guest_endpoint(request: fastapi.Request, content_id: int, guest_id: int):
+    db = None
+    try:
+        db = connect_db()
+        if not is_user_content(db, content_id, request.state.user.id):
+            return Response(status_code=403)
+        if not access_db.remove_grant(db, "content", guest_id, content_id):
+            return Response(status_code=500)
+        access.invalidate()
+        return Response(status_code=200)
+    except Exception as e:
+        logger.error("Error revoking content access")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.get("/{content_id}/similar", tags=["Content management"])
+async def get_similar_content_endpoint(request: fastapi.Request, content_id: int, max_results: int = Query(20)) -> list[ContentModel]:
+    db = None
+    try:
+        db = connect_db()
+        if not has_user_access(db, content_id, request.state.user.id):
+            return Response(status_code=403)
+        if not indexes.ensure_loaded(db):
+            return Response(status_code=500)
+
+        # Over-fetch a little, some of the best matches may be private contents of other users
+        similar = similarity.find_similar(content_id, max_results * 2)
+        visible = content_db.get_visible_content_ids(db, [similar_id for similar_id, _ in similar], request.state.user.id)
+        contents = content_db.get_contents(db, visible[:max_results], request.state.user.id)
+        if contents is None:
+            return Response(status_code=500)
+
+        for item in contents:
+            is_https = os.getenv("IS_HTTPS")
+            if is_https  == "yes":
+                is_https = True
+            else:
+                is_https = False
+            item.url = f"{request.base_url}{item.url}"
+            if is_https:
+                item.url = item.url.replace("http://", "https://")
+
+        return contents
+    except Exception as e:
+        logger.error("Error getting similar content")
+        logger.error(e)
+        return Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
 @router.get("/{content_id}/who", tags=["Administration"])
 @users_type.admin_required
 async def get_content_full_endpoint(request: fastapi.Request, content_id: int) -> UserModel:
@@ -173,7 +537,7 @@ async def get_content_endpoint(request: fastapi.Request, content_id: int) -> Con
         if not has_user_access(db, content_id, request.state.user.id):
             return Response(status_code=403)
 
-        content = content_db.get_content(db, content_id)
+        content = content_db.get_content(db, content_id, request.state.user.id)
 
         if content is None:
             return Response(status_code=404)
@@ -196,9 +560,18 @@ async def get_content_endpoint(request: fastapi.Request, content_id: int) -> Con
         if db is not None:
             db.close()
 
+def validate_references(db, tags: list[int], characters: list[int], authors: list[int], sources: list[int]) -> Union[Response, None]:
+    """Check every referenced taxonomy id at once, returns the 400 response listing all missing ids, None if they all exist"""
+    missing = content_db.get_missing_references(db, {"tags": tags, "characters": characters, "authors": authors, "sources": sources})
+    if missing is None:
+        return Response(status_code=500)
+    if len(missing) > 0:
+        return fastapi.responses.JSONResponse(content={"detail": "Unknown references", "missing": missing}, status_code=400)
+    return None
+
 @router.put("/{content_id}", tags=["Content management"])
 @users_type.admin_or_user_required
-async def put_content_endpoint(request: fastapi.Request, content_id: int, content: models.ContentUpdateModel):
+async def put_content_endpoint(request: fastapi.Request, content_id: int, content: models.ContentUpdateModel) -> models.ContentChangeSetModel:
     db = None
     try:
         db = connect_db()
@@ -206,34 +579,24 @@ async def put_content_endpoint(request: fastapi.Request, content_id: int, conten
         if not is_user_content(db, content_id, request.state.user.id):
             return Response(status_code=403)
 
-        if content.tags is not None:
-            for tag in content.tags:
-                if tags_db.get_tag(db, tag) is None:
-                    return Response(content=f"Tag with id {tag} does not exist", status_code=400)
-
-        if content.characters is not None:
-            for character in content.characters:
-                if characters_db.get_character(db, character) is None:
-                    return Response(content=f"Character with id {character} does not exist", status_code=400)
+        invalid = validate_references(db, content.tags, content.characters, content.authors,
+                                      None if content.source_id is None else [content.source_id])
+        if invalid is not None:
+            return invalid
 
-        if content.authors is not None:
-            for author in content.authors:
-                if authors_db.get_author(db, author) is None:
-                    return Response(content=f"Author with id {author} does not exist", status_code=400)
-
-        if content.source_id is not None:
-            if sources_db.get_source(db, content.source_id) is None:
-                return Response(content=f"Source with id {content.source} does not exist", status_code=400)
-
-        success = content_db.update_content(db, content_id, content)
-        if not success:
+        changes = content_db.update_content(db, content_id, content)
+        if changes is None:
             return Response(status_code=409)
+        if changes.associations_changed():
+            indexes.refresh_contents(db, [content_id])
+        return changes
     except Exception as e:
         logger.error("Error updating content")
         logger.error(e)
         return Response(status_code=500)
-
-    return Response(status_code=200)
+    finally:
+        if db is not None:
+            db.close()
 
 @router.delete("/{content_id}", tags=["Content management"])
 @users_type.admin_or_user_required
@@ -248,6 +611,7 @@ async def delete_content_endpoint(request: fastapi.Request, content_id: int):
         success = content_db.delete_content(db, content_id)
         if not success:
             return Response(status_code=409)
+        indexes.remove_contents([content_id])
     except Exception as e:
         logger.error("Error deleting content")
         logger.error(e)
@@ -274,75 +638,54 @@ async def post_content_endpoint(
 
         db = connect_db()
 
-        for tag in content_obj.tags:
-            if tags_db.get_tag(db, tag) is None:
-                return Response(content=f"Tag with id {tag} does not exist", status_code=400)
-
-        for character in content_obj.characters:
-            if characters_db.get_character(db, character) is None:
-                return Response(content=f"Character with id {character} does not exist", status_code=400)
-
-        for author in content_obj.authors:
-            if authors_db.get_author(db, author) is None:
-                return Response(content=f"Author with id {author} does not exist", status_code=400)
-
-        if sources_db.get_source(db, content_obj.source_id) is None:
-            return Response(content=f"Source with id {content_obj.source} does not exist", status_code=400)
-
-        # Write file to disk
-        random_name = "".join(random.choices(string.ascii_letters + string.digits, k=16))
-        file_path = f"/tmp/{random_name}"
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
+        invalid = validate_references(db, content_obj.tags, content_obj.characters, content_obj.authors, [content_obj.source_id])
+        if invalid is not None:
+            return invalid
 
         # Determine file type
         file_type = file.content_type
 
         # Validate file type
         if not is_file_valid(file_type):
-            # Clean up file
-            os.remove(file_path)
             return Response(content="Invalid file format", status_code=400)
 
-        converted_path = None
-        miniature_path = None
-
-        if is_video(file_type):
-            converted_path = video_utility.convert_video_to_mp4(f"/tmp/{random_name}")
-            miniature_path = video_utility.generate_video_miniature(converted_path, int(video_utility.get_video_length(converted_path) / 4), 480)
-
-        if is_image(file_type):
-            converted_path = convert_image_to_png(file_path)
-            miniature_path = video_utility.generate_image_miniature(converted_path, 480)
+        with staging.StagingArea() as area:
+            # Write file to disk, conversions and miniatures are written next to it
+            file_path = area.path("upload")
+            with open(file_path, "wb") as f:
+                shutil.copyfileobj(file.file, f)
 
-        if is_audio(file_type):
-            converted_path = convert_audio_to_wav(file_path)
+            converted_path = None
+            miniature_path = None
 
-        # Compute file hash
-        file_hash = compute_file_hash(file_path)
-        content_id = content_db.add_content(db, content_obj, file_hash, request.state.user.id)
+            if is_video(file_type):
+                converted_path = video_utility.convert_video_to_mp4(file_path)
+                miniature_path = video_utility.generate_video_miniature(converted_path, int(video_utility.get_video_length(converted_path) / 4), 480)
 
-        if content_id == -1:
-            return Response(status_code=409)
+            if is_image(file_type):
+                converted_path = convert_image_to_png(file_path)
+                miniature_path = video_utility.generate_image_miniature(converted_path, 480)
 
-        if is_video(file_type):
-            video_db.add_video(db, content_id, converted_path)
-            os.remove(file_path)
+            if is_audio(file_type):
+                converted_path = convert_audio_to_wav(file_path)
 
-        if is_image(file_type):
-            video_db.add_image(db, content_id, converted_path)
-            os.remove(file_path)
-
-        if is_audio(file_type):
-            video_db.add_audio(db, content_id, converted_path)
-            os.remove(file_path)
+            if is_video(file_type):
+                media_type = "video"
+            elif is_image(file_type):
+                media_type = "image"
+            else:
+                media_type = "audio"
 
-        if miniature_path is not None:
-            content_db.add_miniature(db, content_id, miniature_path)
-            os.remove(miniature_path)
+            # Compute file hash
+            file_hash = compute_file_hash(file_path)
+            content_id = content_db.ingest_content(db, content_obj, file_hash, request.state.user.id, media_type, converted_path, miniature_path)
 
-        os.remove(converted_path)
+        if content_id == -1:
+            return Response(status_code=409)
+        if content_id == -2:
+            return Response(status_code=500)
 
+        indexes.refresh_contents(db, [content_id])
         return Response(status_code=200)
     except Exception as e:
         logger.error("Error adding content")
@@ -361,13 +704,15 @@ async def get_video_endpoint(request: fastapi.Request, video_id: int):
     try:
         db = connect_db()
 
-        if not has_user_access(db, get_video_content_id(db, video_id), request.state.user.id):
+        access = get_media_access(db, "video", video_id, request.state.user.id)
+        if access is None:
             return Response(status_code=403)
+        history.record_access("content", request.state.user.id, [access[0]], ACCESS_VIEW)
 
         video = video_db.get_video(db, video_id)
         if video is None:
             return Response(status_code=404)
-        return StreamingResponse(async_bytes_it(video), media_type="video/mp4")
+        return StreamingResponse(async_bytes_it(video), media_type=access[1] or "video/mp4")
     except Exception as e:
         logger.error("Error getting video")
         logger.error(e)
@@ -382,13 +727,15 @@ async def get_image_endpoint(request: fastapi.Request, image_id: int):
     try:
         db = connect_db()
 
-        if not has_user_access(db, get_image_content_id(db, image_id), request.state.user.id):
+        access = get_media_access(db, "image", image_id, request.state.user.id)
+        if access is None:
             return Response(status_code=403)
+        history.record_access("content", request.state.user.id, [access[0]], ACCESS_VIEW)
 
         image = video_db.get_image(db, image_id)
         if image is None:
             return Response(status_code=404)
-        return StreamingResponse(async_bytes_it(image), media_type="image/png")
+        return StreamingResponse(async_bytes_it(image), media_type=access[1] or "image/png")
     except Exception as e:
         logger.error("Error getting image")
         logger.error(e)
@@ -403,13 +750,15 @@ async def get_audio_endpoint(request: fastapi.Request, audio_id: int):
     try:
         db = connect_db()
 
-        if not has_user_access(db, get_audio_content_id(db, audio_id), request.state.user.id):
+        access = get_media_access(db, "audio", audio_id, request.state.user.id)
+        if access is None:
             return Response(status_code=403)
+        history.record_access("content", request.state.user.id, [access[0]], ACCESS_VIEW)
 
         audio = video_db.get_audio(db, audio_id)
         if audio is None:
             return Response(status_code=404)
-        return StreamingResponse(async_bytes_it(audio), media_type="audio/wav")
+        return StreamingResponse(async_bytes_it(audio), media_type=access[1] or "audio/wav")
     except Exception as e:
         logger.error("Error getting audio")
         logger.error(e)
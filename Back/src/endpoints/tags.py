@@ -8,6 +8,10 @@ from db_management.connection import connect_db
 from utility.logging import logger
 import decorators.users_type as users_type
 import models.content as content_models
+import db_management.content as content_db
+import utility.cooccurrence as cooccurrence
+import utility.indexes as indexes
+import utility.tag_closure as tag_closure
 
 router = fastapi.APIRouter()
 
@@ -45,6 +49,28 @@ async def search_tags_endpoint(request: Request, tag_name: str = Query(...), max
         if db is not None:
             db.close()
 
+@router.get("/suggest", tags=["Tags management"])
+async def suggest_tags_endpoint(request: Request, tag_ids: list[int] = Query(...), max_results: int = Query(10)) -> content_models.TagSuggestionsModel:
+    db = None
+    try:
+        db = connect_db()
+        if not indexes.ensure_loaded(db):
+            return fastapi.responses.Response(status_code=500)
+
+        suggestions = cooccurrence.suggest(tag_ids, max_results)
+        result = {}
+        for taxonomy, scored in suggestions.items():
+            names = content_db.get_taxonomy_names(db, taxonomy, [item for item, _ in scored])
+            result[taxonomy] = [content_models.SuggestionModel(id=item, name=names[item], score=score) for item, score in scored if item in names]
+        return content_models.TagSuggestionsModel(**result)
+    except Exception as e:
+        logger.error("Error suggesting tags")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
 @router.get("", tags=["Tags management"])
 async def get_tags_endpoint(request: Request, page: int = Query(1), size: int = Query(10)) -> content_models.TagPageModel:
     db = None
@@ -124,6 +150,7 @@ async def delete_tags_endpoint(request: Request, tag_id: int):
         success = tags_db.delete_tag(db, tag_id)
         if not success:
             return fastapi.responses.Response(status_code=409)
+        tag_closure.load(db)
         return fastapi.responses.Response(status_code=200)
     except Exception as e:
         logger.error("Error deleting tag")
@@ -132,3 +159,100 @@ async def delete_tags_endpoint(request: Request, tag_id: int):
     finally:
         if db is not None:
             db.close()
+
+@router.get("/{tag_id}/relations", tags=["Tags management"])
+async def get_tag_relations_endpoint(request: Request, tag_id: int) -> content_models.TagRelationsModel:
+    db = None
+    try:
+        db = connect_db()
+        relations = tags_db.get_tag_relations(db, tag_id)
+        if relations is None:
+            return fastapi.responses.Response(status_code=500)
+        return relations
+    except Exception as e:
+        logger.error("Error getting tag relations")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.post("/{tag_id}/aliases", tags=["Tags management"])
+@users_type.admin_required
+async def post_tag_alias_endpoint(request: Request, tag_id: int, alias_name: str = fastapi.Query(...)):
+    db = None
+    try:
+        db = connect_db()
+        alias_name = alias_name.strip().lower().replace(" ", "_")
+        success = tags_db.add_tag_alias(db, alias_name, tag_id)
+        if not success:
+            return fastapi.responses.Response(status_code=409)
+        tag_closure.load(db)
+        return fastapi.responses.Response(status_code=200)
+    except Exception as e:
+        logger.error("Error adding tag alias")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.delete("/aliases/{alias_name}", tags=["Tags management"])
+@users_type.admin_required
+async def delete_tag_alias_endpoint(request: Request, alias_name: str):
+    db = None
+    try:
+        db = connect_db()
+        success = tags_db.delete_tag_alias(db, alias_name)
+        if not success:
+            return fastapi.responses.Response(status_code=404)
+        tag_closure.load(db)
+        return fastapi.responses.Response(status_code=200)
+    except Exception as e:
+        logger.error("Error deleting tag alias")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.post("/{tag_id}/implications", tags=["Tags management"])
+@users_type.admin_required
+async def post_tag_implication_endpoint(request: Request, tag_id: int, implied_tag_id: int = fastapi.Query(...)):
+    db = None
+    try:
+        db = connect_db()
+        if tag_id == implied_tag_id:
+            return fastapi.responses.Response(status_code=400)
+        updated = tags_db.add_tag_implication(db, tag_id, implied_tag_id)
+        if updated is None:
+            return fastapi.responses.Response(status_code=409)
+        tag_closure.load(db)
+        indexes.refresh_contents(db, updated)
+        return fastapi.responses.JSONResponse(status_code=200, content={"updated_contents": len(updated)})
+    except Exception as e:
+        logger.error("Error adding tag implication")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
+
+@router.delete("/{tag_id}/implications/{implied_tag_id}", tags=["Tags management"])
+@users_type.admin_required
+async def delete_tag_implication_endpoint(request: Request, tag_id: int, implied_tag_id: int):
+    db = None
+    try:
+        db = connect_db()
+        success = tags_db.delete_tag_implication(db, tag_id, implied_tag_id)
+        if not success:
+            return fastapi.responses.Response(status_code=404)
+        tag_closure.load(db)
+        return fastapi.responses.Response(status_code=200)
+    except Exception as e:
+        logger.error("Error deleting tag implication")
+        logger.error(e)
+        return fastapi.responses.Response(status_code=500)
+    finally:
+        if db is not None:
+            db.close()
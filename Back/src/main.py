@@ -15,11 +15,21 @@ import endpoints.characters as characters_endpoints
 import endpoints.authors as authors_endpoints
 import endpoints.content as content_endpoints
 import endpoints.albums as albums_endpoints
+import endpoints.admin as admin_endpoints
 import db_management.login as login_db
 from utility.logging import logger
 from db_management.connection import connect_db
 from db_management.login import check_session
 from db_management.setup import setup_admin_user
+from db_management.migrations import run_migrations
+import db_management.content as content_db
+import db_management.albums as albums_db
+import utility.scheduler as scheduler
+import utility.staging as staging
+import utility.history as history
+import utility.indexes as indexes
+import utility.tag_closure as tag_closure
+import utility.access as access
 from utility.users import get_session
 import fastapi.middleware.cors as cors
 
@@ -58,20 +68,58 @@ app.include_router(characters_endpoints.router, prefix="/v1/characters")
 app.include_router(authors_endpoints.router, prefix="/v1/authors")
 app.include_router(content_endpoints.router, prefix="/v1/content")
 app.include_router(albums_endpoints.router, prefix="/v1/albums")
+app.include_router(admin_endpoints.router, prefix="/v1/admin")
 
 db = None
 while db is None:
     try:
         db = connect_db()
+        if not run_migrations(db):
+            raise Exception("Database migrations failed")
         setup_admin_user(db)
     except Exception as e:
         logging.error("Error connecting to database")
         logging.error(e)
+        if db is not None:
+            db.close()
+            db = None
         time.sleep(5)
     finally:
         if db is not None:
             db.close()
 
+scheduler.register_job("popularity", 15 * 60, content_db.refresh_popularity)
+scheduler.register_job("trending", 5 * 60, content_db.refresh_trending)
+scheduler.register_job("content indexes", 60 * 60, indexes.rebuild)
+scheduler.register_job("tag closure", 5 * 60, tag_closure.load)
+# Also bounds how long a grant revoked through another instance stays visible here
+scheduler.register_job("guest access", 60, access.load)
+scheduler.register_job("album covers", 60, albums_db.refresh_album_covers)
+scheduler.register_job("usage counts", 24 * 60 * 60, content_db.reconcile_usage_counts)
+scheduler.register_job("history flush", history.HISTORY_FLUSH_INTERVAL, history.flush_history)
+scheduler.register_job("staging janitor", 15 * 60, staging.clean_stale_staging, needs_db=False)
+
+@app.on_event("startup")
+async def start_background_jobs():
+    scheduler.start_jobs()
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    scheduler.stop_jobs()
+    # Don't lose the accesses still sitting in the buffer
+    scheduler.run_job("history flush", history.flush_history)
+
+@app.middleware("http")
+async def upload_admission_middleware(request: fastapi.Request, call_next):
+    # Checked before the multipart body is read: by the time the upload endpoint runs, the whole file is already spooled to disk
+    if request.method == "POST" and request.url.path.rstrip("/") == "/v1/content":
+        length = request.headers.get("Content-Length")
+        if length is None or not length.isdigit():
+            return fastapi.responses.Response(content="Uploads must declare their Content-Length", status_code=411)
+        if not staging.has_room_for(int(length)):
+            return fastapi.responses.Response(content="Not enough staging space, try again later", status_code=507)
+    return await call_next(request)
+
 @app.middleware("http")
 async def login_middleware(request: fastapi.Request, call_next):
     if request.url.path.startswith("/v1/login") or request.url.path.startswith("/v1/register") or request.url.path.startswith("/docs") or request.url.path.startswith("/openapi.json"):
@@ -100,6 +148,8 @@ async def login_middleware(request: fastapi.Request, call_next):
         request.state.user = user
         request.state.session = session
         request.state.token = token
+        # Reload the guest access sets if a grant changed, one request at a time. Visibility stays correct (only slower) meanwhile
+        access.ensure_loaded(db)
         response = await call_next(request)
         return response
     except Exception as e:
@@ -6,10 +6,12 @@ from pydantic import BaseModel
 class SourceModel(BaseModel):
     id: int
     name: str
+    usage_count: Optional[int] = None
 
 class TagModel(BaseModel):
     id: int
     name: str
+    usage_count: Optional[int] = None
 
 class CompleteTagModel(TagModel):
     user_id: int
@@ -20,9 +22,21 @@ class TagPageModel(BaseModel):
     total_pages: int
     total_tags: int
 
+class MergeResultModel(BaseModel):
+    taxonomy: str
+    source_id: int
+    target_id: int
+    updated_contents: int
+
+class TagRelationsModel(BaseModel):
+    aliases: list[str]
+    implies: list[TagModel]  # Transitively, not only the direct implications
+    implied_by: list[TagModel]
+
 class CharacterModel(BaseModel):
     id: int
     name: str
+    usage_count: Optional[int] = None
 
 class CharacterPageModel(BaseModel):
     characters: list[CharacterModel]
@@ -32,6 +46,7 @@ class CharacterPageModel(BaseModel):
 class AuthorModel(BaseModel):
     id: int
     name: str
+    usage_count: Optional[int] = None
 
 class AuthorPageModel(BaseModel):
     authors: list[AuthorModel]
@@ -48,11 +63,24 @@ class ContentModel(BaseModel):
     authors: list[AuthorModel]
     is_private: bool
     url: str
+    is_favorite: Optional[bool] = None
+
+class FacetModel(BaseModel):
+    id: int
+    name: str
+    count: int
+
+class ContentFacetsModel(BaseModel):
+    tags: list[FacetModel]
+    characters: list[FacetModel]
+    authors: list[FacetModel]
 
 class ContentPageModel(BaseModel):
     contents: list[ContentModel]
     total_pages: int
     total_contents: int
+    facets: Optional[ContentFacetsModel] = None
+    seed: Optional[int] = None
 
 class ContentPostModel(BaseModel):
     title: str
@@ -72,14 +100,56 @@ class ContentUpdateModel(BaseModel):
     authors: Optional[list[int]]
     is_private: Optional[bool]
 
+# Taxonomies stored in association tables, an edit of any of them invalidates the in-memory content indexes
+ASSOCIATION_TAXONOMIES = ("tags", "characters", "authors")
+
+class ContentChangeSetModel(BaseModel):
+    content_id: int
+    fields: list[str] = []
+    added_tags: list[int] = []
+    removed_tags: list[int] = []
+    added_characters: list[int] = []
+    removed_characters: list[int] = []
+    added_authors: list[int] = []
+    removed_authors: list[int] = []
+
+    def associations_changed(self) -> bool:
+        return any(getattr(self, f"{change}_{taxonomy}") for change in ("added", "removed") for taxonomy in ASSOCIATION_TAXONOMIES)
+
+class ContentBulkEditModel(BaseModel):
+    content_ids: Optional[list[int]] = None
+    query: Optional[str] = None
+    add_tags: list[int] = []
+    remove_tags: list[int] = []
+    add_characters: list[int] = []
+    remove_characters: list[int] = []
+    add_authors: list[int] = []
+    remove_authors: list[int] = []
+    source_id: Optional[int] = None
+    is_private: Optional[bool] = None
+
+    def associations_changed(self) -> bool:
+        return any(getattr(self, f"{change}_{taxonomy}") for change in ("add", "remove") for taxonomy in ASSOCIATION_TAXONOMIES)
+
+class JobModel(BaseModel):
+    id: str
+    status: str
+    total: int
+    processed: int
+    changed: int
+
 class AlbumModel(BaseModel):
     id: int
     name: str
     description: str
+    match_count: Optional[int] = None
+    is_favorite: Optional[bool] = None
 
 class AlbumContentModel(BaseModel):
     info: AlbumModel
     contents: list[ContentModel]
+    total_pages: int = 0
+    total_contents: int = 0
 
 class AlbumPageModel(BaseModel):
     albums: list[AlbumModel]
@@ -97,6 +167,39 @@ class AlbumAddContentModel(BaseModel):
 class AlbumRemoveContentModel(BaseModel):
     content_id: list[int]
 
+class AlbumReorderContentModel(BaseModel):
+    content_id: list[int]
+
+class AlbumMembershipChangeModel(BaseModel):
+    changed: int
+
 class AlbumUpdateModel(BaseModel):
     name: Optional[str]
     description: Optional[str]
+
+class HistoryStatsModel(BaseModel):
+    recorded: int
+    coalesced: int
+    dropped: int
+    flushed: int
+    failed: int
+    pending: int
+    max_pending: int
+
+class FavoriteContentPageModel(BaseModel):
+    contents: list[ContentModel]
+    next_cursor: Optional[str] = None
+
+class FavoriteAlbumPageModel(BaseModel):
+    albums: list[AlbumModel]
+    next_cursor: Optional[str] = None
+
+class SuggestionModel(BaseModel):
+    id: int
+    name: str
+    score: float
+
+class TagSuggestionsModel(BaseModel):
+    tags: list[SuggestionModel]
+    characters: list[SuggestionModel]
+    authors: list[SuggestionModel]
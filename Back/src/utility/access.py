@@ -0,0 +1,73 @@
+import threading
+from typing import List, Union
+
+import db_management.access as access_db
+from utility.logging import logger
+
+# Precomputed guest access sets: {guest_id: sorted ids of every content granted to the guest, directly or through
+# an album}. content_db.visibility_clause turns them into a single `= ANY(...)` term, so a guest's pages and
+# searches are filtered by the database without per-item checks. Users without any grant are not in the map.
+# Granting, revoking or changing the contents of a granted album marks the sets stale: visibility then falls back
+# to evaluating the grants in SQL until they are reloaded, by the next request or by the periodic job.
+# Every invalidation bumps _generation, a load that overlapped one discards what it read and the sets stay stale.
+# Only one reload runs at a time, requests arriving meanwhile don't wait for it and use the SQL fallback.
+_lock = threading.Lock()
+_load_lock = threading.Lock()
+_loaded = False
+_generation = 0
+_allowed = {}
+_albums = set()
+
+def is_loaded() -> bool:
+    return _loaded
+
+def load(db) -> bool:
+    with _load_lock:
+        return _load(db)
+
+def _load(db) -> bool:
+    global _loaded, _allowed, _albums
+    with _lock:
+        generation = _generation
+    result = access_db.get_allowed_contents(db)
+    if result is None:
+        return False
+    with _lock:
+        if generation != _generation:
+            # A grant changed while reading, these sets may predate it
+            return False
+        _allowed, _albums = result
+        _loaded = True
+    logger.info(f"Guest access sets loaded for {len(_allowed)} guests")
+    return True
+
+def ensure_loaded(db) -> bool:
+    if _loaded:
+        return True
+    if not _load_lock.acquire(blocking=False):
+        return False
+    try:
+        return _loaded or _load(db)
+    finally:
+        _load_lock.release()
+
+def invalidate():
+    global _loaded, _generation
+    with _lock:
+        _loaded = False
+        _generation += 1
+
+def invalidate_albums(album_ids: List[int]):
+    """To call after the contents of these albums changed, only granted albums affect the sets"""
+    global _loaded, _generation
+    with _lock:
+        if any(album_id in _albums for album_id in album_ids):
+            _loaded = False
+            _generation += 1
+
+def get_allowed_contents(user_id: int) -> Union[List[int], None]:
+    """Granted content ids of the user, an empty list for users without grants, None when the sets are stale"""
+    with _lock:
+        if not _loaded:
+            return None
+        return _allowed.get(user_id, [])
@@ -0,0 +1,65 @@
+import re
+import time
+import zipfile
+from typing import Iterator
+
+import db_management.stream as stream_db
+from db_management.connection import connect_db
+from utility.logging import logger
+
+MEDIA_EXTENSIONS = {
+    "video/mp4": "mp4",
+    "image/png": "png",
+    "audio/wav": "wav",
+}
+
+# Already compressed formats are stored as is, deflating them again only burns CPU
+COMPRESSIBLE_MIME_TYPES = ("audio/wav",)
+
+class _ArchiveSink:
+    """Write-only, non seekable file object collecting what zipfile writes until it is drained.
+    Having no tell() makes zipfile use data descriptors, so entries never have to be rewritten"""
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+def archive_entry_name(index: int, title: str, mime: str) -> str:
+    title = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", title).strip() or "content"
+    return f"{index:04d} - {title[:100]}.{MEDIA_EXTENSIONS.get(mime, 'bin')}"
+
+def stream_media_archive(entries: list) -> Iterator[bytes]:
+    """Build a ZIP of the given media on the fly, `entries` being content_db.get_contents_media tuples.
+    Media are read from the database chunk by chunk, so memory stays bounded by the chunk size whatever the archive size"""
+    db = None
+    sink = _ArchiveSink()
+    try:
+        db = connect_db()
+        with zipfile.ZipFile(sink, mode="w", allowZip64=True) as archive:
+            for index, (_, title, media_type, media_id, media_size, media_mime) in enumerate(entries, start=1):
+                info = zipfile.ZipInfo(archive_entry_name(index, title, media_mime), date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED if media_mime in COMPRESSIBLE_MIME_TYPES else zipfile.ZIP_STORED
+                info.file_size = media_size or 0
+                with archive.open(info, mode="w", force_zip64=(media_size or 0) > zipfile.ZIP64_LIMIT // 2) as entry:
+                    for chunk in stream_db.iter_media_chunks(db, media_type, media_id):
+                        entry.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+        yield sink.drain()
+    except Exception as e:
+        # Headers are already sent at this point, the client gets a truncated archive
+        logger.error("Error streaming media archive")
+        logger.error(e)
+    finally:
+        if db is not None:
+            db.close()
@@ -0,0 +1,16 @@
+import hashlib
+
+import fastapi
+from fastapi.responses import Response
+
+# Thumbnails and album covers only change when their content does, the ETag lets clients revalidate for free
+IMAGE_CACHE_CONTROL = "private, max-age=86400, must-revalidate"
+
+def cached_image_response(request: fastapi.Request, data: bytes, media_type: str = "image/png") -> Response:
+    """Image response with caching headers, or an empty 304 if the client already has this exact image"""
+    data = bytes(data)
+    etag = f"\"{hashlib.md5(data).hexdigest()}\""
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=media_type, headers=headers)
@@ -0,0 +1,91 @@
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from utility.logging import logger
+
+# Sparse co-occurrence counts between a tag and every other tag, character and author it appears with.
+# Each content's associations are kept so a write can remove its old pairs before adding the new ones.
+# Loading and updates go through utility.indexes, shared with the other in-memory content indexes.
+RELATED_TAXONOMIES = ("tags", "characters", "authors")
+
+_lock = threading.Lock()
+_loaded = False
+_contents = {}
+_tag_counts = Counter()
+_pairs = {taxonomy: {} for taxonomy in RELATED_TAXONOMIES}
+
+def _apply(taxonomies: dict, sign: int):
+    tags = taxonomies.get("tags", [])
+    for tag in tags:
+        _tag_counts[tag] += sign
+        if _tag_counts[tag] <= 0:
+            del _tag_counts[tag]
+        for taxonomy in RELATED_TAXONOMIES:
+            related = _pairs[taxonomy].setdefault(tag, Counter())
+            for item in taxonomies.get(taxonomy, []):
+                if taxonomy == "tags" and item == tag:
+                    continue
+                related[item] += sign
+                if related[item] <= 0:
+                    del related[item]
+            if len(related) == 0:
+                del _pairs[taxonomy][tag]
+
+def _set_content(content_id: int, taxonomies: Dict[str, List[int]]):
+    previous = _contents.pop(content_id, None)
+    if previous is not None:
+        _apply(previous, -1)
+    if taxonomies is not None:
+        taxonomies = {taxonomy: sorted(set(taxonomies.get(taxonomy, []))) for taxonomy in RELATED_TAXONOMIES}
+        _contents[content_id] = taxonomies
+        _apply(taxonomies, 1)
+
+def is_loaded() -> bool:
+    return _loaded
+
+def load(features: dict):
+    """Replace the whole matrix, `features` being content_db.get_content_features of every content"""
+    global _loaded
+    with _lock:
+        _contents.clear()
+        _tag_counts.clear()
+        for taxonomy in RELATED_TAXONOMIES:
+            _pairs[taxonomy].clear()
+        for content_id, taxonomies in features.items():
+            _set_content(content_id, taxonomies)
+        _loaded = True
+    logger.info(f"Tag co-occurrence built over {len(features)} contents")
+
+def update_contents(features: dict, content_ids: list[int]):
+    """Apply fresh features of the given contents, contents missing from `features` no longer exist"""
+    with _lock:
+        if not _loaded:
+            return
+        for content_id in content_ids:
+            _set_content(content_id, features.get(content_id))
+
+def remove_contents(content_ids: list[int]):
+    with _lock:
+        for content_id in content_ids:
+            _set_content(content_id, None)
+
+def suggest(tag_ids: list[int], max_results: int) -> Dict[str, List[Tuple[int, float]]]:
+    """For each related taxonomy, the (id, score) pairs most often found with the selected tags, best first.
+    The score is the mean over the selected tags of P(item | tag), selected tags are never suggested back"""
+    tag_ids = list(dict.fromkeys(tag_ids))
+    suggestions = {}
+    with _lock:
+        for taxonomy in RELATED_TAXONOMIES:
+            scores = Counter()
+            for tag in tag_ids:
+                count = _tag_counts.get(tag, 0)
+                if count == 0:
+                    continue
+                for item, together in _pairs[taxonomy].get(tag, {}).items():
+                    scores[item] += together / count
+            if taxonomy == "tags":
+                for tag in tag_ids:
+                    scores.pop(tag, None)
+            suggestions[taxonomy] = [(item, score / len(tag_ids)) for item, score in scores.most_common(max_results)]
+    return suggestions
@@ -0,0 +1,86 @@
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Tuple
+
+import db_management.history as history_db
+from utility.logging import logger
+from utility.scheduler import run_job
+
+# Write-behind buffer for view/download history. Endpoints only touch memory, repeated accesses to the same
+# target by the same user are coalesced and the buffer is written in batches by the history flush job,
+# or as soon as it holds HISTORY_FLUSH_SIZE entries. Past HISTORY_MAX_PENDING entries new accesses are dropped
+# (and counted) rather than letting memory grow while the database is slow or down.
+HISTORY_FLUSH_INTERVAL = int(os.getenv("HISTORY_FLUSH_INTERVAL_SECONDS", "10"))
+HISTORY_FLUSH_SIZE = int(os.getenv("HISTORY_FLUSH_SIZE", "1000"))
+HISTORY_MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "20000"))
+
+_pending = {}
+_lock = threading.Lock()
+_flushing = threading.Event()
+_stats = {"recorded": 0, "coalesced": 0, "dropped": 0, "flushed": 0, "failed": 0}
+_dropped_since_flush = 0
+
+def record_access(kind: str, user_id: int, target_ids: list[int], access_type: int = history_db.ACCESS_VIEW):
+    """Queue an access of `user_id` to each target, `kind` being a history_db.HISTORY_TABLES key"""
+    global _dropped_since_flush
+    now = datetime.now(timezone.utc)
+    with _lock:
+        for target_id in target_ids:
+            key = (kind, user_id, target_id)
+            entry = _pending.get(key)
+            if entry is not None:
+                entry[0] = now
+                entry[1] = access_type
+                entry[2] += 1
+                _stats["coalesced"] += 1
+            elif len(_pending) >= HISTORY_MAX_PENDING:
+                _stats["dropped"] += 1
+                _dropped_since_flush += 1
+                continue
+            else:
+                _pending[key] = [now, access_type, 1]
+            _stats["recorded"] += 1
+        should_flush = len(_pending) >= HISTORY_FLUSH_SIZE and not _flushing.is_set()
+        if should_flush:
+            _flushing.set()
+    if should_flush:
+        threading.Thread(target=run_job, args=("history flush", flush_history), daemon=True).start()
+
+def _take_pending() -> Tuple[dict, int]:
+    """The pending accesses and how many were dropped since the last flush"""
+    global _pending, _dropped_since_flush
+    with _lock:
+        pending, dropped = _pending, _dropped_since_flush
+        _pending, _dropped_since_flush = {}, 0
+    return pending, dropped
+
+def flush_history(db) -> int:
+    """Write every pending access, returns how many rows were written"""
+    try:
+        pending, dropped = _take_pending()
+        if dropped > 0:
+            logger.warning(f"History buffer full, {dropped} accesses were dropped since the last flush")
+        rows = {kind: [] for kind in history_db.HISTORY_TABLES}
+        for (kind, user_id, target_id), (accessed_at, access_type, access_count) in pending.items():
+            rows[kind].append((user_id, target_id, accessed_at, access_type, access_count))
+
+        written = 0
+        for kind, kind_rows in rows.items():
+            if len(kind_rows) == 0:
+                continue
+            if history_db.save_history(db, kind, kind_rows):
+                written += len(kind_rows)
+            else:
+                logger.error(f"History flush failed, {len(kind_rows)} {kind} accesses lost")
+                with _lock:
+                    _stats["failed"] += len(kind_rows)
+        with _lock:
+            _stats["flushed"] += written
+        return written
+    finally:
+        _flushing.clear()
+
+def get_history_stats() -> dict:
+    with _lock:
+        return dict(_stats, pending=len(_pending), max_pending=HISTORY_MAX_PENDING)
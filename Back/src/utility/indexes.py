@@ -0,0 +1,66 @@
+import threading
+
+import db_management.content as content_db
+import utility.cooccurrence as cooccurrence
+import utility.similarity as similarity
+from utility.logging import logger
+
+# In-memory indexes derived from the content associations. They share one read of the database on
+# rebuild and on each content write, every index exposes is_loaded, load, update_contents and remove_contents.
+# Every write bumps _generation, a rebuild that overlapped one is skipped rather than installing features
+# read before that write. Rebuilds are single-flight so concurrent first requests share one full read.
+INDEXES = (similarity, cooccurrence)
+
+_lock = threading.Lock()
+_load_lock = threading.Lock()
+_generation = 0
+
+def _bump_generation():
+    global _generation
+    with _lock:
+        _generation += 1
+
+def _rebuild(db) -> bool:
+    with _lock:
+        generation = _generation
+    features = content_db.get_content_features(db)
+    if features is None:
+        return False
+    with _lock:
+        if generation != _generation:
+            logger.info("Contents changed while rebuilding the content indexes, keeping the current ones")
+            return False
+        for index in INDEXES:
+            index.load(features)
+    return True
+
+def rebuild(db) -> bool:
+    """Reload every index from the database, run at first use and periodically to catch missed writes"""
+    with _load_lock:
+        return _rebuild(db)
+
+def ensure_loaded(db) -> bool:
+    if all(index.is_loaded() for index in INDEXES):
+        return True
+    with _load_lock:
+        if all(index.is_loaded() for index in INDEXES):
+            return True
+        return _rebuild(db)
+
+def refresh_contents(db, content_ids: list[int]):
+    """Re-read the given contents after a write, contents that no longer exist are dropped"""
+    if len(content_ids) == 0:
+        return
+    _bump_generation()
+    if not any(index.is_loaded() for index in INDEXES):
+        return
+    features = content_db.get_content_features(db, content_ids)
+    if features is None:
+        return
+    for index in INDEXES:
+        index.update_contents(features, content_ids)
+
+def remove_contents(content_ids: list[int]):
+    _bump_generation()
+    for index in INDEXES:
+        index.remove_contents(content_ids)
@@ -0,0 +1,40 @@
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Union
+
+from models.content import JobModel
+
+# Progress of long running operations, kept in memory for the lifetime of the process.
+# Only the most recent jobs are kept so the registry can't grow forever.
+MAX_JOBS = 200
+
+_jobs = OrderedDict()
+_owners = {}
+_lock = threading.Lock()
+
+def create_job(user_id: int, total: int) -> JobModel:
+    job = JobModel(id=uuid.uuid4().hex, status="running", total=total, processed=0, changed=0)
+    with _lock:
+        _jobs[job.id] = job
+        _owners[job.id] = user_id
+        while len(_jobs) > MAX_JOBS:
+            old_id, _ = _jobs.popitem(last=False)
+            _owners.pop(old_id, None)
+    return job
+
+def update_job(job_id: str, **fields):
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        for key, value in fields.items():
+            setattr(job, key, value)
+
+def get_job(job_id: str, user_id: int) -> Union[JobModel, None]:
+    """A copy of the job state, None if it does not exist or belongs to someone else"""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None or _owners.get(job_id) != user_id:
+            return None
+        return job.model_copy()
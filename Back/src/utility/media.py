@@ -136,3 +136,34 @@ def generate_image_miniature(image_path: str, max_size: int = 480) -> str:
     )
 
     return f"{image_path}.png"
+
+def generate_mosaic(image_paths: list, output_path: str, size: int = 480) -> str:
+    """Square cover of `size` pixels: a single image cropped to fit, or a 2x2 grid of the first four images.
+    Two or three images are repeated to fill the grid"""
+    if len(image_paths) == 0:
+        raise ValueError("No image to build a mosaic from")
+    for image_path in image_paths:
+        if not os.path.exists(image_path):
+            raise FileNotFoundError(f"Image file {image_path} not found")
+
+    if len(image_paths) == 1:
+        subprocess.run(
+            [
+                "ffmpeg", "-y", "-i", image_paths[0], "-vf", f"scale={size}:{size}:force_original_aspect_ratio=increase,crop={size}:{size}", "-frames:v", "1", output_path
+            ],
+            check=True
+        )
+        return output_path
+
+    tiles = [image_paths[i % len(image_paths)] for i in range(4)]
+    tile = size // 2
+    inputs = []
+    for path in tiles:
+        inputs += ["-i", path]
+    filters = ";".join(f"[{i}:v]scale={tile}:{tile}:force_original_aspect_ratio=increase,crop={tile}:{tile}[t{i}]" for i in range(4))
+    filters += ";[t0][t1][t2][t3]xstack=inputs=4:layout=0_0|w0_0|0_h0|w0_h0[out]"
+    subprocess.run(
+        ["ffmpeg", "-y"] + inputs + ["-filter_complex", filters, "-map", "[out]", "-frames:v", "1", output_path],
+        check=True
+    )
+    return output_path
@@ -0,0 +1,148 @@
+import re
+from typing import List, Union
+
+# Query syntax, e.g. `tag:a (char:b | char:c) -author:d source:"some site"`
+#   - terms are `field:value`, values may be double-quoted to keep spaces
+#   - `media:video`, `media:image` or `media:audio` filters on the stored media kind
+#   - juxtaposition means AND, `|` means OR, a leading `-` negates, parentheses group
+FIELDS = {
+    "tag": "tags",
+    "tags": "tags",
+    "char": "characters",
+    "character": "characters",
+    "characters": "characters",
+    "author": "authors",
+    "authors": "authors",
+    "source": "sources",
+    "media": "media",
+}
+
+TOKEN_REGEX = re.compile(r'\s*(?:(?P<open>\()|(?P<close>\))|(?P<or>\|)|(?P<not>-)|(?P<term>(?P<field>[a-z_]+):(?:"(?P<quoted>[^"]*)"|(?P<value>[^\s()|"]+))))', re.IGNORECASE)
+
+class QuerySyntaxError(ValueError):
+    pass
+
+class Term:
+    def __init__(self, field: str, value: str):
+        self.field = field
+        self.value = value
+
+    def __repr__(self):
+        return f"Term({self.field}:{self.value})"
+
+class And:
+    def __init__(self, children: List["Node"]):
+        self.children = children
+
+    def __repr__(self):
+        return f"And({self.children})"
+
+class Or:
+    def __init__(self, children: List["Node"]):
+        self.children = children
+
+    def __repr__(self):
+        return f"Or({self.children})"
+
+class Not:
+    def __init__(self, child: "Node"):
+        self.child = child
+
+    def __repr__(self):
+        return f"Not({self.child})"
+
+Node = Union[Term, And, Or, Not]
+
+def normalize_value(field: str, value: str) -> str:
+    """Apply the same normalization as the tags/characters/authors endpoints, sources are stored as typed"""
+    if field == "sources":
+        return value.strip()
+    return value.strip().lower().replace(" ", "_")
+
+def tokenize(query: str) -> list:
+    tokens = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = TOKEN_REGEX.match(query, position)
+        if match is None or match.end() == position:
+            raise QuerySyntaxError(f"Unexpected input at position {position}: {query[position:position + 20]!r}")
+        if match.group("term") is not None:
+            field = match.group("field").lower()
+            if field not in FIELDS:
+                raise QuerySyntaxError(f"Unknown field {field!r}")
+            value = match.group("quoted") if match.group("quoted") is not None else match.group("value")
+            field = FIELDS[field]
+            tokens.append(("term", Term(field, normalize_value(field, value))))
+        else:
+            tokens.append((match.lastgroup, None))
+        position = match.end()
+    return tokens
+
+class _Parser:
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self) -> Union[str, None]:
+        if self.position >= len(self.tokens):
+            return None
+        return self.tokens[self.position][0]
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse_or(self) -> Node:
+        children = [self.parse_and()]
+        while self.peek() == "or":
+            self.take()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self) -> Node:
+        children = []
+        while self.peek() not in (None, "or", "close"):
+            children.append(self.parse_unary())
+        if len(children) == 0:
+            raise QuerySyntaxError("Expected a term")
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_unary(self) -> Node:
+        kind, value = self.take()
+        if kind == "not":
+            if self.peek() in (None, "or", "close"):
+                raise QuerySyntaxError("Expected a term after '-'")
+            return Not(self.parse_unary())
+        if kind == "open":
+            node = self.parse_or()
+            if self.peek() != "close":
+                raise QuerySyntaxError("Missing closing parenthesis")
+            self.take()
+            return node
+        if kind == "term":
+            return value
+        raise QuerySyntaxError(f"Unexpected {kind!r}")
+
+def parse_query(query: str) -> Union[Node, None]:
+    """Parse a search query into an AST, returns None for an empty query"""
+    tokens = tokenize(query)
+    if len(tokens) == 0:
+        return None
+    parser = _Parser(tokens)
+    node = parser.parse_or()
+    if parser.position != len(tokens):
+        raise QuerySyntaxError("Unbalanced closing parenthesis")
+    return node
+
+def query_terms(node: Node) -> List[Term]:
+    """Every term of the AST, in order"""
+    if isinstance(node, Term):
+        return [node]
+    if isinstance(node, Not):
+        return query_terms(node.child)
+    terms = []
+    for child in node.children:
+        terms += query_terms(child)
+    return terms
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Union
+
+import numpy as np
+
+import db_management.history as history_db
+import utility.indexes as indexes
+import utility.similarity as similarity
+
+# Per-user recommendations scored against the similarity feature matrix. A user's profile is the sum of the
+# feature vectors of what they liked and viewed, weighted by history_db.get_user_interactions, and every content
+# is scored at once by a sparse matrix-vector product. Results are cached per user and only recomputed once
+# their interactions moved by more than RECOMMENDATIONS_DRIFT, or after RECOMMENDATIONS_TTL seconds.
+RECOMMENDATIONS_HALF_LIFE_DAYS = float(os.getenv("RECOMMENDATIONS_HALF_LIFE_DAYS", "30"))
+RECOMMENDATIONS_TTL = int(os.getenv("RECOMMENDATIONS_TTL_SECONDS", str(60 * 60)))
+RECOMMENDATIONS_DRIFT = 0.1
+RECOMMENDATIONS_SIZE = 200
+MAX_CACHED_USERS = 5000
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+class _CachedRecommendations:
+    def __init__(self, interactions: set, content_ids: List[int]):
+        self.interactions = interactions
+        self.content_ids = content_ids
+        self.created_at = time.monotonic()
+
+def _has_drifted(cached: _CachedRecommendations, interactions: set) -> bool:
+    if time.monotonic() - cached.created_at > RECOMMENDATIONS_TTL:
+        return True
+    changed = len(cached.interactions ^ interactions)
+    return changed > max(2, RECOMMENDATIONS_DRIFT * len(cached.interactions))
+
+def score_contents(interactions: dict, max_results: int) -> List[int]:
+    """Best scoring contents for the given {content_id: weight} interactions, the interacted contents excluded"""
+    matrix = similarity.get_matrix()
+    if len(matrix.content_ids) == 0 or len(interactions) == 0:
+        return []
+
+    interacted = np.fromiter(interactions.keys(), dtype=np.int64, count=len(interactions))
+    weights = np.fromiter(interactions.values(), dtype=np.float64, count=len(interactions))
+    positions = np.searchsorted(matrix.content_ids, interacted)
+    known = (positions < len(matrix.content_ids)) & (matrix.content_ids[np.minimum(positions, len(matrix.content_ids) - 1)] == interacted)
+    rows, weights = positions[known], weights[known]
+    if len(rows) == 0:
+        return []
+
+    # Profile: weighted sum of the interacted rows, gathered straight from the CSR arrays
+    lengths = matrix.indptr[rows + 1] - matrix.indptr[rows]
+    starts = np.repeat(matrix.indptr[rows] - np.cumsum(lengths) + lengths, lengths)
+    gathered = matrix.indices[starts + np.arange(lengths.sum())]
+    profile = np.bincount(gathered, weights=np.repeat(weights, lengths), minlength=len(matrix.vocabulary)) * matrix.idf
+
+    # Cosine-like score of every content, long feature lists don't win just by being long
+    scores = np.bincount(matrix.rows, weights=profile[matrix.indices] * matrix.idf[matrix.indices], minlength=len(matrix.content_ids))
+    scores /= np.sqrt(np.maximum(np.diff(matrix.indptr), 1))
+    scores[rows] = 0
+
+    count = min(max_results, len(scores))
+    best = np.argpartition(-scores, count - 1)[:count]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [int(matrix.content_ids[index]) for index in best if scores[index] > 0]
+
+def get_recommendations(db, user_id: int) -> Union[List[int], None]:
+    """Recommended content ids for the user, best first, visibility not checked. None on error"""
+    interactions = history_db.get_user_interactions(db, user_id, RECOMMENDATIONS_HALF_LIFE_DAYS)
+    if interactions is None:
+        return None
+
+    with _lock:
+        cached = _cache.get(user_id)
+        if cached is not None and not _has_drifted(cached, set(interactions)):
+            _cache.move_to_end(user_id)
+            return cached.content_ids
+
+    if not indexes.ensure_loaded(db):
+        return None
+    content_ids = score_contents(interactions, RECOMMENDATIONS_SIZE)
+
+    with _lock:
+        _cache[user_id] = _CachedRecommendations(set(interactions), content_ids)
+        _cache.move_to_end(user_id)
+        while len(_cache) > MAX_CACHED_USERS:
+            _cache.popitem(last=False)
+    return content_ids
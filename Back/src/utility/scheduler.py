@@ -0,0 +1,47 @@
+import asyncio
+from typing import Callable
+
+from db_management.connection import connect_db
+from utility.logging import logger
+
+# Periodic background jobs, started once the API is up. Each job gets its own database connection
+# and runs in a worker thread so psycopg2 calls never block the event loop.
+jobs = []
+tasks = []
+
+def register_job(name: str, interval: int, func: Callable, needs_db: bool = True):
+    """Run `func(db)` (or `func()` if needs_db is False) every `interval` seconds"""
+    jobs.append((name, interval, func, needs_db))
+
+def run_job(name: str, func: Callable, needs_db: bool = True):
+    db = None
+    try:
+        if not needs_db:
+            func()
+            return
+        db = connect_db()
+        if db is None:
+            logger.error(f"Skipping job {name}, no database connection")
+            return
+        func(db)
+    except Exception as e:
+        logger.error(f"Error running job {name}")
+        logger.error(e)
+    finally:
+        if db is not None:
+            db.close()
+
+async def _job_loop(name: str, interval: int, func: Callable, needs_db: bool):
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(run_job, name, func, needs_db)
+
+def start_jobs():
+    for name, interval, func, needs_db in jobs:
+        logger.info(f"Starting background job {name} (every {interval}s)")
+        tasks.append(asyncio.create_task(_job_loop(name, interval, func, needs_db)))
+
+def stop_jobs():
+    for task in tasks:
+        task.cancel()
+    tasks.clear()
@@ -0,0 +1,170 @@
+import threading
+from collections import Counter
+from typing import List, Tuple
+
+import numpy as np
+
+from utility.logging import logger
+
+# In-memory "more like this" index. Every content is a set of features (its tags, characters and authors),
+# summarized by a MinHash signature. Signatures are cut in LSH bands so contents sharing a band become
+# candidates, and candidates are then scored exactly with an IDF weighted Jaccard similarity.
+# Loading and updates go through utility.indexes, shared with the other in-memory content indexes.
+MINHASH_BANDS = 16
+MINHASH_ROWS = 4
+MINHASH_SIZE = MINHASH_BANDS * MINHASH_ROWS
+MINHASH_PRIME = (1 << 31) - 1
+
+# Taxonomy ids are spread over one feature space, feature = id * len(FEATURE_OFFSETS) + offset
+FEATURE_OFFSETS = {"tags": 0, "characters": 1, "authors": 2}
+
+_random = np.random.default_rng(7_061_227)
+_hash_a = _random.integers(1, MINHASH_PRIME, size=MINHASH_SIZE, dtype=np.int64)
+_hash_b = _random.integers(0, MINHASH_PRIME, size=MINHASH_SIZE, dtype=np.int64)
+
+_lock = threading.RLock()
+_loaded = False
+_features = {}
+_signatures = {}
+_buckets = [{} for _ in range(MINHASH_BANDS)]
+_document_frequency = Counter()
+_matrix = None
+
+def to_features(taxonomies: dict) -> np.ndarray:
+    """Feature array of a content, from its {taxonomy: [ids]}"""
+    features = [item * len(FEATURE_OFFSETS) + offset for taxonomy, offset in FEATURE_OFFSETS.items() for item in taxonomies.get(taxonomy, [])]
+    return np.unique(np.array(features, dtype=np.int64))
+
+def minhash(features: np.ndarray) -> np.ndarray:
+    return ((_hash_a[:, None] * (features[None, :] % MINHASH_PRIME) + _hash_b[:, None]) % MINHASH_PRIME).min(axis=1)
+
+def _band_keys(signature: np.ndarray) -> List[bytes]:
+    return [band.tobytes() for band in signature.reshape(MINHASH_BANDS, MINHASH_ROWS)]
+
+def _unindex(content_id: int):
+    global _matrix
+    _matrix = None
+    features = _features.pop(content_id, None)
+    if features is None:
+        return
+    _document_frequency.subtract(features.tolist())
+    signature = _signatures.pop(content_id, None)
+    if signature is None:
+        return
+    for band, key in enumerate(_band_keys(signature)):
+        bucket = _buckets[band].get(key)
+        if bucket is not None:
+            bucket.discard(content_id)
+            if len(bucket) == 0:
+                del _buckets[band][key]
+
+def _index(content_id: int, taxonomies: dict):
+    _unindex(content_id)
+    features = to_features(taxonomies)
+    _features[content_id] = features
+    _document_frequency.update(features.tolist())
+    if len(features) == 0:
+        return
+    signature = minhash(features)
+    _signatures[content_id] = signature
+    for band, key in enumerate(_band_keys(signature)):
+        _buckets[band].setdefault(key, set()).add(content_id)
+
+def is_loaded() -> bool:
+    return _loaded
+
+def load(features: dict):
+    """Replace the whole index, `features` being content_db.get_content_features of every content"""
+    global _loaded, _buckets, _matrix
+    with _lock:
+        _features.clear()
+        _signatures.clear()
+        _document_frequency.clear()
+        _buckets = [{} for _ in range(MINHASH_BANDS)]
+        _matrix = None
+        for content_id, taxonomies in features.items():
+            _index(content_id, taxonomies)
+        _loaded = True
+    logger.info(f"Similarity index built over {len(features)} contents")
+
+def update_contents(features: dict, content_ids: list[int]):
+    """Apply fresh features of the given contents, contents missing from `features` no longer exist"""
+    with _lock:
+        if not _loaded:
+            return
+        for content_id in content_ids:
+            if content_id in features:
+                _index(content_id, features[content_id])
+            else:
+                _unindex(content_id)
+
+def remove_contents(content_ids: list[int]):
+    with _lock:
+        for content_id in content_ids:
+            _unindex(content_id)
+
+def _weights(features: np.ndarray, total: int) -> np.ndarray:
+    """IDF weight of each feature, rare tags say more about a content than ubiquitous ones"""
+    frequencies = np.fromiter((_document_frequency.get(feature, 0) for feature in features.tolist()), dtype=np.float64, count=len(features))
+    return np.log1p(total / np.maximum(frequencies, 1))
+
+def find_similar(content_id: int, max_results: int) -> List[Tuple[int, float]]:
+    """(content_id, score) of the contents most similar to `content_id`, best first. Visibility is not checked here"""
+    with _lock:
+        features = _features.get(content_id)
+        signature = _signatures.get(content_id)
+        if features is None or signature is None:
+            return []
+
+        candidates = set()
+        for band, key in enumerate(_band_keys(signature)):
+            candidates |= _buckets[band].get(key, set())
+        candidates.discard(content_id)
+        if len(candidates) == 0:
+            return []
+
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        candidate_features = [_features[candidate] for candidate in candidates.tolist()]
+        flat = np.concatenate(candidate_features)
+        total = max(len(_features), 1)
+        flat_weights = _weights(flat, total)
+        query_weight = _weights(features, total).sum()
+
+    # Exact IDF weighted Jaccard of every candidate at once over the concatenated feature arrays
+    lengths = np.fromiter((len(item) for item in candidate_features), dtype=np.int64, count=len(candidate_features))
+    owners = np.repeat(np.arange(len(candidates)), lengths)
+    shared = np.isin(flat, features)
+
+    intersection = np.bincount(owners[shared], weights=flat_weights[shared], minlength=len(candidates))
+    candidate_total = np.bincount(owners, weights=flat_weights, minlength=len(candidates))
+    union = query_weight + candidate_total - intersection
+    scores = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+    best = np.argsort(-scores, kind="stable")[:max_results]
+    return [(int(candidates[index]), float(scores[index])) for index in best if scores[index] > 0]
+
+class FeatureMatrix:
+    """CSR content x feature matrix of the whole index: the features of content_ids[row] are
+    vocabulary[indices[indptr[row]:indptr[row + 1]]], `rows` giving the row of every stored feature"""
+    def __init__(self, content_ids: np.ndarray, indptr: np.ndarray, indices: np.ndarray, vocabulary: np.ndarray, idf: np.ndarray):
+        self.content_ids = content_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.rows = np.repeat(np.arange(len(content_ids)), np.diff(indptr))
+
+def get_matrix() -> FeatureMatrix:
+    """The feature matrix, rebuilt on demand after the index changed"""
+    global _matrix
+    with _lock:
+        if _matrix is not None:
+            return _matrix
+        content_ids = np.fromiter(sorted(_features), dtype=np.int64, count=len(_features))
+        features = [_features[content_id] for content_id in content_ids.tolist()]
+        lengths = np.fromiter((len(item) for item in features), dtype=np.int64, count=len(features))
+        flat = np.concatenate(features) if len(features) > 0 else np.zeros(0, dtype=np.int64)
+        vocabulary = np.unique(flat)
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        _matrix = FeatureMatrix(content_ids, indptr, np.searchsorted(vocabulary, flat), vocabulary, _weights(vocabulary, max(len(_features), 1)))
+        return _matrix
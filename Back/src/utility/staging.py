@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import time
+
+from utility.logging import logger
+
+# Uploads and intermediate ffmpeg outputs are written under STAGING_DIR, ideally a tmpfs or a fast local disk.
+# Every request works in its own subdirectory, removed as a whole once the request is over.
+STAGING_DIR = os.getenv("STAGING_DIR", os.path.join(tempfile.gettempdir(), "nyapix-staging"))
+# Uploads are refused while accepting them would leave less than this free on the staging filesystem
+STAGING_MIN_FREE_MB = int(os.getenv("STAGING_MIN_FREE_MB", "1024"))
+# Anything older than this is considered left behind by a crashed request
+STAGING_MAX_AGE = int(os.getenv("STAGING_MAX_AGE_SECONDS", str(6 * 60 * 60)))
+
+# A conversion writes a copy of the upload next to it, plus a miniature
+STAGING_SPACE_FACTOR = 3
+
+class StagingArea:
+    """Per-request staging directory, everything created in it is removed on exit"""
+    def __init__(self, prefix: str = "request-"):
+        self.prefix = prefix
+        self.directory = None
+
+    def __enter__(self) -> "StagingArea":
+        os.makedirs(STAGING_DIR, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix=self.prefix, dir=STAGING_DIR)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+def has_room_for(upload_size: int) -> bool:
+    """Whether staging an upload of `upload_size` bytes, and its conversions, keeps the minimum free space.
+    The multipart parser first spools the whole upload to the system temp dir, that copy is counted as well"""
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    needed = {}
+    for directory, size in ((STAGING_DIR, upload_size * STAGING_SPACE_FACTOR), (tempfile.gettempdir(), upload_size)):
+        device = os.stat(directory).st_dev
+        path, total = needed.get(device, (directory, 0))
+        needed[device] = (path, total + size)
+    return all(shutil.disk_usage(path).free - total >= STAGING_MIN_FREE_MB * 1024 * 1024 for path, total in needed.values())
+
+def clean_stale_staging(max_age: int = STAGING_MAX_AGE) -> int:
+    """Remove staging entries older than `max_age` seconds, returns how many were removed"""
+    if not os.path.isdir(STAGING_DIR):
+        return 0
+    removed = 0
+    limit = time.time() - max_age
+    for entry in os.scandir(STAGING_DIR):
+        try:
+            if entry.stat(follow_symlinks=False).st_mtime >= limit:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+            removed += 1
+        except FileNotFoundError:
+            continue
+    if removed > 0:
+        logger.info(f"Removed {removed} stale staging entries")
+    return removed
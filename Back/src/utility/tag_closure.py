@@ -0,0 +1,47 @@
+import threading
+from typing import Dict, List, Union
+
+import db_management.tags as tags_db
+from utility.logging import logger
+
+# In-memory copy of nyapixtag_closure and of the tag aliases, so expanding a searched tag to every tag
+# implying it, or resolving an alias, is a dictionary lookup. The database stays the reference: implied tags
+# are applied there at write time, this cache only serves searches. It is reloaded after every alias or
+# implication change made by this instance and periodically to pick up the changes of the others.
+_lock = threading.Lock()
+_loaded = False
+_implying = {}
+_aliases = {}
+
+def is_loaded() -> bool:
+    return _loaded
+
+def load(db) -> bool:
+    global _loaded, _implying, _aliases
+    closure = tags_db.get_tag_closure(db)
+    aliases = tags_db.get_tag_aliases(db)
+    if closure is None or aliases is None:
+        return False
+    implying = {}
+    for tag_id, implied_tag_id in closure:
+        implying.setdefault(implied_tag_id, set()).add(tag_id)
+    with _lock:
+        _implying = {tag_id: sorted(tags) for tag_id, tags in implying.items()}
+        _aliases = aliases
+        _loaded = True
+    logger.info(f"Tag closure loaded: {len(closure)} implications, {len(aliases)} aliases")
+    return True
+
+def ensure_loaded(db) -> bool:
+    if _loaded:
+        return True
+    return load(db)
+
+def expand(tag_ids: List[int]) -> Dict[int, List[int]]:
+    """{tag_id: [tag_id and every tag implying it]}, content having any of them counts as having the tag"""
+    with _lock:
+        return {tag_id: [tag_id] + _implying.get(tag_id, []) for tag_id in tag_ids}
+
+def resolve_alias(name: str) -> Union[int, None]:
+    with _lock:
+        return _aliases.get(name)
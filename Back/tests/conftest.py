@@ -0,0 +1,4 @@
+import os
+
+# utility.logging opens logs/nyapix.log relative to the working directory as soon as it is imported
+os.makedirs("logs", exist_ok=True)
@@ -0,0 +1,37 @@
+import threading
+
+import utility.access as access
+
+def test_only_one_request_reloads_the_access_sets(monkeypatch):
+    reading, release = threading.Event(), threading.Event()
+    calls = []
+
+    def read_grants(db):
+        calls.append(db)
+        reading.set()
+        release.wait(5)
+        return {7: [1, 2]}, set()
+    monkeypatch.setattr(access.access_db, "get_allowed_contents", read_grants)
+    access.invalidate()
+
+    loader = threading.Thread(target=access.ensure_loaded, args=("first",))
+    loader.start()
+    reading.wait(5)
+    # Doesn't wait for nor duplicate the reload in flight, visibility uses the SQL fallback
+    assert not access.ensure_loaded("second")
+    assert access.get_allowed_contents(7) is None
+    release.set()
+    loader.join(5)
+
+    assert calls == ["first"]
+    assert access.get_allowed_contents(7) == [1, 2]
+
+def test_revoke_during_reload_keeps_the_sets_stale(monkeypatch):
+    def read_grants(db):
+        access.invalidate()
+        return {7: [1, 2]}, set()
+    monkeypatch.setattr(access.access_db, "get_allowed_contents", read_grants)
+    access.invalidate()
+
+    assert not access.load(None)
+    assert access.get_allowed_contents(7) is None
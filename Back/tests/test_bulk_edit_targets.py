@@ -0,0 +1,34 @@
+from db_management.content import get_owned_matching_content_ids
+from utility.query import parse_query
+
+class RecordingCursor:
+    def __init__(self, executed: list):
+        self.executed = executed
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        # Name resolution: every looked up name exists, with id 1
+        self.rows = [(name, 1) for name in params[0]] if "= ANY(%s)" in sql and "nyapixcontent c" not in sql else []
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+class RecordingDb:
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        return RecordingCursor(self.executed)
+
+def test_or_query_only_selects_owned_contents():
+    db = RecordingDb()
+    get_owned_matching_content_ids(db, 42, query=parse_query("tag:x | character:y"))
+
+    sql, params = db.executed[-1]
+    assert sql.startswith("SELECT c.id FROM nyapixcontent c WHERE c.user_id = %s AND (")
+    assert sql.endswith(") ORDER BY c.id")
+    assert params[0] == 42
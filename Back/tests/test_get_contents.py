@@ -0,0 +1,34 @@
+import datetime
+
+from db_management.content import get_contents
+from db_management.favorites import get_favorite_contents
+
+class FailingCursor:
+    """Answers the page query with one content, fails every hydration query"""
+    def __init__(self):
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        if "nyapixuser_content_favorites f" in sql:
+            self.rows = [(5, datetime.datetime(2024, 1, 1))]
+            return
+        raise RuntimeError("connection lost")
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+class FailingDb:
+    def cursor(self):
+        return FailingCursor()
+
+def test_get_contents_returns_none_on_error():
+    assert get_contents(FailingDb(), [5], 42) is None
+
+def test_get_contents_without_ids_skips_the_database():
+    assert get_contents(FailingDb(), [], 42) == []
+
+def test_page_fails_when_hydration_fails():
+    assert get_favorite_contents(FailingDb(), 42, 10) is None
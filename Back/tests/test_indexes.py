@@ -0,0 +1,21 @@
+import utility.cooccurrence as cooccurrence
+import utility.indexes as indexes
+
+FEATURES = {1: {"tags": [1, 2], "characters": [], "authors": []}, 2: {"tags": [2], "characters": [], "authors": []}}
+
+def test_rebuild_is_skipped_when_a_write_overlaps_it(monkeypatch):
+    def read_features(db, content_ids=None):
+        # A content is deleted while the full read is in flight
+        indexes.remove_contents([2])
+        return FEATURES
+    monkeypatch.setattr(indexes.content_db, "get_content_features", read_features)
+    monkeypatch.setattr(cooccurrence, "_loaded", False)
+
+    assert not indexes.rebuild(None)
+    assert not cooccurrence.is_loaded()
+
+def test_rebuild_loads_when_nothing_changed(monkeypatch):
+    monkeypatch.setattr(indexes.content_db, "get_content_features", lambda db, content_ids=None: FEATURES)
+
+    assert indexes.ensure_loaded(None)
+    assert cooccurrence.suggest([1], 5)["tags"] == [(2, 1.0)]
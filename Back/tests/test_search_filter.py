@@ -0,0 +1,12 @@
+from db_management.content import build_search_filter, compile_query, visibility_clause
+from utility.query import parse_query
+
+def test_or_query_stays_inside_visibility():
+    query = parse_query("tag:x | character:y")
+    compiled = compile_query(query, {("tags", "x"): 1, ("characters", "y"): 2})
+    where, params = build_search_filter({}, {}, 42, query=compiled)
+
+    visibility, visibility_params = visibility_clause(42)
+    assert where == f"{visibility} AND ({compiled[0]})"
+    assert compiled[0].startswith("(") and compiled[0].endswith(")")
+    assert params == visibility_params + [[1], [2]]